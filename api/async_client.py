@@ -0,0 +1,475 @@
+from . import logger
+from .client import ConfluenceAPIClient
+from .response_cache import ResponseCache
+from .multipart import MultipartStream
+from config.config_types import ConfluenceInstance
+import aiohttp
+import asyncio
+import base64
+import json
+import multidict
+import os
+import requests
+import tempfile
+import time
+import urllib.parse
+from pathlib import Path
+
+class AsyncResponse:
+    # Body is read eagerly inside the request context, so callers can use it like a requests.Response
+    def __init__(self, status_code: int, headers: multidict.CIMultiDict, content: bytes):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    @property
+    def text(self) -> str:
+        return self.content.decode('utf-8', errors='replace')
+
+    def json(self):
+        return json.loads(self.content)
+
+class AsyncConfluenceAPIClient(ConfluenceAPIClient):
+    """Asyncio twin of ConfluenceAPIClient, every endpoint helper is a coroutine.
+
+    All requests share one aiohttp session and a semaphore of ``instance_config.max_in_flight_requests``.
+    Pass ``stats_client`` to record the requests in the metrics of an existing client, e.g. the one shown in the StatsTable.
+    """
+    def __init__(self, instance_config: ConfluenceInstance, api_config: dict, stats_client: ConfluenceAPIClient = None):
+        super().__init__(instance_config=instance_config, api_config=api_config)
+        self.session = None
+        self.stats_client = stats_client
+        if stats_client is not None:
+            self.metrics = stats_client.metrics
+        self.max_in_flight_requests = instance_config.max_in_flight_requests
+        self.semaphore = None
+        self.in_flight_requests = {}
+
+    @classmethod
+    def from_client(cls, client: ConfluenceAPIClient) -> 'AsyncConfluenceAPIClient':
+        # Reuse instance, endpoints and cookies of an already logged in client
+        async_client = cls(instance_config=client.instance_config, api_config=client.api_config, stats_client=client)
+        async_client.cookies = [{'name': cookie.name, 'value': cookie.value, 'domain': cookie.domain, 'path': cookie.path, 'secure': cookie.secure} for cookie in client.session.cookies]
+        async_client.current_user_memberships = client.current_user_memberships
+        async_client.response_cache = client.response_cache
+        async_client.single_flight = client.single_flight
+        return async_client
+
+    async def __aenter__(self):
+        await self.initialize_session(cookies=getattr(self, 'cookies', []))
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def initialize_session(self, cookies: list = []):
+        headers = {'X-Atlassian-Token': 'no-check', 'Accept': 'application/json'}
+        auth = None
+
+        auth_type = self.instance_config.credentials.rest_auth_type
+        confluence_type = self.instance_config.confluence_type
+        email = self.instance_config.credentials.email
+        api_token = self.instance_config.credentials.api_token
+        password = self.instance_config.credentials.password
+        cookie_jar = aiohttp.CookieJar(unsafe=True)
+
+        if auth_type == 'basic_auth':
+            auth = aiohttp.BasicAuth(email, api_token if confluence_type == "cloud" else password)
+            logger.debug(f"{self.logs_prefix} Using Basic Authentication username: {email}")
+        elif auth_type == 'cookies_auth':
+            cookie_jar.update_cookies({cookie.get('name', ''): cookie.get('value', '') for cookie in cookies})
+            logger.debug(f"{self.logs_prefix} Using {len(cookies)} Cookies from Browser to async session.")
+        elif auth_type == 'header_auth':
+            if confluence_type == "cloud":
+                credentials = f"{email}:{api_token}"
+                headers['Authorization'] = f"Basic {base64.b64encode(credentials.encode()).decode()}"
+            else:
+                headers['Authorization'] = f"Bearer {api_token}"
+            logger.debug(f"{self.logs_prefix} Using Authorization header: {'*' * len(headers['Authorization'])}")
+        else:
+            raise ValueError(f"{self.logs_prefix} Invalid Authentication Method: {auth_type}")
+
+        self.semaphore = asyncio.Semaphore(self.max_in_flight_requests)
+        connector = aiohttp.TCPConnector(
+            limit=self.max_in_flight_requests,
+            limit_per_host=self.instance_config.pool_maxsize if self.instance_config.pool_block else 0,
+            force_close=not self.instance_config.keep_alive
+        )
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_connection_create_end.append(self._on_connection_created)
+        self.session = aiohttp.ClientSession(headers=headers, auth=auth, cookie_jar=cookie_jar, connector=connector, trace_configs=[trace_config])
+        self.logged_in = True
+
+    async def _on_connection_created(self, session, trace_context, params):
+        # Each new connection is a TCP/TLS handshake, reused keep-alive connections do not trigger this
+        self.metrics.inc("connections_opened_total", client="async")
+
+    def get_pool_stats(self) -> dict:
+        if self.session is None:
+            return {}
+        return {
+            'connections_opened': int(self.metrics.value("connections_opened_total", client="async")),
+            'requests_sent': self.total_requests,
+            # aiohttp has no public count, released keep-alive connections wait in the connector's per host queues
+            'connections_idle': sum(len(connections) for connections in getattr(self.session.connector, '_conns', {}).values()),
+            'pool_maxsize': self.session.connector.limit_per_host or self.session.connector.limit,
+            'pools': 1
+        }
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def api_request(self, method, category, action, api_version="v1", **kwargs):
+        url = kwargs.get('url') or self.build_url(category, action, api_version, kwargs.get('path_params', {}))
+        request_kwargs = self.build_request_kwargs(kwargs)
+        cache_key, cached_response = self._cache_lookup(method, category, action, url, request_kwargs, kwargs)
+        if cached_response is not None:
+            return cached_response
+        if method != 'GET' or 'stream_to' in kwargs or 'stream_into' in kwargs:
+            return await self._send_request(method, category, action, url, request_kwargs, cache_key, kwargs)
+
+        # Identical GETs awaited by other tasks while this one is in flight share its response
+        flight_key = ResponseCache.make_key(method, url, request_kwargs.get('params'))
+        in_flight = self.in_flight_requests.get(flight_key)
+        if in_flight is not None:
+            self.single_flight.shared += 1
+            return await asyncio.shield(in_flight)
+        in_flight = self.in_flight_requests[flight_key] = asyncio.get_running_loop().create_future()
+        try:
+            response = await self._send_request(method, category, action, url, request_kwargs, cache_key, kwargs)
+            in_flight.set_result(response)
+            return response
+        except asyncio.CancelledError:
+            in_flight.cancel()
+            raise
+        except Exception as e:
+            in_flight.set_exception(e)
+            in_flight.exception()  # Marks the error as retrieved when no other task was waiting
+            raise
+        finally:
+            del self.in_flight_requests[flight_key]
+
+    async def _send_request(self, method, category, action, url, request_kwargs, cache_key, kwargs):
+        files = request_kwargs.pop('files', None)
+        body = request_kwargs.pop('data', None) if isinstance(request_kwargs.get('data'), MultipartStream) else None
+        retry_policy = self.get_retry_policy(category, action)
+
+        attempt = 0
+        while True:
+            if body is not None:
+                # Streamed body, re-read from the start on every attempt, its length is sent as Content-Length
+                request_kwargs['data'] = self._iter_body(body)
+                request_kwargs.setdefault('headers', {})['Content-Length'] = str(body.len)
+            if files:
+                # aiohttp closes uploaded files once sent, so retries reopen them by name into a new FormData
+                if attempt > 0:
+                    files = {field: (file_name, open(file_obj.name, 'rb'), content_type) for field, (file_name, file_obj, content_type) in files.items()}
+                form = aiohttp.FormData()
+                for field, (file_name, file_obj, content_type) in files.items():
+                    form.add_field(field, file_obj, filename=file_name, content_type=content_type)
+                request_kwargs['data'] = form
+
+            logger.debug(f"{self.logs_prefix} HTTP_REQ {method} URL: {url} {str(request_kwargs)[:150]}")
+            started_at = None
+            try:
+                async with self.semaphore:
+                    # Latency is measured once the semaphore is acquired, queueing is not part of it
+                    started_at = time.perf_counter()
+                    async with self.session.request(method, url, **request_kwargs) as raw_response:
+                        if kwargs.get('stream_to') and raw_response.status == 200:
+                            await self._save_stream(raw_response, kwargs['stream_to'])
+                            content = b''
+                        elif kwargs.get('stream_into') is not None and raw_response.status == 200:
+                            await self._copy_stream(raw_response, kwargs['stream_into'])
+                            content = b''
+                        else:
+                            content = await raw_response.read()
+                        response = AsyncResponse(raw_response.status, multidict.CIMultiDict(raw_response.headers), content)
+            except (aiohttp.ClientConnectionError, aiohttp.ClientPayloadError, asyncio.TimeoutError) as e:
+                if started_at is not None:
+                    self.metrics.observe_request(category, action, "error", time.perf_counter() - started_at)
+                self._close_files(files)
+                if not retry_policy.should_retry_error(method, isinstance(e, aiohttp.ClientConnectorError), attempt):
+                    self.update_request_stats(is_successful=False)
+                    raise
+                delay = retry_policy.get_delay(attempt)
+                logger.warning(f"{self.logs_prefix} HTTP_RETRY {method} URL: {url} Error: {e!r} Retrying in {delay:.1f}s ({attempt + 1}/{retry_policy.max_retries})")
+            else:
+                bytes_received = len(content) or int(response.headers.get('Content-Length') or 0)
+                self.metrics.observe_request(category, action, response.status_code, time.perf_counter() - started_at, self._request_size(request_kwargs, body, files), bytes_received)
+                if not retry_policy.should_retry(method, response.status_code, attempt):
+                    break
+                delay = retry_policy.get_delay(attempt, response.headers.get('Retry-After'))
+                logger.warning(f"{self.logs_prefix} HTTP_RETRY {method} URL: {url} Status: {response.status_code} Retrying in {delay:.1f}s ({attempt + 1}/{retry_policy.max_retries})")
+            attempt += 1
+            self.metrics.inc("http_retries_total", endpoint=f"{category}.{action}")
+            # Sleeping outside the semaphore frees the slot for requests that are not throttled
+            await asyncio.sleep(delay)
+
+        response = self._cache_update(cache_key, method, response, kwargs)
+        self.handle_response(response, category, action)
+
+        return response
+
+    def _close_files(self, files):
+        for _, file_obj, _ in (files or {}).values():
+            file_obj.close()
+
+    def _request_size(self, request_kwargs, body, files) -> int:
+        # aiohttp does not expose the sent body, so its size is derived from what was passed in
+        if body is not None:
+            return body.len
+        if files:
+            return sum(os.path.getsize(file_obj.name) for _, file_obj, _ in files.values() if isinstance(getattr(file_obj, 'name', None), str))
+        if request_kwargs.get('json') is not None:
+            return len(json.dumps(request_kwargs['json']).encode('utf-8'))
+        return 0
+
+    async def get_space_id(self, space_key) -> dict:
+        return (await self.api_request('GET', 'space', 'get', 'v1', path_params={'spaceKey': space_key})).json().get("id","")
+
+    async def get_content(self, content_id, expand=True, profile: str = "default") -> AsyncResponse:
+        params = {
+            'limit': self.instance_config.fetch_pages_limit
+        }
+        if expand:
+            params['expand'] = self.EXPAND_PROFILES[profile]
+        return await self.api_request('GET', 'content', 'get', 'v1', path_params={'contentId': content_id}, params=params)
+
+    async def get_page_title(self, content_id) -> dict:
+        return (await self.api_request('GET', 'content', 'get', 'v1', path_params={'contentId': content_id})).json().get("title","")
+
+    async def get_page_id(self, title: str, space_key: str):
+        params = {
+            'title': title,
+            'spaceKey': space_key
+        }
+        return (await self.api_request('GET','rest','base','v1', params=params)).json().get("results",{})[0].get("id","")
+
+    async def create_content(self, data, space_key: str = None) -> dict:
+        response = await self.api_request('POST', 'content', 'create', self.use_v2_for_cloud, data=data)
+        if response.status_code == 400:
+            logger.warning(f"{self.logs_prefix} Error Creating Page '{data['title']}': {response.json()['errors'][0]['title']}")
+            return await self.get_page_id(title=data['title'], space_key=space_key)
+        return response.json()['id']
+
+    async def get_content_version(self, content_id):
+        version_number = (await self.api_request('GET', 'content', 'get', self.use_v2_for_cloud, path_params={'contentId': content_id}, cache=False)).json().get("version",{}).get("number","")
+        if version_number:
+            self.response_cache.revalidate_version(content_id, version_number)
+        return version_number
+
+    async def create_page(self, title: str, body: str, space_key: str, space_id: str = None, parent_id: str = None, labels: list = []):
+        label_data = [{"prefix": "global", "name": label} for label in dict.fromkeys(labels) if label]
+        data = self._page_create_data(title, body, space_key, space_id, parent_id, label_data)
+        response = await self.api_request('POST', 'content', 'create', self.use_v2_for_cloud, data=data)
+        if response.status_code not in [200, 201]:
+            return response, False
+        if self.use_v2_for_cloud == "v2" and label_data:
+            label_response = await self.api_request('POST', 'label', 'add', 'v1', path_params={'contentId': response.json()['id']}, data=label_data)
+            return response, label_response.status_code == 200
+        return response, True
+
+    async def update_content(self, content_id, title: str, body: str, version_number: int = None):
+        if version_number is None:
+            version_number = int(await self.get_content_version(content_id) or 0)
+        data = self._content_update_data(content_id, title, body, version_number)
+        return await self.api_request('PUT', 'content', 'update', self.use_v2_for_cloud, path_params={'contentId': content_id}, data=data)
+
+    async def move_page(self, page_id, position: str, target_id):
+        return await self.api_request('PUT', 'content', 'move', 'v1', path_params={'contentId': page_id, 'position': position, 'targetId': target_id})
+
+    async def get_labels(self, content_id):
+        return (await self.api_request('GET', 'label', 'get', 'v1', path_params={'contentId': content_id})).json()['results']
+
+    async def add_labels(self, content_id, labels):
+        data = [{"prefix":"global","name": label} for label in labels]
+        return await self.api_request('POST', 'label', 'add', 'v1', path_params={'contentId': content_id}, data=data)
+
+    async def add_automation_label(self, content_id: str, automation_label: str):
+        return await self.add_labels(content_id, [automation_label])
+
+    async def get_child_pages(self, parent_id, profile: str = "tree_with_bodies"):
+        return [page async for page in self.iter_child_pages(parent_id, profile=profile)]
+
+    async def iter_child_pages(self, parent_id, profile: str = "tree_with_bodies", page_size: int = None):
+        params = {
+            'limit': page_size or self.instance_config.fetch_pages_limit or 25,
+            'expand': self.EXPAND_PROFILES[profile]
+        }
+        async for page in self._iter_results('child', 'get', path_params={'parentId': parent_id}, params=params):
+            yield page
+
+    async def search_content(self, cql: str, expand: str = '', page_size: int = None):
+        params = {
+            'cql': cql,
+            'limit': page_size or self.instance_config.fetch_pages_limit or 25
+        }
+        if expand:
+            params['expand'] = expand
+        async for page in self._iter_results('content', 'cql', params=params):
+            yield page
+
+    async def list_space_pages(self, space_key: str, expand: str = '', page_size: int = None):
+        params = {
+            'spaceKey': space_key,
+            'type': 'page',
+            'limit': page_size or self.instance_config.fetch_pages_limit or 25
+        }
+        if expand:
+            params['expand'] = expand
+        async for page in self._iter_results('content', 'list', params=params):
+            yield page
+
+    async def _iter_results(self, category: str, action: str, path_params: dict = {}, params: dict = {}):
+        response = await self.api_request('GET', category, action, 'v1', path_params=path_params, params=params)
+        while True:
+            if response.status_code != 200:
+                raise self._listing_error(response, category, action)
+            links = response.json().get('_links', {})
+            for result in response.json().get('results', []):
+                yield result
+            if not links.get('next'):
+                break
+            response = await self.api_request('GET', category, action, 'v1', url=f"{links.get('base', self.instance_config.site_url)}{links['next']}")
+
+    async def get_attachments(self, content_id) -> AsyncResponse:
+        params = {
+            'limit': self.instance_config.fetch_attachments_limit
+        }
+        return await self.api_request('GET','attachment','get','v1',path_params={'contentId':content_id},params=params)
+
+    async def iter_attachments(self, content_id, page_size: int = None):
+        params = {
+            'limit': page_size or self.instance_config.fetch_attachments_limit or 25
+        }
+        async for attachment in self._iter_results('attachment', 'get', path_params={'contentId': content_id}, params=params):
+            yield attachment
+
+    async def get_user_groups(self):
+        try:
+            self.current_user_memberships = [group['name'] async for group in self.iter_user_groups()]
+        except requests.exceptions.HTTPError as e:
+            logger.warning(f"Could not list the groups of the current user: {e}")
+            self.current_user_memberships = []
+        return self.current_user_memberships
+
+    async def iter_user_groups(self, page_size: int = 100):
+        async for group in self._iter_results('user', 'groups', params={'limit': page_size}):
+            yield group
+
+    async def get_page_restrictions(self, page_id):
+        try:
+            username = self.instance_config.credentials.email
+            if username is None:
+                raise ValueError(f"{self.logs_prefix} Cannot find username in {self.instance_config.preferred_auth}")
+            response = await self.api_request('GET', 'content', 'restrictions', 'v1', path_params={'contentId': page_id})
+            return self._has_page_access(page_id, username, response.json())
+        except KeyError as ke:
+            raise ValueError(f"Expected key not found in API response for page {page_id}: {ke}")
+
+    async def create_attachment(self, content_id: str, attachment_name: str, file_path: str, attachment_id: str = None):
+        try:
+            logger.debug(f"{self.logs_prefix} Uploading Attachment {file_path} to page {content_id}")
+            with open(file_path, 'rb') as f:
+                files = {
+                    'file': (attachment_name, f, 'multipart/form-data')
+                }
+                action, path_params = self._attachment_upload_endpoint(content_id, attachment_id)
+                upload_response = await self.api_request('POST', 'attachment', action, 'v1', path_params=path_params, files=files)
+            if upload_response.status_code in [200, 201]:
+                logger.info(f"{self.logs_prefix} Successfully Uploaded Attachment Title: '{attachment_name}'")
+            else:
+                logger.error(f"{self.logs_prefix} Attachment Upload Failed Status: {upload_response.status_code} Title: '{attachment_name}'")
+        finally:
+            os.remove(file_path)
+            logger.debug(f"Deleted Attachment from path {file_path}")
+        return upload_response
+
+    async def download_attachment(self, content_id, file_name, download_dir) -> str:
+        file_path = self._download_path(file_name, download_dir)
+        response = await self.api_request('GET', 'attachment', 'download', 'v1', path_params={'contentId': content_id, 'fileName': urllib.parse.quote(file_name)}, stream_to=file_path)
+        if response.status_code != 200:
+            await asyncio.to_thread(self._save_file, response.content, file_name, download_dir)
+        logger.debug(f"{self.logs_prefix} Downloaded Attachment at {file_path}")
+        return str(file_path)
+
+    async def download_pdf(self, content_id, content_name, download_dir):
+        await self._download_export(content_id, content_name, download_dir, 'pdf', 'pdf', "PDF document")
+
+    async def download_word(self, content_id, content_name, download_dir):
+        await self._download_export(content_id, content_name, download_dir, 'word', 'doc', "Word document")
+
+    async def _download_export(self, content_id, content_name, download_dir, action: str, extension: str, document_type: str):
+        download_path = Path(download_dir) / action / f"{self.safe_name(content_name)}.{extension}"
+        try:
+            download_path.parent.mkdir(parents=True, exist_ok=True)
+            response = await self.api_request('GET', 'export', action, 'v1', params={'pageId': content_id}, stream_to=download_path)
+            if response.status_code == 200:
+                logger.debug(f"{self.logs_prefix} '{content_name}' {document_type} downloaded at: {download_path}")
+            else:
+                logger.error(f"Failed to download {document_type} for '{content_name}'. Status code: {response.status_code}")
+        except OSError as e:
+            logger.error(f"Failed to write {document_type} for '{content_name}' to {download_path}. OS error: {e}")
+
+    async def _iter_body(self, body: MultipartStream):
+        body.seek(0)
+        while chunk := await asyncio.to_thread(body.read, MultipartStream.CHUNK_SIZE):
+            yield chunk
+
+    async def _copy_stream(self, raw_response, fileobj) -> int:
+        # A retried download starts over, the bytes of a body cut off mid-transfer must not stay in front of it
+        fileobj.seek(0)
+        fileobj.truncate()
+        total_bytes = 0
+        async for chunk in raw_response.content.iter_chunked(self.instance_config.download_chunk_size):
+            await asyncio.to_thread(fileobj.write, chunk)
+            total_bytes += len(chunk)
+        return total_bytes
+
+    async def create_attachment_from_stream(self, content_id: str, attachment_name: str, fileobj, size: int, attachment_id: str = None):
+        body = MultipartStream('file', attachment_name, fileobj, size)
+        logger.debug(f"{self.logs_prefix} Uploading Attachment '{attachment_name}' ({size} bytes) to page {content_id}")
+        action, path_params = self._attachment_upload_endpoint(content_id, attachment_id)
+        upload_response = await self.api_request('POST', 'attachment', action, 'v1', path_params=path_params, body=body, headers={'Content-Type': body.content_type})
+        if upload_response.status_code in [200, 201]:
+            logger.info(f"{self.logs_prefix} Successfully Uploaded Attachment Title: '{attachment_name}'")
+        else:
+            logger.error(f"{self.logs_prefix} Attachment Upload Failed Status: {upload_response.status_code} Title: '{attachment_name}'")
+        return upload_response
+
+    async def spool_attachment(self, content_id, file_name):
+        spool = tempfile.SpooledTemporaryFile(max_size=self.instance_config.relay_buffer_size)
+        started_at = time.perf_counter()
+        try:
+            response = await self.api_request('GET', 'attachment', 'download', 'v1', path_params={'contentId': content_id, 'fileName': urllib.parse.quote(file_name)}, stream_into=spool)
+        except Exception:
+            spool.close()
+            raise
+        if response.status_code != 200:
+            spool.close()
+            return None, 0
+        total_bytes = spool.tell()
+        spool.seek(0)
+        self._log_download_rate(Path(file_name), total_bytes, started_at)
+        return spool, total_bytes
+
+    async def _save_stream(self, raw_response, file_path):
+        # Chunks are written from a worker thread so disk writes never block the event loop
+        file_path = Path(file_path)
+        temp_fd, temp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".part")
+        total_bytes = 0
+        started_at = time.perf_counter()
+        try:
+            with os.fdopen(temp_fd, 'wb') as f:
+                async for chunk in raw_response.content.iter_chunked(self.instance_config.download_chunk_size):
+                    await asyncio.to_thread(f.write, chunk)
+                    total_bytes += len(chunk)
+            os.replace(temp_path, file_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        self._log_download_rate(file_path, total_bytes, started_at)
@@ -1,28 +1,51 @@
 from . import logger
+from .retry import RetryPolicy
+from .http_pool import PooledHTTPAdapter
+from .response_cache import ResponseCache
+from .single_flight import SingleFlight
+from .multipart import MultipartStream
+from .metrics import MetricsRegistry
+from .storage_transform import StorageTransform
 from config.config_types import ConfluenceInstance
 from requests.auth import HTTPBasicAuth
 import requests
+import urllib3
 import re
 import json
 import os
 from pathlib import Path
+from typing import Optional
 import urllib.parse
 import base64
+import tempfile
+import time
 
 class ConfluenceAPIClient:
+    # Fields expanded per operation, so each page is hydrated by exactly one request
+    EXPAND_PROFILES = {
+        "default": "body.storage,children.attachment",
+        "tree_metadata": "version,metadata.labels",
+        "tree_with_bodies": "version,metadata.labels,body.storage",
+        "tree_flat": "ancestors,extensions.position,version,metadata.labels,body.storage",
+        "tree_flat_metadata": "ancestors,extensions.position,version,metadata.labels",
+        "page_body": "version,body.storage",
+        "attachments": "children.attachment",
+        "ids": "",
+    }
+
     def __init__(self, instance_config: ConfluenceInstance,api_config:dict):
         self.instance_config = instance_config
         self.api_config = api_config
         self.current_user_memberships = []
         self.session = requests.Session()
-        self.total_success = 0
-        self.total_failed = 0
-        self.total_requests = 0
-        self.total_pages_created = 0
-        self.total_attachments_created = 0
-        self.total_pdfs_download = 0
-        self.total_attachments_download = 0
-        self.total_docs_download = 0
+        self.metrics = MetricsRegistry()
+        self.retry_policies = {}
+        self.http_adapter = None
+        cache_config = self.api_config.get('cache', {})
+        self.cached_endpoints = set(cache_config.get('endpoints', []))
+        self.response_cache = ResponseCache(max_entries=cache_config.get('max_entries', 1024), ttl=cache_config.get('ttl', 300))
+        self.single_flight = SingleFlight()
+        self.storage_validator = StorageTransform()
         self.use_v2_for_cloud = "v2" if self.instance_config.confluence_type == "cloud" else "v1"
         self.rest_api_path = "/wiki/rest/api/content" if self.instance_config.confluence_type == "cloud" else "/rest/api/content"
         self.logs_prefix = f"{self.instance_config.name} {self.instance_config.confluence_type}>"
@@ -31,30 +54,84 @@ class ConfluenceAPIClient:
     def get_endpoint(self, category: str, action: str, api_version: str = "v1") -> str:
         return self.api_config.get(self.instance_config.confluence_type, {}).get(api_version, {}).get(category, {}).get(action, '')
 
+    def get_retry_policy(self, category: str, action: str) -> RetryPolicy:
+        # Per endpoint overrides ("category.action") are merged over the "default" policy
+        key = f"{category}.{action}"
+        if key not in self.retry_policies:
+            retry_config = self.api_config.get('retry', {})
+            self.retry_policies[key] = RetryPolicy({**retry_config.get('default', {}), **retry_config.get(key, {})})
+        return self.retry_policies[key]
+
+    @property
+    def total_requests(self) -> int:
+        return int(self.metrics.value("requests_total"))
+
+    @property
+    def total_success(self) -> int:
+        return int(self.metrics.value("requests_total", outcome="success"))
+
+    @property
+    def total_failed(self) -> int:
+        return int(self.metrics.value("requests_total", outcome="failure"))
+
+    @property
+    def total_pages_created(self) -> int:
+        return int(self.metrics.value("pages_created_total"))
+
+    @property
+    def total_attachments_created(self) -> int:
+        return int(self.metrics.value("attachments_created_total"))
+
+    @property
+    def total_pdfs_download(self) -> int:
+        return int(self.metrics.value("downloads_total", kind="pdf"))
+
+    @property
+    def total_docs_download(self) -> int:
+        return int(self.metrics.value("downloads_total", kind="word"))
+
+    @property
+    def total_attachments_download(self) -> int:
+        return int(self.metrics.value("downloads_total", kind="attachment"))
+
+    @property
+    def total_retries(self) -> int:
+        return int(self.metrics.value("http_retries_total"))
+
     def requests_stats(self):
         logger.info(f"{self.logs_prefix} Total requests: {self.total_requests}, Total success: {self.total_success}, Total failed: {self.total_failed}")
+        pool_stats = self.get_pool_stats()
+        if pool_stats:
+            logger.info(f"{self.logs_prefix} Connections opened: {pool_stats['connections_opened']} for {pool_stats['requests_sent']} requests, idle: {pool_stats['connections_idle']}/{pool_stats['pool_maxsize']} per host")
         logger.info(f"{self.logs_prefix} Success rate: {self.total_success / self.total_requests * 100:.2f}%")
     
+    def export_metrics(self, metrics_dir) -> Path:
+        """Write the metrics snapshot as ``<instance>.json`` and ``<instance>.prom`` into ``metrics_dir``."""
+        metrics_dir = Path(metrics_dir)
+        metrics_dir.mkdir(parents=True, exist_ok=True)
+        file_path = metrics_dir / self.safe_name(self.instance_config.name)
+        file_path.with_suffix('.json').write_text(self.metrics.to_json(), encoding='utf-8')
+        file_path.with_suffix('.prom').write_text(self.metrics.to_prometheus(instance=self.instance_config.name), encoding='utf-8')
+        logger.debug(f"{self.logs_prefix} Metrics exported to {file_path}.json/.prom")
+        return file_path
+
     def update_request_stats(self,is_successful: bool=True,created_attachment: bool=False,created_page: bool=False,download_pdf:bool=False,download_doc:bool=False,download_attachment:bool=False):
         if created_page:
-            self.total_pages_created +=1
+            self.metrics.inc("pages_created_total")
         if created_attachment:
-            self.total_attachments_created += 1
+            self.metrics.inc("attachments_created_total")
         if download_pdf:
-            self.total_pdfs_download +=1
+            self.metrics.inc("downloads_total", kind="pdf")
         if download_doc:
-            self.total_docs_download +=1
+            self.metrics.inc("downloads_total", kind="word")
         if download_attachment:
-            self.total_attachments_download +=1
-        if is_successful:
-            self.total_success += 1
-        else:
-            self.total_failed += 1
-        self.total_requests += 1
+            self.metrics.inc("downloads_total", kind="attachment")
+        self.metrics.inc("requests_total", outcome="success" if is_successful else "failure")
 
     def initialize_session(self,cookies:list=[]):
         self.session = requests.Session()
         self.session.headers.update({'X-Atlassian-Token': 'no-check','Accept': 'application/json'})
+        self.mount_http_adapter()
 
         auth_type = self.instance_config.credentials.rest_auth_type
         confluence_type = self.instance_config.confluence_type
@@ -83,17 +160,143 @@ class ConfluenceAPIClient:
             raise ValueError(f"{self.logs_prefix} Invalid Authentication Method: {auth_type}")
         self.logged_in = True
 
+    def mount_http_adapter(self):
+        # Workers beyond pool_maxsize would open a new connection (and TLS handshake) per request
+        instance = self.instance_config
+        pool_maxsize = max(instance.pool_maxsize, instance.fetch_workers, instance.create_workers, instance.copy_workers, instance.attachment_list_workers + max(instance.attachment_download_workers, instance.attachment_upload_workers))
+        self.http_adapter = PooledHTTPAdapter(
+            pool_connections=self.instance_config.pool_connections,
+            pool_maxsize=pool_maxsize,
+            pool_block=self.instance_config.pool_block,
+            tcp_keepalive=self.instance_config.tcp_keepalive
+        )
+        self.session.mount('https://', self.http_adapter)
+        self.session.mount('http://', self.http_adapter)
+        if not self.instance_config.keep_alive:
+            self.session.headers.update({'Connection': 'close'})
+        logger.debug(f"{self.logs_prefix} HTTP pool: {self.instance_config.pool_connections} hosts x {pool_maxsize} connections, block: {self.instance_config.pool_block}, keep-alive: {self.instance_config.keep_alive}")
+
+    def get_pool_stats(self) -> dict:
+        if self.http_adapter is None:
+            return {}
+        pool_stats = self.http_adapter.get_pool_stats()
+        # Connections opened by an AsyncConfluenceAPIClient accounting on this client
+        pool_stats['connections_opened'] += int(self.metrics.value("connections_opened_total", client="async"))
+        return pool_stats
+
     def api_request(self, method, category, action, api_version="v1", **kwargs):
-        url = self.build_url(category, action, api_version, kwargs.get('path_params', {}))
+        url = kwargs.get('url') or self.build_url(category, action, api_version, kwargs.get('path_params', {}))
         request_kwargs = self.build_request_kwargs(kwargs)
 
-        logger.debug(f"{self.logs_prefix} HTTP_REQ {method} URL: {url} {str(request_kwargs)[:150]}")
-        response = self.session.request(method, url, **request_kwargs)
-
+        cache_key, cached_response = self._cache_lookup(method, category, action, url, request_kwargs, kwargs)
+        if cached_response is not None:
+            return cached_response
+        if method == 'GET' and not kwargs.get('stream'):
+            # Identical GETs issued by other threads while this one is in flight share its response
+            flight_key = ResponseCache.make_key(method, url, request_kwargs.get('params'))
+            return self.single_flight.do(flight_key, lambda: self._send_request(method, category, action, url, request_kwargs, cache_key, kwargs))
+        return self._send_request(method, category, action, url, request_kwargs, cache_key, kwargs)
+
+    def _send_request(self, method, category, action, url, request_kwargs, cache_key, kwargs):
+        retry_policy = self.get_retry_policy(category, action)
+
+        attempt = 0
+        while True:
+            logger.debug(f"{self.logs_prefix} HTTP_REQ {method} URL: {url} {str(request_kwargs)[:150]}")
+            started_at = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **request_kwargs)
+            except (requests.exceptions.ConnectionError, requests.exceptions.Timeout) as e:
+                self.metrics.observe_request(category, action, "error", time.perf_counter() - started_at)
+                if not retry_policy.should_retry_error(method, self._is_connect_failure(e), attempt):
+                    self.update_request_stats(is_successful=False)
+                    raise
+                delay = retry_policy.get_delay(attempt)
+                logger.warning(f"{self.logs_prefix} HTTP_RETRY {method} URL: {url} Error: {e} Retrying in {delay:.1f}s ({attempt + 1}/{retry_policy.max_retries})")
+            else:
+                self._observe_response(category, action, response, time.perf_counter() - started_at)
+                if not retry_policy.should_retry(method, response.status_code, attempt):
+                    break
+                delay = retry_policy.get_delay(attempt, response.headers.get('Retry-After'))
+                logger.warning(f"{self.logs_prefix} HTTP_RETRY {method} URL: {url} Status: {response.status_code} Retrying in {delay:.1f}s ({attempt + 1}/{retry_policy.max_retries})")
+                response.close()
+            attempt += 1
+            self.metrics.inc("http_retries_total", endpoint=f"{category}.{action}")
+            time.sleep(delay)
+            self._rewind_files(request_kwargs)
+
+        response = self._cache_update(cache_key, method, response, kwargs)
         self.handle_response(response, category, action)
 
         return response
 
+    @staticmethod
+    def _is_connect_failure(error: requests.exceptions.RequestException) -> bool:
+        # Refused, reset or unresolvable connects are raised as a ConnectionError wrapping NewConnectionError, nothing was sent
+        if isinstance(error, requests.exceptions.ConnectTimeout):
+            return True
+        reason = getattr(error.args[0], 'reason', None) if error.args else None
+        return isinstance(reason, urllib3.exceptions.NewConnectionError)
+
+    def _observe_response(self, category, action, response, seconds):
+        # Sizes come from the prepared body and, for streamed downloads not read yet, from Content-Length
+        body = response.request.body if response.request is not None else None
+        bytes_sent = len(body) if isinstance(body, (bytes, str)) else getattr(body, 'len', 0)
+        if response._content is False:
+            bytes_received = int(response.headers.get('Content-Length') or 0)
+        else:
+            bytes_received = len(response.content or b'')
+        self.metrics.observe_request(category, action, response.status_code, seconds, bytes_sent, bytes_received)
+
+    def _cache_lookup(self, method, category, action, url, request_kwargs, kwargs):
+        # Only GETs of endpoints listed under "cache" in the api config are cached, callers can opt out with cache=False
+        if method != 'GET' or not kwargs.get('cache', True) or f"{category}.{action}" not in self.cached_endpoints:
+            return None, None
+        if 'body.' in str(request_kwargs.get('params', {}).get('expand', '')):
+            # Bodies are large and loaded once per page, caching them would only evict the small responses that are reused
+            return None, None
+        cache_key = ResponseCache.make_key(method, url, request_kwargs.get('params'))
+        cached_response, etag = self.response_cache.lookup(cache_key)
+        if cached_response is None and etag:
+            request_kwargs.setdefault('headers', {})['If-None-Match'] = etag
+        return cache_key, cached_response
+
+    def _cache_update(self, cache_key, method, response, kwargs):
+        if cache_key is not None:
+            if response.status_code == 304:
+                return self.response_cache.revalidated(cache_key) or response
+            if response.status_code == 200:
+                self.response_cache.store(cache_key, response, kwargs.get('path_params', {}).values(), self._response_version(response))
+        elif method != 'GET' and 200 <= response.status_code < 300:
+            data = kwargs.get('data')
+            content_ids = list(kwargs.get('path_params', {}).values())
+            if isinstance(data, dict):
+                content_ids += [data[key] for key in ('id', 'parentId') if data.get(key)]
+            self.invalidate_cache(content_ids)
+        return response
+
+    @staticmethod
+    def _response_version(response) -> Optional[int]:
+        # Content responses carry their version, cached entries are revalidated against it by get_content_version
+        try:
+            data = response.json()
+        except ValueError:
+            return None
+        version = data.get('version') if isinstance(data, dict) else None
+        return version.get('number') if isinstance(version, dict) else None
+
+    def invalidate_cache(self, content_ids=None):
+        """Drop cached responses of the given content ids, or the whole cache when no ids are given."""
+        self.response_cache.invalidate(content_ids)
+
+    def _rewind_files(self, request_kwargs):
+        # Uploads are file objects, they must be read again from the start when a request is resent
+        for file_tuple in request_kwargs.get('files', {}).values():
+            if len(file_tuple) > 1 and hasattr(file_tuple[1], 'seek'):
+                file_tuple[1].seek(0)
+        if hasattr(request_kwargs.get('data'), 'seek'):
+            request_kwargs['data'].seek(0)
+
     def build_url(self, category, action, api_version, path_params):
         url = f"{self.instance_config.site_url}{self.get_endpoint(category, action, api_version)}"
         for key, value in path_params.items():
@@ -110,6 +313,12 @@ class ConfluenceAPIClient:
             request_kwargs['files'] = kwargs['files']
         if 'allow_redirects' in kwargs:
             request_kwargs['allow_redirects'] = kwargs['allow_redirects']
+        if 'stream' in kwargs:
+            request_kwargs['stream'] = kwargs['stream']
+        if 'body' in kwargs:
+            request_kwargs['data'] = kwargs['body']
+        if 'headers' in kwargs:
+            request_kwargs['headers'] = dict(kwargs['headers'])
         return request_kwargs
 
     def handle_response(self, response, category, action):
@@ -117,27 +326,28 @@ class ConfluenceAPIClient:
             self.update_request_stats(
                 is_successful=True,
                 created_page=(category == 'content' and action == 'create'),
+                created_attachment=(category == 'attachment' and action == 'create'),
                 download_pdf=(category == 'export' and action == 'pdf'),
                 download_doc=(category == 'export' and action == 'word'),
                 download_attachment=(category == 'attachment' and action == 'download')
             )
-            if action not in ["export","download"]:
+            if category != "export" and action != "download":
                 logger.debug(f"{self.logs_prefix} HTTP_RES {response.status_code} MESSAGE: {response.text[:250]}...")
         else:
             self.update_request_stats(is_successful=False)
-            if action not in ["export","download"]:
+            if category != "export" and action != "download":
                 logger.warning(f"{self.logs_prefix} HTTP_RES {response.status_code} MESSAGE: {response.text[:350]}...")
 
 
     def get_space_id(self, space_key) -> dict:
         return self.api_request('GET', 'space', 'get', 'v1', path_params={'spaceKey': space_key}).json().get("id","")
 
-    def get_content(self, content_id, expand=True) -> dict:
+    def get_content(self, content_id, expand=True, profile: str = "default") -> dict:
         params = {
             'limit': self.instance_config.fetch_pages_limit
         }
         if expand:
-            params['expand'] = 'body.storage,children.attachment'
+            params['expand'] = self.EXPAND_PROFILES[profile]
         return self.api_request('GET', 'content', 'get', 'v1', path_params={'contentId': content_id}, params=params)
 
     def get_page_title(self, content_id) -> dict:
@@ -157,16 +367,82 @@ class ConfluenceAPIClient:
             return self.get_page_id(title=data['title'],space_key=space_key)
         return response.json()['id']
 
+    def create_page(self, title: str, body: str, space_key: str, space_id: str = None, parent_id: str = None, labels: list = []):
+        """Create a page with its body and labels, returns the response of the create request and whether the labels were applied.
+
+        REST v1 takes ancestors, body and metadata.labels in the create payload, so a page costs one
+        request. REST v2 has no labels on create, they follow in one combined label request.
+        """
+        label_data = [{"prefix": "global", "name": label} for label in dict.fromkeys(labels) if label]
+        data = self._page_create_data(title, body, space_key, space_id, parent_id, label_data)
+        response = self.api_request('POST', 'content', 'create', self.use_v2_for_cloud, data=data)
+        if response.status_code not in [200, 201]:
+            return response, False
+        if self.use_v2_for_cloud == "v2" and label_data:
+            label_response = self.api_request('POST', 'label', 'add', 'v1', path_params={'contentId': response.json()['id']}, data=label_data)
+            return response, label_response.status_code == 200
+        return response, True
+
+    def _page_create_data(self, title: str, body: str, space_key: str, space_id: str, parent_id: str, label_data: list) -> dict:
+        if self.use_v2_for_cloud == "v2":
+            data = {
+                "title": title,
+                "spaceId": str(space_id),
+                "status": "current",
+                "body": {"representation": "storage", "value": body}
+            }
+            if parent_id:
+                data["parentId"] = str(parent_id)
+        else:
+            data = {
+                "type": "page",
+                "title": title,
+                "space": {"key": space_key},
+                "body": {"storage": {"value": body, "representation": "storage"}},
+                "metadata": {"labels": label_data}
+            }
+            if parent_id:
+                data["ancestors"] = [{"id": str(parent_id)}]
+        return data
+
     def get_content_version(self,content_id):
-        return self.api_request('GET', 'content', 'get', self.use_v2_for_cloud, path_params={'contentId': content_id}).json().get("version",{}).get("number","")
+        # Version numbers are used for optimistic locking, so they are never served from the cache
+        version_number = self.api_request('GET', 'content', 'get', self.use_v2_for_cloud, path_params={'contentId': content_id}, cache=False).json().get("version",{}).get("number","")
+        if version_number:
+            self.response_cache.revalidate_version(content_id, version_number)
+        return version_number
+
+    def update_content(self, content_id, title: str, body: str, version_number: int = None):
+        # Confluence expects the next version number, so the current one is looked up unless given
+        if version_number is None:
+            version_number = int(self.get_content_version(content_id) or 0)
+        data = self._content_update_data(content_id, title, body, version_number)
+        return self.api_request('PUT', 'content', 'update', self.use_v2_for_cloud, path_params={'contentId': content_id}, data=data)
+
+    def _content_update_data(self, content_id, title: str, body: str, version_number: int) -> dict:
+        if self.use_v2_for_cloud == "v2":
+            return {
+                "id": str(content_id),
+                "status": "current",
+                "title": title,
+                "body": {"representation": "storage", "value": body},
+                "version": {"number": version_number + 1}
+            }
+        return {
+            "id": str(content_id),
+            "type": "page",
+            "title": title,
+            "body": {"storage": {"value": body, "representation": "storage"}},
+            "version": {"number": version_number + 1}
+        }
+
+    def move_page(self, page_id, position: str, target_id):
+        # position is "before" or "after" (sibling of target_id) or "append" (last child of target_id)
+        return self.api_request('PUT', 'content', 'move', 'v1', path_params={'contentId': page_id, 'position': position, 'targetId': target_id})
  
     def validate_xhtml(self, body_data):
-        try:
-            from lxml import etree
-            etree.fromstring(body_data)  # This will raise an error if invalid
-            return True
-        except etree.XMLSyntaxError:
-            return False
+        # Storage bodies use undeclared ac:/ri: prefixes and HTML entities, the transform parser accepts both
+        return self.storage_validator.validate(body_data)
 
     def get_labels(self, content_id):
         return self.api_request('GET', 'label', 'get', 'v1', path_params={'contentId': content_id}).json()['results']
@@ -179,24 +455,76 @@ class ConfluenceAPIClient:
         data = [{"prefix":"global","name": automation_label}]
         return self.api_request('POST', 'label', 'add', 'v1', path_params={'contentId': content_id}, data=data)
 
-    def get_child_pages(self, parent_id):
+    def get_child_pages(self, parent_id, profile: str = "tree_with_bodies"):
+        return list(self.iter_child_pages(parent_id, profile=profile))
+
+    def iter_child_pages(self, parent_id, profile: str = "tree_with_bodies", page_size: int = None):
+        params = {
+            'limit': page_size or self.instance_config.fetch_pages_limit or 25,
+            'expand': self.EXPAND_PROFILES[profile]
+        }
+        yield from self._iter_results('child', 'get', path_params={'parentId': parent_id}, params=params)
+
+    def search_content(self, cql: str, expand: str = '', page_size: int = None):
+        params = {
+            'cql': cql,
+            'limit': page_size or self.instance_config.fetch_pages_limit or 25
+        }
+        if expand:
+            params['expand'] = expand
+        yield from self._iter_results('content', 'cql', params=params)
+
+    def list_space_pages(self, space_key: str, expand: str = '', page_size: int = None):
         params = {
-            'limit': self.instance_config.fetch_pages_limit,
-            'expand': 'body.storage'
+            'spaceKey': space_key,
+            'type': 'page',
+            'limit': page_size or self.instance_config.fetch_pages_limit or 25
         }
-        return self.api_request('GET', 'child', 'get', 'v1', path_params={'parentId': parent_id}, params=params).json()['results']
+        if expand:
+            params['expand'] = expand
+        yield from self._iter_results('content', 'list', params=params)
+
+    def _iter_results(self, category: str, action: str, path_params: dict = {}, params: dict = {}):
+        # Lazily follows _links.next, so only one page of results is held in memory at a time
+        response = self.api_request('GET', category, action, 'v1', path_params=path_params, params=params)
+        while True:
+            if response.status_code != 200:
+                raise self._listing_error(response, category, action)
+            links = response.json().get('_links', {})
+            yield from response.json().get('results', [])
+            if not links.get('next'):
+                break
+            # next links are relative to the base url, which already contains the context path (e.g. /wiki)
+            response = self.api_request('GET', category, action, 'v1', url=f"{links.get('base', self.instance_config.site_url)}{links['next']}")
+
+    def _listing_error(self, response, category: str, action: str) -> requests.exceptions.HTTPError:
+        # A results page that still fails after the retries ends the listing with an error, a truncated listing would pass for a complete one
+        return requests.exceptions.HTTPError(f"{self.logs_prefix} Listing {category}.{action} failed with {response.status_code}: {response.text[:200]}", response=response)
 
     def get_attachments(self, content_id) -> dict:
         params = {
             'limit': self.instance_config.fetch_attachments_limit
         }
         return self.api_request('GET','attachment','get','v1',path_params={'contentId':content_id},params=params)
-    
+
+    def iter_attachments(self, content_id, page_size: int = None):
+        params = {
+            'limit': page_size or self.instance_config.fetch_attachments_limit or 25
+        }
+        yield from self._iter_results('attachment', 'get', path_params={'contentId': content_id}, params=params)
+
     def get_user_groups(self):
-        response = self.api_request('GET', 'user', 'groups', 'v1', params={'limit': '100'})
-        self.current_user_memberships = [group['name'] for group in response.json()['results']]
+        try:
+            self.current_user_memberships = [group['name'] for group in self.iter_user_groups()]
+        except requests.exceptions.HTTPError as e:
+            # Group memberships are only shown in the stats, a user that may not list them can still migrate
+            logger.warning(f"Could not list the groups of the current user: {e}")
+            self.current_user_memberships = []
         return self.current_user_memberships
 
+    def iter_user_groups(self, page_size: int = 100):
+        yield from self._iter_results('user', 'groups', params={'limit': page_size})
+
     def get_page_restrictions(self, page_id):
         try:
             username = self.instance_config.credentials.email
@@ -204,58 +532,99 @@ class ConfluenceAPIClient:
                 raise ValueError(f"{self.logs_prefix} Cannot find username in {self.instance_config.preferred_auth}")
             
             response = self.api_request('GET', 'content', 'restrictions', 'v1', path_params={'contentId': page_id})
-            read_access_emails = [user['username'] for user in response.json()['read']['restrictions']['user']['results']]
-            read_access_groups = [group['name'] for group in response.json()['read']['restrictions']['group']['results']]
-            edit_access_emails = [user['username'] for user in response.json()['update']['restrictions']['user']['results']]
-            edit_access_groups = [group['name'] for group in response.json()['update']['restrictions']['group']['results']]
-            
-            if read_access_emails or read_access_groups:
-                logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} Read Access Users: {read_access_emails} Groups: {read_access_groups}")
-            if edit_access_emails or edit_access_groups:
-                logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} Edit Access Users: {edit_access_emails} Groups: {edit_access_groups}")
-
-            if username in read_access_emails or len(read_access_emails) == 0:
-                logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has read access")
-                return True
-            elif username in edit_access_emails or len(edit_access_emails) == 0:
-                logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has edit access")
-                return True
-            elif any(group in read_access_groups for group in self.current_user_memberships) or len(read_access_groups) == 0:
-                logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has read access through group membership")
-                return True
-            elif any(group in edit_access_groups for group in self.current_user_memberships) or len(edit_access_groups) == 0:
-                logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has edit access through group membership")
-                return True
-            else:
-                logger.warning(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} does not have read or edit access")
-                return False
+            return self._has_page_access(page_id, username, response.json())
         except KeyError as ke:
             raise ValueError(f"Expected key not found in API response for page {page_id}: {ke}")
 
-    def create_attachment(self, content_id: str, attachment_name: str, file_path: str) -> dict:
-        upload_response = None
+    def _has_page_access(self, page_id, username: str, restrictions: dict) -> bool:
+        read_access_emails = [user['username'] for user in restrictions['read']['restrictions']['user']['results']]
+        read_access_groups = [group['name'] for group in restrictions['read']['restrictions']['group']['results']]
+        edit_access_emails = [user['username'] for user in restrictions['update']['restrictions']['user']['results']]
+        edit_access_groups = [group['name'] for group in restrictions['update']['restrictions']['group']['results']]
+
+        if read_access_emails or read_access_groups:
+            logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} Read Access Users: {read_access_emails} Groups: {read_access_groups}")
+        if edit_access_emails or edit_access_groups:
+            logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} Edit Access Users: {edit_access_emails} Groups: {edit_access_groups}")
+
+        if username in read_access_emails or len(read_access_emails) == 0:
+            logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has read access")
+            return True
+        elif username in edit_access_emails or len(edit_access_emails) == 0:
+            logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has edit access")
+            return True
+        elif any(group in read_access_groups for group in self.current_user_memberships) or len(read_access_groups) == 0:
+            logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has read access through group membership")
+            return True
+        elif any(group in edit_access_groups for group in self.current_user_memberships) or len(edit_access_groups) == 0:
+            logger.debug(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} has edit access through group membership")
+            return True
+        else:
+            logger.warning(f"{self.logs_prefix} PAGE_ID: {page_id} User {username} does not have read or edit access")
+            return False
+
+    def create_attachment(self, content_id: str, attachment_name: str, file_path: str, attachment_id: str = None):
         try:
-            upload_url = f"{self.instance_config.site_url}{self.get_endpoint('rest','base')}/{content_id}/child/attachment"
-            logger.debug(f"{self.logs_prefix} Uploading Attachment {file_path} to {upload_url}")
+            logger.debug(f"{self.logs_prefix} Uploading Attachment {file_path} to page {content_id}")
             with open(file_path, 'rb') as f:
                 files = {
                     'file': (attachment_name, f, 'multipart/form-data')
                 }
-                upload_response = self.session.post(upload_url,files=files)
+                action, path_params = self._attachment_upload_endpoint(content_id, attachment_id)
+                upload_response = self.api_request('POST', 'attachment', action, 'v1', path_params=path_params, files=files)
             if upload_response.status_code in [200, 201]:
-                self.update_request_stats(is_successful=True,created_attachment=True)
                 logger.info(f"{self.logs_prefix} Successfully Uploaded Attachment Title: '{attachment_name}'")
-        except requests.exceptions.HTTPError as e:
-            self.update_request_stats(is_successful=False)
-            logger.error(f"{self.logs_prefix} Attachment Upload Failed Status: {upload_response.status_code} Title: '{attachment_name}'")
-            logger.error(f"{self.logs_prefix} Response: {upload_response.text[:200]} Reason: {e.response.json()['data']['message'][:200]}") 
+            else:
+                logger.error(f"{self.logs_prefix} Attachment Upload Failed Status: {upload_response.status_code} Title: '{attachment_name}'")
         finally:
             os.remove(file_path)
             logger.debug(f"Deleted Attachment from path {file_path}")
+        return upload_response
+
+    def _attachment_upload_endpoint(self, content_id: str, attachment_id: str = None):
+        # Existing attachments get a new version through update_data, create fails on names already in use
+        if attachment_id:
+            return 'update_data', {'contentId': content_id, 'attachmentId': attachment_id}
+        return 'create', {'contentId': content_id}
+
+    def create_attachment_from_stream(self, content_id: str, attachment_name: str, fileobj, size: int, attachment_id: str = None):
+        body = MultipartStream('file', attachment_name, fileobj, size)
+        logger.debug(f"{self.logs_prefix} Uploading Attachment '{attachment_name}' ({size} bytes) to page {content_id}")
+        action, path_params = self._attachment_upload_endpoint(content_id, attachment_id)
+        upload_response = self.api_request('POST', 'attachment', action, 'v1', path_params=path_params, body=body, headers={'Content-Type': body.content_type})
+        if upload_response.status_code in [200, 201]:
+            logger.info(f"{self.logs_prefix} Successfully Uploaded Attachment Title: '{attachment_name}'")
+        else:
+            logger.error(f"{self.logs_prefix} Attachment Upload Failed Status: {upload_response.status_code} Title: '{attachment_name}'")
+        return upload_response
+
+    def spool_attachment(self, content_id, file_name):
+        """Download an attachment into a SpooledTemporaryFile, returns it rewound with its size or (None, 0) on failure.
+
+        Bodies up to relay_buffer_size stay in memory, bigger ones roll over to an anonymous temp file.
+        """
+        response = self.api_request('GET', 'attachment', 'download', 'v1', path_params={'contentId': content_id, 'fileName': urllib.parse.quote(file_name)}, stream=True)
+        if response.status_code != 200:
+            response.close()
+            return None, 0
+        spool = tempfile.SpooledTemporaryFile(max_size=self.instance_config.relay_buffer_size)
+        total_bytes = 0
+        started_at = time.perf_counter()
+        try:
+            with response:
+                for chunk in response.iter_content(chunk_size=self.instance_config.download_chunk_size):
+                    spool.write(chunk)
+                    total_bytes += len(chunk)
+        except Exception:
+            spool.close()
+            raise
+        spool.seek(0)
+        self._log_download_rate(Path(file_name), total_bytes, started_at)
+        return spool, total_bytes
 
     def download_attachment(self, content_id, file_name, download_dir) -> str:
-        response = self.api_request('GET', 'attachment', 'download', 'v1', path_params={'contentId': content_id, 'fileName': urllib.parse.quote(file_name)})
-        file_path = self._save_file(response.content, file_name, download_dir=download_dir)
+        response = self.api_request('GET', 'attachment', 'download', 'v1', path_params={'contentId': content_id, 'fileName': urllib.parse.quote(file_name)}, stream=True)
+        file_path = self._save_stream(response, self._download_path(file_name, download_dir))
         logger.debug(f"{self.logs_prefix} Downloaded Attachment at {file_path}")
         return file_path
 
@@ -271,14 +640,14 @@ class ConfluenceAPIClient:
                 'pageId': content_id
             }
             # Perform the API request
-            response = self.api_request('GET', 'export', 'pdf', 'v1', params=params)
+            response = self.api_request('GET', 'export', 'pdf', 'v1', params=params, stream=True)
             # Check if the response is successful
             if response.status_code == 200:
-                # Write the response content to a file
-                with open(download_path, 'wb') as pdf_file:
-                    pdf_file.write(response.content)
+                # Stream the response content to the file
+                self._save_stream(response, download_path)
                 logger.debug(f"{self.logs_prefix} '{content_name}' PDF document downloaded at: {download_path}")
             else:
+                response.close()
                 logger.error(f"Failed to download PDF for '{content_name}'. Status code: {response.status_code}")
         except OSError as e:
             logger.error(f"Failed to write PDF document for '{content_name}' to {download_path}. OS error: {e}")
@@ -294,19 +663,19 @@ class ConfluenceAPIClient:
             'pageId': content_id
         }
         # Perform the API request
-        response = self.api_request('GET', 'export', 'word', 'v1', params=params)
+        response = self.api_request('GET', 'export', 'word', 'v1', params=params, stream=True)
         # Check if the response is successful
         if response.status_code == 200:
             try:
-                # Write the response content to a file
-                with open(download_path, 'wb') as word_file:
-                    word_file.write(response.content)
+                # Stream the response content to the file
+                self._save_stream(response, download_path)
                 logger.debug(f"{self.logs_prefix} '{content_name}' Word document downloaded at: {download_path}")
             except OSError as e:
                 logger.error(f"Failed to write Word document for '{content_name}' to {download_path}. OS error: {e}")
             except Exception as e:
                 logger.error(f"An unexpected error occurred while writing Word document for '{content_name}' to {download_path}. Error: {e}")
         else:
+            response.close()
             logger.error(f"Failed to download Word document for '{content_name}'. Status code: {response.status_code}")
 
     def safe_name(self,actual_name: str)-> str:
@@ -316,22 +685,52 @@ class ConfluenceAPIClient:
         # logger.debug(f"{self.logs_prefix} Safe FileName: {safe_name}")
         return safe_name
 
+    def _download_path(self, filename, download_dir) -> Path:
+        # Separate the filename into name and extension
+        name, ext = os.path.splitext(filename)
+        # Sanitize the name part and Recombine with the original extension
+        safe_filename = f"{self.safe_name(name)}{ext}"
+        # Determine the file path and create its folder
+        cwd = Path.cwd()
+        file_path = cwd / download_dir / safe_filename
+        file_path.parent.mkdir(parents=True, exist_ok=True)
+        os.chmod(cwd, 0o777)  # Ensure write permissions
+        return file_path
+
     def _save_file(self, content, filename, download_dir):
         file_path = ""
         try:
-            # Separate the filename into name and extension
-            name, ext = os.path.splitext(filename)
-            # logger.debug(f"Original filename: {filename} ext: {ext}")
-            # Sanitize the name part and Recombine with the original extension
-            safe_filename = f"{self.safe_name(name)}{ext}"
-            # Determine the file path and save the file
-            cwd = Path.cwd()
-            file_path = cwd / download_dir / safe_filename
-            file_path.parent.mkdir(parents=True, exist_ok=True)
-            os.chmod(cwd, 0o777)  # Ensure write permissions
+            file_path = self._download_path(filename, download_dir)
             with open(file_path, 'wb') as f:
                 f.write(content)
             
             return str(file_path)
         except Exception as e:
             raise ValueError(f"Failed to save file {file_path}: {e}")
+
+    def _save_stream(self, response, file_path) -> str:
+        """Write a streamed response to file_path chunk by chunk, memory use stays at one chunk whatever the size.
+
+        The body goes to a temporary file next to file_path which replaces it only once complete,
+        so an interrupted download never leaves a truncated file behind.
+        """
+        file_path = Path(file_path)
+        temp_fd, temp_path = tempfile.mkstemp(dir=file_path.parent, prefix=f".{file_path.name}.", suffix=".part")
+        total_bytes = 0
+        started_at = time.perf_counter()
+        try:
+            with response, os.fdopen(temp_fd, 'wb') as f:
+                for chunk in response.iter_content(chunk_size=self.instance_config.download_chunk_size):
+                    f.write(chunk)
+                    total_bytes += len(chunk)
+            os.replace(temp_path, file_path)
+        except Exception as e:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise ValueError(f"Failed to save file {file_path}: {e}") from e
+        self._log_download_rate(file_path, total_bytes, started_at)
+        return str(file_path)
+
+    def _log_download_rate(self, file_path: Path, total_bytes: int, started_at: float):
+        elapsed = max(time.perf_counter() - started_at, 1e-6)
+        logger.info(f"{self.logs_prefix} Downloaded '{file_path.name}' {total_bytes / 1e6:.2f} MB in {elapsed:.2f}s ({total_bytes / 1e6 / elapsed:.2f} MB/s)")
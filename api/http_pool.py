@@ -0,0 +1,35 @@
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
+import socket
+
+class PooledHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter sized from the instance config, with TCP keep-alive and pool usage counters.
+
+    ``pool_connections`` is the number of per-host pools kept, ``pool_maxsize`` the number of
+    connections kept alive per host. With ``pool_block`` workers wait for a free connection
+    instead of opening throwaway ones past ``pool_maxsize``.
+    """
+    def __init__(self, pool_connections: int = 10, pool_maxsize: int = 10, pool_block: bool = False, tcp_keepalive: bool = False, **kwargs):
+        self.socket_options = list(HTTPConnection.default_socket_options)
+        if tcp_keepalive:
+            self.socket_options.append((socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1))
+        super().__init__(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=pool_block, **kwargs)
+
+    def init_poolmanager(self, connections, maxsize, block=False, **pool_kwargs):
+        pool_kwargs['socket_options'] = self.socket_options
+        super().init_poolmanager(connections, maxsize, block=block, **pool_kwargs)
+
+    def get_pool_stats(self) -> dict:
+        # Every connection a pool opens costs a TCP (and TLS) handshake, everything else was a reused connection
+        stats = {'connections_opened': 0, 'requests_sent': 0, 'connections_idle': 0, 'pool_maxsize': self._pool_maxsize, 'pools': 0}
+        pools = self.poolmanager.pools
+        for key in pools.keys():
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            stats['pools'] += 1
+            stats['connections_opened'] += pool.num_connections
+            stats['requests_sent'] += pool.num_requests
+            if pool.pool is not None:
+                stats['connections_idle'] += sum(1 for connection in list(pool.pool.queue) if connection is not None)
+        return stats
@@ -0,0 +1,103 @@
+from bisect import bisect_left
+from typing import Dict, Optional
+import json
+import threading
+
+class MetricsRegistry:
+    """Thread-safe counters and histograms of one API client, keyed by metric name and labels.
+
+    Snapshots can be exported as JSON or in the Prometheus text exposition format.
+    """
+    # Upper bounds in seconds of the request latency buckets, the implicit last bucket is +Inf
+    LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+    PREFIX = "confluence_"
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, list] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple:
+        return (name, tuple(sorted((key, str(value)) for key, value in labels.items())))
+
+    def inc(self, name: str, value: float = 1, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name: str, value: float, **labels):
+        key = self._key(name, labels)
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                # Per bucket counts (+Inf last), sum and count of the observations
+                histogram = self.histograms[key] = [[0] * (len(self.LATENCY_BUCKETS) + 1), 0.0, 0]
+            histogram[0][bisect_left(self.LATENCY_BUCKETS, value)] += 1
+            histogram[1] += value
+            histogram[2] += 1
+
+    def value(self, name: str, **labels) -> float:
+        """Sum of the counter over every label set matching the given labels."""
+        wanted = {(key, str(value)) for key, value in labels.items()}
+        with self.lock:
+            return sum(value for (counter_name, counter_labels), value in self.counters.items() if counter_name == name and wanted.issubset(counter_labels))
+
+    def observe_request(self, category: str, action: str, status, seconds: float, bytes_sent: int = 0, bytes_received: int = 0):
+        endpoint = f"{category}.{action}"
+        self.inc("http_requests_total", endpoint=endpoint, status=status)
+        self.observe("http_request_duration_seconds", seconds, endpoint=endpoint)
+        if bytes_sent:
+            self.inc("http_sent_bytes_total", bytes_sent, endpoint=endpoint)
+        if bytes_received:
+            self.inc("http_received_bytes_total", bytes_received, endpoint=endpoint)
+
+    def slowest_endpoints(self, limit: int = 3) -> list:
+        """``(endpoint, mean seconds, count)`` of the endpoints with the highest mean latency."""
+        with self.lock:
+            means = [(dict(labels).get("endpoint", ""), histogram[1] / histogram[2], histogram[2]) for (name, labels), histogram in self.histograms.items() if name == "http_request_duration_seconds" and histogram[2]]
+        return sorted(means, key=lambda mean: mean[1], reverse=True)[:limit]
+
+    def snapshot(self) -> dict:
+        with self.lock:
+            counters = [{"name": name, "labels": dict(labels), "value": value} for (name, labels), value in self.counters.items()]
+            histograms = [
+                {"name": name, "labels": dict(labels), "buckets": dict(zip([*map(str, self.LATENCY_BUCKETS), "+Inf"], list(histogram[0]))), "sum": histogram[1], "count": histogram[2]}
+                for (name, labels), histogram in self.histograms.items()
+            ]
+        return {"counters": counters, "histograms": histograms}
+
+    def to_json(self, indent: Optional[int] = 2) -> str:
+        return json.dumps(self.snapshot(), indent=indent)
+
+    def to_prometheus(self, **extra_labels) -> str:
+        snapshot = self.snapshot()
+        lines = []
+        typed = set()
+        for counter in sorted(snapshot["counters"], key=lambda counter: counter["name"]):
+            name = self.PREFIX + counter["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} counter")
+                typed.add(name)
+            lines.append(f"{name}{self._format_labels({**extra_labels, **counter['labels']})} {counter['value']:g}")
+        for histogram in sorted(snapshot["histograms"], key=lambda histogram: histogram["name"]):
+            name = self.PREFIX + histogram["name"]
+            if name not in typed:
+                lines.append(f"# TYPE {name} histogram")
+                typed.add(name)
+            labels = {**extra_labels, **histogram["labels"]}
+            cumulative = 0
+            # Prometheus buckets are cumulative, the snapshot keeps per bucket counts
+            for upper_bound, count in histogram["buckets"].items():
+                cumulative += count
+                lines.append(f"{name}_bucket{self._format_labels({**labels, 'le': upper_bound})} {cumulative}")
+            lines.append(f"{name}_sum{self._format_labels(labels)} {histogram['sum']:g}")
+            lines.append(f"{name}_count{self._format_labels(labels)} {histogram['count']}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    def _format_labels(labels: dict) -> str:
+        if not labels:
+            return ""
+        escaped = {key: str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n") for key, value in labels.items()}
+        return "{" + ",".join(f'{key}="{value}"' for key, value in escaped.items()) + "}"
@@ -0,0 +1,60 @@
+from typing import BinaryIO
+import io
+import uuid
+
+class MultipartStream:
+    """Streaming ``multipart/form-data`` body with a single file field.
+
+    The file object is read chunk by chunk while the body is sent, so uploads never hold the whole
+    file in memory. ``len`` lets requests send a Content-Length instead of chunked encoding, which
+    Confluence rejects for attachment uploads. ``seek(0)`` rewinds the body for retries.
+    """
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, field_name: str, file_name: str, fileobj: BinaryIO, size: int, content_type: str = 'application/octet-stream'):
+        self.boundary = uuid.uuid4().hex
+        self.fileobj = fileobj
+        self.file_start = fileobj.tell()
+        # Same escaping as urllib3 (HTML5 form encoding) for names with quotes or line breaks
+        quoted_file_name = file_name.replace('"', '%22').replace('\r', '%0D').replace('\n', '%0A')
+        self.head = (
+            f'--{self.boundary}\r\n'
+            f'Content-Disposition: form-data; name="{field_name}"; filename="{quoted_file_name}"\r\n'
+            f'Content-Type: {content_type}\r\n\r\n'
+        ).encode('utf-8')
+        self.tail = f'\r\n--{self.boundary}--\r\n'.encode('utf-8')
+        self.len = len(self.head) + size + len(self.tail)
+        self.content_type = f'multipart/form-data; boundary={self.boundary}'
+        self.seek(0)
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if offset != 0 or whence != io.SEEK_SET:
+            raise io.UnsupportedOperation("MultipartStream can only be rewound to the start")
+        self.fileobj.seek(self.file_start)
+        self.chunks = self._iter_chunks()
+        self.current = b''
+        return 0
+
+    def read(self, size: int = -1) -> bytes:
+        if size is None or size < 0:
+            return b''.join(iter(lambda: self.read(self.CHUNK_SIZE), b''))
+        buffer = bytearray()
+        while len(buffer) < size:
+            if not self.current:
+                self.current = next(self.chunks, b'')
+                if not self.current:
+                    break
+            taken = self.current[:size - len(buffer)]
+            self.current = self.current[len(taken):]
+            buffer += taken
+        return bytes(buffer)
+
+    def _iter_chunks(self):
+        yield self.head
+        while chunk := self.fileobj.read(self.CHUNK_SIZE):
+            yield chunk
+        yield self.tail
+
+    def __iter__(self):
+        self.seek(0)
+        return iter(lambda: self.read(self.CHUNK_SIZE), b'')
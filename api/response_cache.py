@@ -0,0 +1,91 @@
+from collections import OrderedDict
+from typing import Iterable, Optional
+import threading
+import time
+
+class ResponseCache:
+    """Thread-safe LRU cache of GET responses with a time to live.
+
+    Fresh entries are served without a request. Expired entries that carried an ETag are kept
+    so the next request can revalidate them with If-None-Match, a 304 then reuses the cached body.
+    Entries are tagged with the content ids they describe, so writes can invalidate them. Content
+    entries also keep the version they were stored at, a later lookup of the current version of
+    that content revalidates them without an ETag.
+    """
+    def __init__(self, max_entries: int = 1024, ttl: float = 300):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.revalidations = 0
+
+    @staticmethod
+    def make_key(method: str, url: str, params: Optional[dict] = None) -> tuple:
+        return (method.upper(), url, tuple(sorted((params or {}).items())))
+
+    def lookup(self, key: tuple):
+        """Return ``(response, etag)``, response is only set while the entry is fresh."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None, None
+            self.entries.move_to_end(key)
+            response, etag, stored_at, _, version = entry
+            if time.monotonic() - stored_at < self.ttl:
+                self.hits += 1
+                return response, etag
+            if etag is None and version is None:
+                del self.entries[key]
+            self.misses += 1
+            return None, etag
+
+    def revalidated(self, key: tuple):
+        # Server answered 304 Not Modified, the cached entry is fresh for another ttl
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            self.entries[key] = (entry[0], entry[1], time.monotonic(), entry[3], entry[4])
+            self.revalidations += 1
+            return entry[0]
+
+    def revalidate_version(self, content_id, version) -> int:
+        """Every change of a content bumps its version: entries stored at ``version`` are fresh for another ttl,
+        entries stored at another version are dropped. Returns the number of entries revalidated."""
+        content_id = str(content_id)
+        revalidated = 0
+        with self.lock:
+            for key, entry in list(self.entries.items()):
+                if entry[4] is None or content_id not in entry[3]:
+                    continue
+                if entry[4] == version:
+                    self.entries[key] = (*entry[:2], time.monotonic(), *entry[3:])
+                    revalidated += 1
+                else:
+                    del self.entries[key]
+            self.revalidations += revalidated
+        return revalidated
+
+    def store(self, key: tuple, response, content_ids: Iterable[str] = (), version: Optional[int] = None):
+        with self.lock:
+            self.entries[key] = (response, response.headers.get('ETag'), time.monotonic(), frozenset(str(content_id) for content_id in content_ids), version)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def invalidate(self, content_ids: Optional[Iterable[str]] = None):
+        """Drop entries tagged with any of ``content_ids``, or everything when no ids are given."""
+        with self.lock:
+            if content_ids is None:
+                self.entries.clear()
+                return
+            content_ids = {str(content_id) for content_id in content_ids}
+            for key in [key for key, entry in self.entries.items() if entry[3] & content_ids]:
+                del self.entries[key]
+
+    def get_stats(self) -> dict:
+        with self.lock:
+            return {'hits': self.hits, 'misses': self.misses, 'revalidations': self.revalidations, 'entries': len(self.entries)}
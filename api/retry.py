@@ -0,0 +1,69 @@
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from typing import Optional
+import random
+
+class RetryPolicy:
+    """Retry rules for one category/action, loaded from the "retry" section of the api config.
+
+    Idempotent requests (GET, PUT, DELETE or actions marked idempotent) are retried on every
+    status in ``retry_statuses`` and on connection errors. Other POSTs are only retried when the
+    server cannot have processed them, i.e. on ``post_retry_statuses`` or when connecting failed.
+    A server's Retry-After is honored up to ``max_retry_after``, computed backoffs stay below ``max_backoff``.
+    """
+    IDEMPOTENT_METHODS = ('GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE')
+    DEFAULTS = {
+        'max_retries': 5,
+        'backoff_factor': 1.0,
+        'max_backoff': 60.0,
+        'max_retry_after': 900.0,
+        'retry_statuses': [429, 500, 502, 503, 504],
+        'post_retry_statuses': [429, 503],
+        'idempotent': False,
+    }
+
+    def __init__(self, policy_data: Optional[dict] = None):
+        policy = {**self.DEFAULTS, **(policy_data or {})}
+        self.max_retries: int = int(policy['max_retries'])
+        self.backoff_factor: float = float(policy['backoff_factor'])
+        self.max_backoff: float = float(policy['max_backoff'])
+        self.max_retry_after: float = float(policy['max_retry_after'])
+        self.retry_statuses = set(policy['retry_statuses'])
+        self.post_retry_statuses = set(policy['post_retry_statuses'])
+        self.idempotent: bool = policy['idempotent']
+
+    def is_idempotent(self, method: str) -> bool:
+        return self.idempotent or method.upper() in self.IDEMPOTENT_METHODS
+
+    def should_retry(self, method: str, status_code: int, attempt: int) -> bool:
+        if attempt >= self.max_retries:
+            return False
+        statuses = self.retry_statuses if self.is_idempotent(method) else self.post_retry_statuses
+        return status_code in statuses
+
+    def should_retry_error(self, method: str, connect_failed: bool, attempt: int) -> bool:
+        # A request that never connected can be resent safely, anything else only when idempotent
+        if attempt >= self.max_retries:
+            return False
+        return connect_failed or self.is_idempotent(method)
+
+    def get_delay(self, attempt: int, retry_after: Optional[str] = None) -> float:
+        retry_after_delay = self.parse_retry_after(retry_after)
+        if retry_after_delay is not None:
+            return min(retry_after_delay, self.max_retry_after)
+        # Full jitter, spreads retries of parallel workers instead of sending them in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff_factor * (2 ** attempt)))
+
+    @staticmethod
+    def parse_retry_after(retry_after: Optional[str]) -> Optional[float]:
+        if not retry_after:
+            return None
+        try:
+            return max(0.0, float(retry_after))
+        except ValueError:
+            pass
+        try:
+            retry_at = parsedate_to_datetime(retry_after)
+        except (TypeError, ValueError):
+            return None
+        return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
@@ -0,0 +1,224 @@
+from concurrent.futures import ProcessPoolExecutor
+from html.entities import name2codepoint
+from typing import Dict, List, NamedTuple, Optional
+from lxml import etree
+import multiprocessing
+import os
+import re
+import threading
+
+AC_NAMESPACE = "http://atlassian.com/content"
+RI_NAMESPACE = "http://atlassian.com/resource/identifier"
+AT_NAMESPACE = "http://atlassian.com/template"
+
+def _ac(name: str) -> str:
+    return f"{{{AC_NAMESPACE}}}{name}"
+
+def _ri(name: str) -> str:
+    return f"{{{RI_NAMESPACE}}}{name}"
+
+class TransformResult(NamedTuple):
+    body: str
+    valid: bool
+    macros: List[str]
+    error: str = ""
+
+class StorageTransform:
+    """Rewrites Confluence storage format bodies for another instance.
+
+    The rules are compiled once into a tag -> handler table, each body is then parsed once and walked
+    once: links, ``ri:`` resource references, user mentions, space keys and macros are rewritten in that
+    walk, which also validates the body and collects its macro names.
+    ``macro_rewrites`` maps a macro name to ``"drop"``, ``"unwrap"`` (keep its rich text body) or a new name.
+    """
+    # Storage bodies are fragments with undeclared ac:/ri: prefixes, they are parsed inside this wrapper
+    WRAPPER_START = f'<storage xmlns:ac="{AC_NAMESPACE}" xmlns:ri="{RI_NAMESPACE}" xmlns:at="{AT_NAMESPACE}">'
+    WRAPPER_END = "</storage>"
+    XML_ENTITIES = {"amp", "lt", "gt", "quot", "apos"}
+    # CDATA sections are matched as a whole so entity-like text inside them, e.g. in code macros, is left alone
+    ENTITY_PATTERN = re.compile(r"<!\[CDATA\[.*?\]\]>|&([A-Za-z][A-Za-z0-9]*);", re.DOTALL)
+    SPACE_KEY_PARAMETERS = {"spaceKey", "spaces", "space"}
+    SPACE_KEY_LIST_PATTERN = re.compile(r"[^,\s]+")
+
+    def __init__(self, space_keys: Optional[Dict[str, str]] = None, page_ids: Optional[Dict[str, str]] = None,
+                 user_accounts: Optional[Dict[str, str]] = None, site_urls: Optional[Dict[str, str]] = None,
+                 macro_rewrites: Optional[Dict[str, str]] = None):
+        self.space_keys = space_keys or {}
+        self.page_ids = {str(source_id): str(target_id) for source_id, target_id in (page_ids or {}).items()}
+        self.user_accounts = user_accounts or {}
+        self.site_urls = {source_url.rstrip('/'): target_url.rstrip('/') for source_url, target_url in (site_urls or {}).items() if source_url}
+        self.macro_rewrites = macro_rewrites or {}
+        self.page_id_pattern = re.compile(r"(pageId=|/pages/)(\d+)")
+        self.site_url_pattern = re.compile("^(" + "|".join(map(re.escape, self.site_urls)) + ")") if self.site_urls else None
+        self.handlers = self._compile_handlers()
+        self.local = threading.local()  # lxml parsers must not be shared between threads
+
+    def _compile_handlers(self) -> dict:
+        # Only rules with something to rewrite get a handler, macros are always visited to collect their names
+        handlers = {_ac("structured-macro"): self._visit_macro, _ac("macro"): self._visit_macro}
+        if self.space_keys or self.page_ids:
+            handlers[_ri("page")] = self._rewrite_page_reference
+        if self.space_keys:
+            handlers[_ri("space")] = self._rewrite_space_reference
+            handlers[_ri("blog-post")] = self._rewrite_space_reference
+            handlers[_ac("parameter")] = self._rewrite_space_parameter
+        if self.user_accounts:
+            handlers[_ri("user")] = self._rewrite_user_mention
+        if self.page_ids or self.site_urls:
+            handlers["a"] = self._rewrite_link
+        return handlers
+
+    @property
+    def parser(self) -> etree.XMLParser:
+        parser = getattr(self.local, 'parser', None)
+        if parser is None:
+            parser = self.local.parser = etree.XMLParser(resolve_entities=False, strip_cdata=False, huge_tree=True)
+        return parser
+
+    def _replace_entity(self, match) -> str:
+        # HTML named entities (&nbsp; ...) are not defined in XML, they become character references
+        name = match.group(1)
+        if name is None or name in self.XML_ENTITIES or name not in name2codepoint:
+            return match.group(0)
+        return f"&#{name2codepoint[name]};"
+
+    def parse(self, body: str):
+        return etree.fromstring(self.WRAPPER_START + self.ENTITY_PATTERN.sub(self._replace_entity, body or "") + self.WRAPPER_END, self.parser)
+
+    def validate(self, body: str) -> bool:
+        try:
+            self.parse(body)
+            return True
+        except etree.XMLSyntaxError:
+            return False
+
+    def transform(self, body: str) -> TransformResult:
+        try:
+            root = self.parse(body)
+        except etree.XMLSyntaxError as e:
+            return TransformResult(body, False, [], str(e))
+        macros = []
+        removals = []
+        for element in root.iter(tag=etree.Element):
+            handler = self.handlers.get(element.tag)
+            if handler is not None:
+                handler(element, macros, removals)
+        # Structural changes are applied after the walk, iterating a tree while detaching its nodes skips siblings
+        for element, rewrite in reversed(removals):
+            self._remove_macro(element, rewrite == "unwrap")
+        return TransformResult(self._serialize(root), True, macros)
+
+    def _serialize(self, root) -> str:
+        if root.text is None and len(root) == 0:
+            return ""
+        serialized = etree.tostring(root, encoding="unicode")
+        return serialized[serialized.index(">") + 1:-len(self.WRAPPER_END)]
+
+    def _visit_macro(self, element, macros: list, removals: list):
+        name = element.get(_ac("name"), "")
+        macros.append(name)
+        rewrite = self.macro_rewrites.get(name)
+        if rewrite in ("drop", "unwrap"):
+            removals.append((element, rewrite))
+        elif rewrite:
+            element.set(_ac("name"), rewrite)
+
+    def _remove_macro(self, element, keep_body: bool):
+        parent = element.getparent()
+        if parent is None:
+            return
+        rich_text_body = element.find(_ac("rich-text-body")) if keep_body else None
+        replacement = list(rich_text_body) if rich_text_body is not None else []
+        leading_text = rich_text_body.text if rich_text_body is not None else None
+        index = parent.index(element)
+        tail = element.tail
+        parent.remove(element)  # lxml removes the tail text together with the element
+        for offset, child in enumerate(replacement):
+            parent.insert(index + offset, child)
+        if replacement:
+            replacement[-1].tail = (replacement[-1].tail or "") + (tail or "")
+        else:
+            leading_text = (leading_text or "") + (tail or "")
+        if leading_text:
+            previous = parent[index - 1] if index > 0 else None
+            if previous is not None:
+                previous.tail = (previous.tail or "") + leading_text
+            else:
+                parent.text = (parent.text or "") + leading_text
+
+    def _rewrite_page_reference(self, element, macros: list, removals: list):
+        self._rewrite_space_reference(element, macros, removals)
+        content_id = element.get(_ri("content-id"))
+        if content_id in self.page_ids:
+            element.set(_ri("content-id"), self.page_ids[content_id])
+
+    def _rewrite_space_reference(self, element, macros: list, removals: list):
+        space_key = element.get(_ri("space-key"))
+        if space_key in self.space_keys:
+            element.set(_ri("space-key"), self.space_keys[space_key])
+
+    def _rewrite_space_parameter(self, element, macros: list, removals: list):
+        if element.get(_ac("name")) in self.SPACE_KEY_PARAMETERS and element.text:
+            element.text = self.SPACE_KEY_LIST_PATTERN.sub(lambda match: self.space_keys.get(match.group(0), match.group(0)), element.text)
+
+    def _rewrite_user_mention(self, element, macros: list, removals: list):
+        # Cloud mentions reference account ids, server ones user keys or user names
+        user = element.get(_ri("userkey")) or element.get(_ri("username"))
+        if user in self.user_accounts:
+            element.attrib.pop(_ri("userkey"), None)
+            element.attrib.pop(_ri("username"), None)
+            element.set(_ri("account-id"), self.user_accounts[user])
+
+    def _rewrite_link(self, element, macros: list, removals: list):
+        href = element.get("href")
+        if not href:
+            return
+        if self.site_url_pattern is not None:
+            href = self.site_url_pattern.sub(lambda match: self.site_urls[match.group(1)], href)
+        if self.page_ids:
+            href = self.page_id_pattern.sub(lambda match: match.group(1) + self.page_ids.get(match.group(2), match.group(2)), href)
+        element.set("href", href)
+
+_worker_transform: Optional[StorageTransform] = None
+
+def _initialize_worker(spec: dict):
+    # Every pool process compiles the rules once, only the bodies are sent per task
+    global _worker_transform
+    _worker_transform = StorageTransform(**spec)
+
+def _transform_in_worker(body: str) -> TransformResult:
+    return _worker_transform.transform(body)
+
+class StorageTransformPool:
+    """Runs a StorageTransform over batches of bodies, in a process pool once a batch is large enough.
+
+    Rewriting is CPU bound, in worker processes it does not hold the GIL the I/O threads need.
+    Small batches are transformed in process, the pool is only started for the first large one.
+    """
+    def __init__(self, spec: dict, max_workers: int = 0, pool_threshold: int = 200):
+        self.spec = spec
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.pool_threshold = pool_threshold
+        self.transformer = StorageTransform(**spec)
+        self.executor = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def transform(self, bodies: List[str]) -> List[TransformResult]:
+        if self.max_workers == 1 or len(bodies) < self.pool_threshold:
+            return [self.transformer.transform(body) for body in bodies]
+        if self.executor is None:
+            # Forking the threaded GUI process could copy locks held by other threads (e.g. logging) into the workers
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                                initializer=_initialize_worker, initargs=(self.spec,))
+        chunk_size = max(1, len(bodies) // (self.max_workers * 4))
+        return list(self.executor.map(_transform_in_worker, bodies, chunksize=chunk_size))
+
+    def close(self):
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
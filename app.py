@@ -1,6 +1,8 @@
 from utils.logger import Logger
 from typing import Optional
 from api.client import ConfluenceAPIClient
+from api.async_client import AsyncConfluenceAPIClient
+from api.storage_transform import StorageTransformPool, TransformResult
 from browser.selenium_driver import ConfluenceBrowserClient
 from config.config_loader import ConfluenceConfig
 from config.config_types import ConfluenceInstance
@@ -10,12 +12,25 @@ from models.gui.sections.settings_form import SettingsForm
 from models.tree.tree import ConfluencePagesTree
 from models.tree.page_node import ConfluencePageNode
 from models.tree.attachment_node import ConfluenceAttachmentNode
+from models.tree.attachment_pipeline import AttachmentTransferPipeline, attachment_uploads, journal_attachment, unjournaled_attachments
+from models.tree.migration_journal import MigrationJournal
 from tkinter import ttk
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta, timezone
+from itertools import repeat
+from operator import attrgetter
+from pathlib import Path
+import asyncio
+import hashlib
+import requests
 import threading
 import time
 logger = Logger()
 
 class ConfluenceSpacesApp:
+    SYNC_WATERMARK_MARGIN = timedelta(minutes=5)
+    PLACEHOLDER_BODY = "Text will follow soon!"
+
     def __init__(self, root, **kwargs):
         self.root = root
         self.notebook = ttk.Notebook(self.root)
@@ -41,6 +56,10 @@ class ConfluenceSpacesApp:
 
         # Target
         self.target_space_id = None
+        self.target_title_index = None
+        self.title_index_lock = threading.Lock()
+        self.migration_journal = None
+        self.journal_lock = threading.Lock()
         self.target_tree: ConfluencePagesTree = Optional[ConfluencePagesTree]
         self.target_instance = self.app_config.find_instance_by_key("target")
         self.target_api_client = ConfluenceAPIClient(instance_config=self.target_instance,api_config=self.app_config.api_config_data)
@@ -54,9 +73,11 @@ class ConfluenceSpacesApp:
         self.actions_section.update_action_command("save","target",{"command": lambda: threading.Thread(target=self.target_tree.save_tree_to_file_as_json()).start()})
         self.actions_section.update_action_command("create_pages","create_pages_only",{"command": lambda: threading.Thread(target=self.create_pages).start()})
         self.actions_section.update_action_command("create_pages","create_pages_with_attachments",{"command": lambda: threading.Thread(target=self.create_pages, kwargs={'with_attachments': True}).start()})
+        self.actions_section.update_action_command("copy_pages","copy_pages_rest",{"command": lambda: threading.Thread(target=self.copy_pages_rest).start()})
         self.actions_section.update_action_command("copy_pages","copy_pages_source_mode",{"command": lambda: threading.Thread(target=self.copy_pages).start()})
         self.actions_section.update_action_command("copy_pages","copy_pages_edit_mode",{"command": lambda: threading.Thread(target=self.copy_pages, kwargs={'edit_mode': True}).start()})
         self.actions_section.update_action_command("copy_pages","copy_attachments",{"command": lambda: threading.Thread(target=self.copy_attachments).start()})
+        self.actions_section.update_action_command("copy_pages","sync_changes",{"command": lambda: threading.Thread(target=self.sync_pages).start()})
         self.actions_section.update_action_command("export","pdf",{"command": lambda: threading.Thread(target=self.download_pdfs).start()})
         self.actions_section.update_action_command("export","word",{"command": lambda: threading.Thread(target=self.download_words).start()})
         self.actions_section.update_action_command("download","attachments",{"command": lambda: threading.Thread(target=self.download_attachments).start()})
@@ -105,7 +126,7 @@ class ConfluenceSpacesApp:
         root_page = self.source_api_client.get_content(self.source_instance.root_page_id)
         root_node = ConfluencePageNode.from_api_response(root_page.json(), self.source_instance.confluence_type)
         self.source_tree = ConfluencePagesTree(root_node, self.source_api_client)
-        self.source_tree.build_tree(self.source_instance.confluence_type, from_label=self.source_instance.label, exclude_page_ids=self.source_instance.exclude_ids)
+        self._build_tree(self.source_tree, self.source_instance, self.source_api_client)
         self.source_tree.print_pages()
         self.source_space_id = self.source_api_client.get_space_id(self.source_instance.space_key)
         self.source_stats.update_current_user_groups(self.source_api_client.get_user_groups())
@@ -128,7 +149,7 @@ class ConfluenceSpacesApp:
         root_page = self.target_api_client.get_content(self.target_instance.root_page_id)
         root_node = ConfluencePageNode.from_api_response(root_page.json(), self.target_instance.confluence_type)
         self.target_tree = ConfluencePagesTree(root_node, self.target_api_client)
-        self.target_tree.build_tree(self.target_instance.confluence_type, from_label=self.target_instance.label, exclude_page_ids=self.target_instance.exclude_ids)
+        self._build_tree(self.target_tree, self.target_instance, self.target_api_client)
         self.target_tree.print_pages()
         self.target_space_id = self.target_api_client.get_space_id(self.target_instance.space_key)
         self.target_stats.update_current_user_groups(self.target_api_client.get_user_groups())
@@ -136,6 +157,16 @@ class ConfluenceSpacesApp:
         self.actions_section.update_button_state("save", "readonly", "normal")
         self._update_req_stats()
 
+    def _build_tree(self, tree: ConfluencePagesTree, instance: ConfluenceInstance, api_client: ConfluenceAPIClient):
+        if instance.async_requests:
+            asyncio.run(self._build_tree_async(tree, instance, api_client))
+        else:
+            tree.build_tree(instance.confluence_type, from_label=instance.label, exclude_page_ids=instance.exclude_ids)
+
+    async def _build_tree_async(self, tree: ConfluencePagesTree, instance: ConfluenceInstance, api_client: ConfluenceAPIClient):
+        async with AsyncConfluenceAPIClient.from_client(api_client) as async_client:
+            await tree.build_tree_async(instance.confluence_type, async_client, from_label=instance.label, exclude_page_ids=instance.exclude_ids)
+
     def _initialize_browser_and_login(self, instance, api_client: ConfluenceAPIClient):
         browser = ConfluenceBrowserClient()
         browser.initialize_driver()
@@ -162,6 +193,7 @@ class ConfluenceSpacesApp:
             "total_attachments_created": self.target_api_client.total_attachments_created
         })
         self._update_req_stats()  # Final stats update
+        self._export_metrics()
         return result
 
     def create_pages(self, with_attachments: bool = False):
@@ -170,7 +202,9 @@ class ConfluenceSpacesApp:
         stats_thread = threading.Thread(target=self._update_stats_realtime, args=(stop_event,))
         stats_thread.start()
         try: # Create pages in order, which can take time
+            self._record_sync_start()
             self.target_tree = None
+            self._refresh_target_title_index()
             root_page = self.target_api_client.get_content(self.target_instance.root_page_id)
             root_node = ConfluencePageNode.from_api_response(root_page.json(), self.target_instance.confluence_type)
             self.target_tree = ConfluencePagesTree(root_node, self.target_api_client)
@@ -180,77 +214,365 @@ class ConfluenceSpacesApp:
             stop_event.set()  # Signal the stats thread to stop
             stats_thread.join()  # Wait for the stats thread to finish
         self._update_req_stats()  # Final stats update
+        self._export_metrics()
         
-    def _create_page(self,parent_id,source_node: ConfluencePageNode,with_attachments: bool = False):
-        self._update_req_stats()
-        payload = {
-            "title": str(source_node.title),
-            "spaceId": str(self.target_space_id),
-            "body": {
-                "storage": {
-                    "value": "Text will follow soon!",
-                    "representation": "storage"
-                }
-            }
-        }
-        if parent_id:
-            payload["parentId"] = parent_id
-        created_page_id = self.target_api_client.create_content(payload,self.target_instance.space_key)
-        self.target_api_client.add_automation_label(content_id=created_page_id,automation_label=self.target_instance.label)
-        if len(source_node.labels) > 0:
-            self.target_api_client.add_labels(created_page_id, source_node.labels)
+    def _create_page(self,parent_id,source_node: ConfluencePageNode,with_attachments: bool = False, body: Optional[str] = None, record_body: bool = False):
+        journal = self._migration_journal()
+        labels = [label for label in (self.target_instance.label, *source_node.labels) if label]
+        created_page_id = journal.lookup(MigrationJournal.PAGE, source_node.id)
+        if created_page_id:
+            logger.info(f"Page '{source_node.title}' was created by an earlier run ({created_page_id}), skipping it")
+        else:
+            title_index = self._target_title_index()
+            created_page_id = title_index.get(source_node.title)
+            if created_page_id:
+                # Titles are unique per space, so an existing page is reused instead of failing the create
+                logger.warning(f"Page '{source_node.title}' already exists on target ({created_page_id}), reusing it")
+            else:
+                page_body = body or source_node.body or self.PLACEHOLDER_BODY
+                response, labels_applied = self._create_target_page(parent_id, source_node, page_body, labels)
+                if response.status_code in [200, 201]:
+                    created_page_id = response.json()['id']
+                    if record_body and page_body != self.PLACEHOLDER_BODY:
+                        journal.record(MigrationJournal.BODY, source_node.id, created_page_id, source_node.version)
+                else:
+                    logger.warning(f"Error Creating Page '{source_node.title}': {response.status_code} {response.text[:200]}")
+                    # Title taken since the index was loaded, the page that won the race is used instead
+                    created_page_id = self._lookup_target_page_id(source_node.title)
+                    if not created_page_id and response.status_code == 400 and page_body != self.PLACEHOLDER_BODY:
+                        # Otherwise the target rejected the body, e.g. a macro unknown to it, the copy step writes it later
+                        logger.warning(f"Creating page '{source_node.title}' with a placeholder body")
+                        response, labels_applied = self._create_target_page(parent_id, source_node, self.PLACEHOLDER_BODY, labels)
+                        if response.status_code in [200, 201]:
+                            created_page_id = response.json()['id']
+                    if not created_page_id:
+                        logger.error(f"Could not create page '{source_node.title}', skipping it with all sub pages: {response.status_code} {response.text[:200]}")
+                        return None
+                # Labels are part of the create request (v1) or sent right after it (v2), failed ones are retried below
+                if labels_applied:
+                    journal.record(MigrationJournal.LABELS, source_node.id, created_page_id)
+                title_index[source_node.title] = created_page_id
+            journal.record(MigrationJournal.PAGE, source_node.id, created_page_id)
+        if not journal.lookup(MigrationJournal.LABELS, source_node.id):
+            # Reused pages, or pages whose run stopped before their labels were applied
+            if not labels or self.target_api_client.add_labels(created_page_id, labels).status_code == 200:
+                journal.record(MigrationJournal.LABELS, source_node.id, created_page_id)
         if with_attachments:
             self.download_and_upload_attachments(source_node, created_page_id)
         return created_page_id
 
+    def _create_target_page(self, parent_id, source_node: ConfluencePageNode, body: str, labels: list) -> tuple:
+        return self.target_api_client.create_page(
+            title=str(source_node.title),
+            body=body,
+            space_key=self.target_instance.space_key,
+            space_id=self.target_space_id,
+            parent_id=parent_id,
+            labels=labels
+        )
+
+    def _lookup_target_page_id(self, title: str) -> Optional[str]:
+        try:
+            return self.target_api_client.get_page_id(title=title, space_key=self.target_instance.space_key)
+        except (IndexError, KeyError):
+            return None
+
+    def _migration_journal(self) -> MigrationJournal:
+        # One journal per source/target space pair and target root page, a different pair in the settings opens its own
+        journal_name = f"{self.source_api_client.safe_name(self.source_instance.name)}-{self.source_instance.space_key}_to_{self.target_api_client.safe_name(self.target_instance.name)}-{self.target_instance.space_key}-{self.target_instance.root_page_id}.sqlite"
+        journal_file = Path(self.download_dir) / "journal" / journal_name
+        with self.journal_lock:
+            if self.migration_journal is None or self.migration_journal.journal_file != str(journal_file):
+                if self.migration_journal is not None:
+                    self.migration_journal.close()
+                journal_file.parent.mkdir(parents=True, exist_ok=True)
+                self.migration_journal = MigrationJournal(str(journal_file))
+            return self.migration_journal
+
+    def _target_title_index(self) -> dict:
+        # Title -> page id of every target space page, loaded once per run so title conflicts cost no requests
+        # Creation workers share it, the lock lets only the first of them load it
+        with self.title_index_lock:
+            if self.target_title_index is None:
+                self.target_title_index = {page['title']: page['id'] for page in self.target_api_client.list_space_pages(self.target_instance.space_key)}
+                logger.info(f"Loaded {len(self.target_title_index)} target page titles from space '{self.target_instance.space_key}'")
+                self._prune_migration_journal(self.target_title_index.values())
+            return self.target_title_index
+
+    def _refresh_target_title_index(self) -> dict:
+        # Pages may have been added or deleted on the target since the last run
+        with self.title_index_lock:
+            self.target_title_index = None
+        return self._target_title_index()
+
+    def _prune_migration_journal(self, target_page_ids):
+        # Steps journaled for target pages deleted since, e.g. to rerun a migration, are redone instead of skipped
+        if not target_page_ids:
+            return
+        forgotten_steps = self._migration_journal().prune([*target_page_ids, self.target_instance.root_page_id])
+        if forgotten_steps:
+            logger.warning(f"Forgot {forgotten_steps} journaled steps whose target pages no longer exist")
+
     def create_pages_in_order(self, node: Optional[ConfluencePageNode] = None, parent_id: Optional[str] = None, with_attachments: bool = False):
-        self._update_req_stats()
+        # Level by level: parents exist before their children, the pages of one level are created concurrently
         if node is None:
             node = self.source_tree.root
+        started_at = time.perf_counter()
+        created_pages = 0
+        frontier = [(node, parent_id)]
+        # Batches bound the number of bodies loaded at once, as in copy_pages_rest
+        batch_size = self.app_config.api_config_data.get('body_copy', {}).get('batch_size', 100)
+        with ThreadPoolExecutor(max_workers=self.target_instance.create_workers, thread_name_prefix=f"{self.target_instance.name}-creator") as executor, self._storage_transform_pool() as transform_pool:
+            while frontier:
+                created_page_ids = []
+                for start in range(0, len(frontier), batch_size):
+                    batch = frontier[start:start + batch_size]
+                    # Bodies missing from the tree are loaded by the I/O threads, then rewritten by the transform pool
+                    bodies = list(executor.map(self._load_source_body, (source_node for source_node, _ in batch)))
+                    transformed = iter(transform_pool.transform([body for body in bodies if body is not None]))
+                    transformed = [next(transformed) if body is not None else None for body in bodies]
+                    # executor.map yields results in submission order, so created ids line up with their source nodes
+                    created_page_ids += executor.map(self._create_page_in_level, batch, transformed, repeat(with_attachments))
+                siblings = {}
+                for (_, sibling_parent_id), created_page_id in zip(frontier, created_page_ids):
+                    if created_page_id:
+                        siblings.setdefault(sibling_parent_id, []).append(created_page_id)
+                list(executor.map(self._restore_sibling_order, siblings.keys(), siblings.values()))
+                created_pages += sum(map(len, siblings.values()))
+                frontier = [(child_node, created_page_id) for (source_node, _), created_page_id in zip(frontier, created_page_ids) if created_page_id for child_node in source_node.children]
+                logger.info(f"Created {created_pages} pages in {time.perf_counter() - started_at:.1f}s, next level: {len(frontier)} pages")
+
+    def _load_source_body(self, source_node: ConfluencePageNode) -> Optional[str]:
         try:
-            logger.info(f"Creating page '{node.title}'")
-            node.labels = [label['name'] for label in self.source_api_client.get_labels(node.id)]
-            node.child_pages = self.source_api_client.get_child_pages(node.id)
-            created_page_id = self._create_page(parent_id=parent_id, source_node=node, with_attachments=with_attachments)
-            for child_node in node.child_pages:
-                self.create_pages_in_order(child_node, created_page_id, with_attachments)
+            return source_node.body
         except Exception as e:
-            logger.error(f"Error Creating Page with title: '{node.title}' Reason: {str(e)}")
+            logger.error(f"Error Loading Body of Page '{source_node.title}' Reason: {str(e)}")
+            return None
 
-    def download_and_upload_attachments(self,source_node: ConfluencePageNode, target_page_id:str):
-        self.source_tree.fetch_attachments(source_node)
-        if len(source_node.child_attachments) > 0:
-            for attachment in source_node.child_attachments:
+    def _create_page_in_level(self, page_and_parent: tuple, transformed: Optional[TransformResult], with_attachments: bool = False) -> Optional[str]:
+        source_node, parent_id = page_and_parent
+        if transformed is None:
+            # The body could not be loaded, the page is skipped like one that could not be created
+            return None
+        try:
+            logger.info(f"Creating page '{source_node.title}'")
+            return self._create_page(parent_id=parent_id, source_node=source_node, with_attachments=with_attachments, body=transformed.body)
+        except Exception as e:
+            # The subtree of a page that could not be created is skipped
+            logger.error(f"Error Creating Page with title: '{source_node.title}' Reason: {str(e)}")
+            return None
+
+    def _storage_transform_pool(self, page_ids: Optional[dict] = None) -> StorageTransformPool:
+        # Rewrites source space, site and page references in bodies to their target counterparts
+        transform_config = self.app_config.api_config_data.get('storage_transform', {})
+        spec = {
+            "space_keys": {self.source_instance.space_key: self.target_instance.space_key} if self.source_instance.space_key != self.target_instance.space_key else {},
+            "page_ids": page_ids or {},
+            "user_accounts": transform_config.get('user_accounts', {}),
+            "site_urls": {self._base_url(self.source_instance): self._base_url(self.target_instance)},
+            "macro_rewrites": transform_config.get('macro_rewrites', {}).get(self.target_instance.confluence_type, {})
+        }
+        return StorageTransformPool(spec, max_workers=transform_config.get('process_workers', 0), pool_threshold=transform_config.get('process_pool_threshold', 200))
+
+    def _base_url(self, instance: ConfluenceInstance) -> str:
+        return f"{instance.site_url.rstrip('/')}/wiki" if instance.confluence_type == 'cloud' else instance.site_url.rstrip('/')
+
+    def _restore_sibling_order(self, parent_id: str, page_ids: list):
+        # Concurrent creates land in completion order, pages are moved only when that differs from the source order
+        if len(page_ids) < 2:
+            return
+        journal = self._migration_journal()
+        # Keyed by the exact sibling list, a parent that gained children since is ordered again
+        siblings_key = hashlib.sha1(",".join(map(str, page_ids)).encode()).hexdigest()
+        if journal.lookup(MigrationJournal.ORDER, parent_id, siblings_key):
+            return
+        wanted_ids = set(page_ids)
+        try:
+            target_order = [page['id'] for page in self.target_api_client.iter_child_pages(parent_id, profile="ids") if page['id'] in wanted_ids]
+        except requests.exceptions.HTTPError as e:
+            # The order is not journaled, the next run restores it
+            logger.warning(f"Could not list the children of page {parent_id} to restore their order: {e}")
+            return
+        # Reused pages living under another parent are left where they are
+        listed_ids = set(target_order)
+        page_ids = [page_id for page_id in page_ids if page_id in listed_ids]
+        if target_order == page_ids:
+            journal.record(MigrationJournal.ORDER, parent_id, parent_id, siblings_key)
+            return
+        first_mismatch = next(index for index, (page_id, target_id) in enumerate(zip(page_ids, target_order)) if page_id != target_id)
+        if first_mismatch == 0:
+            self.target_api_client.move_page(page_ids[0], 'before', target_order[0])
+        for index in range(max(first_mismatch, 1), len(page_ids)):
+            response = self.target_api_client.move_page(page_ids[index], 'after', page_ids[index - 1])
+            if response.status_code != 200:
+                logger.warning(f"Could not move page {page_ids[index]} after {page_ids[index - 1]}: {response.text[:200]}")
+        journal.record(MigrationJournal.ORDER, parent_id, parent_id, siblings_key)
+        logger.debug(f"Reordered {len(page_ids) - max(first_mismatch, 1)} children of page {parent_id}")
+
+    def download_and_upload_attachments(self,source_node: ConfluencePageNode, target_page_id:str, attachments: Optional[list] = None, target_attachments: Optional[dict] = None):
+        journal = self._migration_journal()
+        attachments = list(attachments if attachments is not None else self.source_tree.iter_attachments(source_node))
+        if not attachments:
+            logger.warning(f"No attachments Found for '{source_node.title}'")
+        # Attachments journaled by an earlier run are skipped without listing the target page
+        pending_attachments = unjournaled_attachments(attachments, journal)
+        if len(pending_attachments) < len(attachments):
+            logger.info(f"Skipping {len(attachments) - len(pending_attachments)} attachments of '{source_node.title}' copied by an earlier run")
+        # Listed once per page, so re-runs only transfer new or changed files
+        if pending_attachments and target_attachments is None:
+            target_attachments = self._list_target_attachments(target_page_id)
+        for attachment, target_attachment_id in attachment_uploads(pending_attachments, target_attachments or {}, target_page_id, journal):
+            if self.target_instance.relay_attachments:
+                response = self._relay_attachment(source_node, attachment, target_page_id, target_attachment_id)
+            else:
                 logger.info(f"Downloading attachment '{attachment.title}' from page '{source_node.title}'")
                 file_path = self.source_api_client.download_attachment(source_node.id, attachment.title,f"{self.download_dir}/{self.source_instance.name}")
                 logger.info(f"Uploading attachment '{attachment.title}' to target page '{target_page_id}'")
-                self.target_api_client.create_attachment(content_id=target_page_id, attachment_name=attachment.title, file_path=file_path)
-        else:
-            logger.warning(f"No attachments Found for '{source_node.title}'")
+                response = self.target_api_client.create_attachment(content_id=target_page_id, attachment_name=attachment.title, file_path=file_path, attachment_id=target_attachment_id)
+            if response is not None and response.status_code in [200, 201]:
+                journal_attachment(journal, attachment, target_page_id)
         self._update_req_stats()
 
+    def _list_target_attachments(self, target_page_id: str) -> dict:
+        return {attachment_data['title']: ConfluenceAttachmentNode.from_api_response(attachment_data) for attachment_data in self.target_api_client.iter_attachments(target_page_id)}
+
+    def _relay_attachment(self, source_node: ConfluencePageNode, attachment, target_page_id: str, target_attachment_id: Optional[str] = None):
+        # Source download is spooled in memory (or a temp file past relay_buffer_size) and uploaded from there
+        logger.info(f"Relaying attachment '{attachment.title}' from page '{source_node.title}' to target page '{target_page_id}'")
+        spool, size = self.source_api_client.spool_attachment(source_node.id, attachment.title)
+        if spool is None:
+            logger.error(f"Failed to download attachment '{attachment.title}' from page '{source_node.title}'")
+            return None
+        with spool:
+            return self.target_api_client.create_attachment_from_stream(content_id=target_page_id, attachment_name=attachment.title, fileobj=spool, size=size, attachment_id=target_attachment_id)
+
     def copy_pages(self, edit_mode: bool = False, **kwargs):
-        if self.target_tree is None:
-            logger.warn_tree_not_initialized(is_source=False)
+        if not self._can_pair_pages():
             return
 
         def copy_logic():
-            browser = ConfluenceBrowserClient()
-            browser.initialize_driver()
-            self._login_to_instances(browser)
+            self._record_sync_start()
+            self._copy_pages_in_browser(self._matched_page_pairs(), edit_mode)
+        return self.execute_with_stats_update(copy_logic, **kwargs)
 
-            self.target_tree.rearrange_trees(self.source_tree.root)
-            for source_node, new_node in zip(self.source_tree.traverse_tree(), self.target_tree.traverse_tree()):
-                if edit_mode and not self._is_page_editable(source_node):
-                    continue
-                if source_node.title == new_node.title:
-                    self._perform_copy_paste(browser, source_node, new_node, edit_mode)
-                    self.total_pages_copied += 1
-                else:
-                    logger.warning(f"Warning: Titles do not match. Original: '{source_node.title}', Target: '{new_node.title}'")
-            browser.close_driver()
+    def copy_pages_rest(self, **kwargs):
+        if not self._can_pair_pages():
+            return
+
+        def copy_logic():
+            # Bodies go through the content update endpoint, the browser only copies pages with macros REST can not carry over
+            body_copy_config = self.app_config.api_config_data.get('body_copy', {})
+            batch_size = body_copy_config.get('batch_size', 100)
+            browser_only_macros = set(body_copy_config.get('browser_only_macros', []))
+            self._record_sync_start()
+            journal = self._migration_journal()
+            page_pairs = self._matched_page_pairs()
+            page_ids = {source_node.id: new_node.id for source_node, new_node in page_pairs}
+            # Bodies copied from the same source version by an earlier run are skipped
+            pending_pairs = [(source_node, new_node) for source_node, new_node in page_pairs if not journal.lookup(MigrationJournal.BODY, source_node.id, source_node.version)]
+            if len(pending_pairs) < len(page_pairs):
+                logger.info(f"Skipping {len(page_pairs) - len(pending_pairs)} page bodies copied by an earlier run")
+            page_pairs = pending_pairs
+            browser_pairs = []
+            started_at = time.perf_counter()
+            with ThreadPoolExecutor(max_workers=self.target_instance.copy_workers, thread_name_prefix=f"{self.target_instance.name}-copier") as executor, self._storage_transform_pool(page_ids) as transform_pool:
+                # Batches bound the number of bodies loaded at once when they are kept in a body store
+                for start in range(0, len(page_pairs), batch_size):
+                    batch = page_pairs[start:start + batch_size]
+                    # Bodies are loaded by the threads and rewritten in worker processes, the threads then do the updates
+                    transformed = transform_pool.transform(list(executor.map(attrgetter('body'), (source_node for source_node, _ in batch))))
+                    for page_pair, outcome in zip(batch, executor.map(self._copy_page_body, batch, transformed, repeat(browser_only_macros))):
+                        if outcome == "copied":
+                            self.total_pages_copied += 1
+                        elif outcome == "browser":
+                            browser_pairs.append(page_pair)
+                    logger.info(f"Copied {self.total_pages_copied}/{len(page_pairs)} page bodies in {time.perf_counter() - started_at:.1f}s")
+            if browser_pairs:
+                logger.info(f"Copying {len(browser_pairs)} pages in the browser")
+                self._copy_pages_in_browser(browser_pairs)
         return self.execute_with_stats_update(copy_logic, **kwargs)
 
+    def _can_pair_pages(self) -> bool:
+        # Pages are paired through the journaled id mapping, a fetched target tree is only needed without one
+        if isinstance(self.target_tree, ConfluencePagesTree) or self._migration_journal().count(MigrationJournal.PAGE):
+            return True
+        logger.warn_tree_not_initialized(is_source=False)
+        return False
+
+    def _matched_page_pairs(self) -> list:
+        # Source pages are looked up in the id mapping journaled when their target pages were created.
+        # Pages created before it existed are matched by title in the fetched target tree, which seeds the mapping.
+        # Mapped target pages deleted since are dropped from the mapping by the next create or sync, which reload the target titles
+        journal = self._migration_journal()
+        target_titles = {}
+        if isinstance(self.target_tree, ConfluencePagesTree):
+            for target_node in self.target_tree.traverse_tree():
+                target_titles.setdefault(target_node.title, []).append(target_node)
+        page_pairs = []
+        for source_node in self.source_tree.traverse_tree():
+            target_page_id = journal.lookup(MigrationJournal.PAGE, source_node.id)
+            if target_page_id:
+                target_node = self.target_tree.get_node(target_page_id) if isinstance(self.target_tree, ConfluencePagesTree) else None
+                new_node = target_node or self._mapped_target_node(source_node, target_page_id)
+            else:
+                candidates = target_titles.get(source_node.title, [])
+                if len(candidates) != 1:
+                    logger.warning(f"Warning: No target page mapped for '{source_node.title}'{f' and {len(candidates)} target pages share its title' if candidates else ''}, skipping it")
+                    continue
+                new_node = candidates[0]
+                journal.record(MigrationJournal.PAGE, source_node.id, new_node.id)
+            page_pairs.append((source_node, new_node))
+        return page_pairs
+
+    def _mapped_target_node(self, source_node: ConfluencePageNode, target_page_id: str) -> ConfluencePageNode:
+        # Stand-in for a target page that is not in a fetched tree, its version is looked up when the body is written
+        return ConfluencePageNode(page_id=target_page_id, title=source_node.title, edit_link=f"/pages/editpage.action?pageId={target_page_id}")
+
+    def _copy_page_body(self, page_pair: tuple, transformed: TransformResult, browser_only_macros: set) -> str:
+        source_node, new_node = page_pair
+        if not transformed.valid:
+            logger.warning(f"Body of page '{source_node.title}' is not well-formed ({transformed.error}), leaving it to the browser copy")
+            return "browser"
+        unsupported_macros = browser_only_macros.intersection(transformed.macros)
+        if unsupported_macros:
+            logger.info(f"Page '{source_node.title}' uses macros {sorted(unsupported_macros)}, leaving it to the browser copy")
+            return "browser"
+        try:
+            response = self.target_api_client.update_content(new_node.id, new_node.title, transformed.body, version_number=new_node.version or None)
+            if response.status_code == 409:
+                # The target page changed since its tree was fetched, the update is retried on its current version
+                response = self.target_api_client.update_content(new_node.id, new_node.title, transformed.body)
+        except Exception as e:
+            logger.error(f"Error Copying Page '{source_node.title}' Reason: {str(e)}")
+            return "failed"
+        if response.status_code == 200:
+            new_node.version = response.json().get('version', {}).get('number', new_node.version)
+            self._migration_journal().record(MigrationJournal.BODY, source_node.id, new_node.id, source_node.version)
+            logger.debug(f"Copied body of page '{source_node.title}' to {new_node.id}")
+            return "copied"
+        if response.status_code == 400:
+            # Storage format the target rejects, e.g. macros unknown to it, may still paste in the editor
+            logger.warning(f"Target rejected body of page '{source_node.title}', leaving it to the browser copy: {response.text[:200]}")
+            return "browser"
+        logger.warning(f"Error Copying Page '{source_node.title}': {response.status_code} {response.text[:200]}")
+        return "failed"
+
+    def _copy_pages_in_browser(self, page_pairs: list, edit_mode: bool = False):
+        journal = self._migration_journal()
+        browser = ConfluenceBrowserClient()
+        browser.initialize_driver()
+        self._login_to_instances(browser)
+        for source_node, new_node in page_pairs:
+            if journal.lookup(MigrationJournal.BODY, source_node.id, source_node.version):
+                logger.info(f"Page '{source_node.title}' was copied by an earlier run, skipping it")
+                continue
+            if edit_mode and not self._is_page_editable(source_node):
+                continue
+            self._perform_copy_paste(browser, source_node, new_node, edit_mode)
+            journal.record(MigrationJournal.BODY, source_node.id, new_node.id, source_node.version)
+            self.total_pages_copied += 1
+        browser.close_driver()
+
     def _login_to_instances(self, browser):
         self._login_to_instance(browser, self.source_instance, same_tab=True)
         self._login_to_instance(browser, self.target_instance, same_tab=False)
@@ -297,20 +619,159 @@ class ConfluenceSpacesApp:
             edit_mode=edit_mode
         )
 
-    def copy_attachments(self):
+    def copy_attachments(self, **kwargs):
         def copy_logic():
-            if self.target_tree == None:
-                logger.warn_tree_not_initialized(is_source=False)
+            if not self._can_pair_pages():
                 return 
             logger.info("Copying Attachments to target pages...")
-            self.target_tree.rearrange_trees(self.source_tree.root)
-            for source_node, new_node in zip(self.source_tree.traverse_tree(), self.target_tree.traverse_tree()):
-                if source_node.title == new_node.title:
-                    logger.info(f"Copying attachments from page '{source_node.title}'")
-                    self.download_and_upload_attachments(source_node, new_node.id)
+            self._record_sync_start()
+            node_pairs = [(source_node, new_node.id) for source_node, new_node in self._matched_page_pairs()]
+            if self.source_instance.async_requests or self.target_instance.async_requests:
+                asyncio.run(self._copy_attachments_async(node_pairs))
+            else:
+                self._attachment_pipeline(journal=self._migration_journal()).copy((source_node.id, target_page_id) for source_node, target_page_id in node_pairs)
             self._update_req_stats()
         return self.execute_with_stats_update(copy_logic, **kwargs)
 
+    async def _copy_attachments_async(self, node_pairs: list):
+        async with AsyncConfluenceAPIClient.from_client(self.source_api_client) as source_client, AsyncConfluenceAPIClient.from_client(self.target_api_client) as target_client:
+            await asyncio.gather(*(self._download_and_upload_attachments_async(source_client, target_client, source_node, target_page_id) for source_node, target_page_id in node_pairs))
+
+    async def _download_and_upload_attachments_async(self, source_client: AsyncConfluenceAPIClient, target_client: AsyncConfluenceAPIClient, source_node: ConfluencePageNode, target_page_id: str):
+        journal = self._migration_journal()
+        # Listed per run and not kept on the node, so a rerun does not upload them twice
+        attachments = [attachment async for attachment in self.source_tree.iter_attachments_async(source_client, source_node)]
+        if not attachments:
+            logger.warning(f"No attachments Found for '{source_node.title}'")
+            return
+        # Attachments journaled by an earlier run are skipped without listing the target page
+        pending_attachments = unjournaled_attachments(attachments, journal)
+        if not pending_attachments:
+            logger.info(f"All attachments of '{source_node.title}' were copied by an earlier run")
+            return
+        target_attachments = {attachment_data['title']: ConfluenceAttachmentNode.from_api_response(attachment_data) async for attachment_data in target_client.iter_attachments(target_page_id)}
+        for attachment, target_attachment_id in attachment_uploads(pending_attachments, target_attachments, target_page_id, journal):
+            if self.target_instance.relay_attachments:
+                logger.info(f"Relaying attachment '{attachment.title}' from page '{source_node.title}' to target page '{target_page_id}'")
+                spool, size = await source_client.spool_attachment(source_node.id, attachment.title)
+                if spool is None:
+                    logger.error(f"Failed to download attachment '{attachment.title}' from page '{source_node.title}'")
+                    continue
+                with spool:
+                    response = await target_client.create_attachment_from_stream(content_id=target_page_id, attachment_name=attachment.title, fileobj=spool, size=size, attachment_id=target_attachment_id)
+            else:
+                # Pages are processed concurrently, so every page gets its own download folder
+                file_path = await source_client.download_attachment(source_node.id, attachment.title, f"{self.download_dir}/{self.source_instance.name}/{source_node.id}")
+                logger.info(f"Uploading attachment '{attachment.title}' to target page '{target_page_id}'")
+                response = await target_client.create_attachment(content_id=target_page_id, attachment_name=attachment.title, file_path=file_path, attachment_id=target_attachment_id)
+            if response.status_code in [200, 201]:
+                journal_attachment(journal, attachment, target_page_id)
+
+    def sync_pages(self, **kwargs):
+        def sync_logic():
+            root_page_id = self.source_instance.root_page_id
+            scope = f"(id = {root_page_id} or ancestor = {root_page_id})"
+            watermark = self.source_instance.last_synced_at
+            if not watermark:
+                # The watermark is recorded when create/copy starts, without it there is no migration to sync from
+                logger.warning("No previous migration found. Run create/copy first for a full migration.")
+                return
+
+            logger.info(f"Syncing pages modified since '{watermark}'...")
+            new_watermark = watermark
+            failed_pages = []
+            self._refresh_target_title_index()
+            journal = self._migration_journal()
+            target_page_ids = {}  # source page id -> target page id
+            # CQL results are unordered, sorting by depth creates new parents before their new children
+            modified_pages = sorted(self.source_api_client.search_content(f'{scope} and type = page and lastmodified >= "{watermark}"', expand=self.source_api_client.EXPAND_PROFILES["tree_flat"]), key=lambda page_data: len(page_data.get('ancestors', [])))
+            source_nodes = [ConfluencePageNode.from_api_response(page_data, self.source_instance.confluence_type) for page_data in modified_pages]
+            with self._storage_transform_pool(journal.targets(MigrationJournal.PAGE)) as transform_pool:
+                transformed = transform_pool.transform([source_node.body for source_node in source_nodes])
+            for page_data, source_node, transformed_body in zip(modified_pages, source_nodes, transformed):
+                new_watermark = max(new_watermark, self._to_cql_date(page_data['version']['when']))
+                if journal.lookup(MigrationJournal.BODY, source_node.id, source_node.version):
+                    continue  # synced by an earlier run that did not complete
+                if not transformed_body.valid:
+                    logger.warning(f"Body of page '{source_node.title}' is not well-formed ({transformed_body.error}), syncing it unchanged")
+                    transformed_body = transformed_body._replace(body=source_node.body)
+                target_page_id, created = self._find_or_create_target_page(source_node, page_data.get('ancestors', []), target_page_ids, body=transformed_body.body)
+                if not target_page_id:
+                    failed_pages.append(source_node.title)
+                elif not created:
+                    logger.info(f"Updating target page '{source_node.title}' ({target_page_id})")
+                    outcome = self._copy_page_body((source_node, self._mapped_target_node(source_node, target_page_id)), transformed_body, set())
+                    if outcome == "copied":
+                        self.total_pages_copied += 1
+                    else:
+                        failed_pages.append(source_node.title)
+
+            # Attachments can change without a new page version, so they are synced by their own watermark query
+            modified_attachments = {}
+            for attachment_data in self.source_api_client.search_content(f'type = attachment and space = "{self.source_instance.space_key}" and lastmodified >= "{watermark}"', expand="version,container,container.ancestors"):
+                new_watermark = max(new_watermark, self._to_cql_date(attachment_data['version']['when']))
+                container = attachment_data.get('container', {})
+                if str(container.get('id')) != str(root_page_id) and str(root_page_id) not in [str(ancestor['id']) for ancestor in container.get('ancestors', [])]:
+                    continue
+                modified_attachments.setdefault(container['id'], (container, []))[1].append(ConfluenceAttachmentNode.from_api_response(attachment_data))
+            for container, attachments in modified_attachments.values():
+                source_node = ConfluencePageNode.from_api_response(container, self.source_instance.confluence_type)
+                target_page_id, _ = self._find_or_create_target_page(source_node, container.get('ancestors', []), target_page_ids)
+                if target_page_id:
+                    self.download_and_upload_attachments(source_node, target_page_id, attachments=attachments)
+
+            if failed_pages:
+                # The next sync starts from the same watermark, pages synced by this one are skipped through the journal
+                logger.warning(f"Could not sync {len(failed_pages)} pages ({', '.join(failed_pages[:10])}), keeping the sync watermark at '{watermark}'")
+                return
+            self._save_sync_watermark(new_watermark)
+            logger.info(f"Synced {len(target_page_ids)} pages, next sync starts from '{new_watermark}'")
+        return self.execute_with_stats_update(sync_logic, **kwargs)
+
+    def _find_or_create_target_page(self, source_node: ConfluencePageNode, ancestors: list, target_page_ids: dict, body: Optional[str] = None) -> tuple:
+        # Returns the target page id, None when it could not be found or created, and whether it was created now
+        if source_node.id in target_page_ids:
+            return target_page_ids[source_node.id], False
+        journal = self._migration_journal()
+        if str(source_node.id) == str(self.source_instance.root_page_id):
+            target_page_id = self.target_instance.root_page_id
+        else:
+            target_page_id = journal.lookup(MigrationJournal.PAGE, source_node.id) or self._find_target_page_id(source_node.title)
+        created = False
+        if not target_page_id:
+            parent = ancestors[-1] if ancestors else None
+            if parent is None:
+                logger.warning(f"No target page found for '{source_node.title}', skipping.")
+                return None, False
+            parent_id = self.target_instance.root_page_id if str(parent['id']) == str(self.source_instance.root_page_id) else journal.lookup(MigrationJournal.PAGE, parent['id']) or self._find_target_page_id(parent['title'])
+            if not parent_id:
+                logger.warning(f"No target parent found for new page '{source_node.title}', skipping.")
+                return None, False
+            logger.info(f"Creating new page '{source_node.title}' under target page {parent_id}")
+            # New pages are created with their body and journal it, an update would only add a second version
+            target_page_id = self._create_page(parent_id=parent_id, source_node=source_node, body=body, record_body=body is not None)
+            created = target_page_id is not None
+        target_page_ids[source_node.id] = target_page_id
+        return target_page_id, created
+
+    def _find_target_page_id(self, title: str) -> Optional[str]:
+        return self._target_title_index().get(title)
+
+    def _save_sync_watermark(self, watermark: str):
+        self.source_instance.last_synced_at = watermark
+        self.app_config.update_config({"source": self.source_instance.to_dict()})
+
+    def _record_sync_start(self):
+        # Edits made once a create/copy has started may not be in the target, the first sync has to pick them up
+        if not self.source_instance.last_synced_at:
+            self._save_sync_watermark(self._to_cql_date(datetime.now(timezone.utc).isoformat()))
+
+    def _to_cql_date(self, timestamp: str) -> str:
+        # CQL compares dates with minute precision in the timezone of the requesting user, e.g. "2024-05-01 10:22".
+        # That is taken to be the local one, the margin covers clock skew and edits saved while the watermark was taken
+        when = datetime.fromisoformat(timestamp.replace("Z", "+00:00")).astimezone() - self.SYNC_WATERMARK_MARGIN
+        return when.strftime("%Y-%m-%d %H:%M")
+
     def download_pdfs(self):
         if self.source_tree == None:
             logger.warn_tree_not_initialized(is_source=True)
@@ -333,15 +794,22 @@ class ConfluenceSpacesApp:
         if self.source_tree == None:
             logger.warn_tree_not_initialized(is_source=True)
             return 
-        for page in self.source_tree.traverse_tree():
-            self.source_tree.fetch_attachments(page)
-            if len(page.child_attachments) > 0:
-                for attachment in page.child_attachments:
-                    logger.info(f"Downloading attachment '{attachment.title}' from page '{page.title}'")
-                    file_path = self.source_api_client.download_attachment(page.id, attachment.title,f"{self.download_dir}/attachments/{self.source_api_client.safe_name(page.title)}")
-                    logger.debug(f"Downloaded attachment to {file_path}")
+        pages = ((page.id, f"{self.download_dir}/attachments/{self.source_api_client.safe_name(page.title)}") for page in self.source_tree.traverse_tree())
+        self._attachment_pipeline().download(pages)
         self._update_req_stats()
 
+    def _attachment_pipeline(self, journal: Optional[MigrationJournal] = None) -> AttachmentTransferPipeline:
+        # Listing, downloads and the byte budget follow the source instance settings, uploads the target ones
+        return AttachmentTransferPipeline(
+            source_client=self.source_api_client,
+            target_client=self.target_api_client,
+            list_workers=self.source_instance.attachment_list_workers,
+            download_workers=self.source_instance.attachment_download_workers,
+            upload_workers=self.target_instance.attachment_upload_workers,
+            max_in_flight_bytes=self.source_instance.max_in_flight_bytes,
+            journal=journal
+        )
+
     def _update_stats_realtime(self, stop_event):
         #Continuously updates the stats until the stop_event is set. param stop_event: Event to signal when to stop updating stats.
         while not stop_event.is_set():
@@ -361,14 +829,28 @@ class ConfluenceSpacesApp:
         elif confluence_type == 'server':
             return f"{site_url}{edit_url}"
 
+    def _export_metrics(self):
+        metrics_dir = f"{self.download_dir}/metrics"
+        for client in (self.source_api_client, self.target_api_client):
+            try:
+                client.export_metrics(metrics_dir)
+            except OSError as e:
+                logger.warning(f"Could not export metrics of {client.instance_config.name}: {e}")
+
     def _update_req_stats(self):
+        source_cache_stats = self.source_api_client.response_cache.get_stats()
+        target_cache_stats = self.target_api_client.response_cache.get_stats()
+        self.source_stats.update_from_metrics(self.source_api_client.metrics)
         threading.Thread(target=self.source_stats.update_stats({
-            "total_http_requests": self.source_api_client.total_requests,
-            "successful_http_requests": self.source_api_client.total_success,
-            "failed_http_requests": self.source_api_client.total_failed
+            "opened_http_connections": self.source_api_client.get_pool_stats().get('connections_opened', 'n/a'),
+            "cache_hits": source_cache_stats['hits'] + source_cache_stats['revalidations'],
+            "cache_misses": source_cache_stats['misses'],
+            "deduplicated_http_requests": self.source_api_client.single_flight.shared
         })).start()
+        self.target_stats.update_from_metrics(self.target_api_client.metrics)
         threading.Thread(target=self.target_stats.update_stats({
-            "total_http_requests": self.target_api_client.total_requests,
-            "successful_http_requests": self.target_api_client.total_success,
-            "failed_http_requests": self.target_api_client.total_failed
+            "opened_http_connections": self.target_api_client.get_pool_stats().get('connections_opened', 'n/a'),
+            "cache_hits": target_cache_stats['hits'] + target_cache_stats['revalidations'],
+            "cache_misses": target_cache_stats['misses'],
+            "deduplicated_http_requests": self.target_api_client.single_flight.shared
         })).start()
\ No newline at end of file
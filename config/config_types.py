@@ -68,6 +68,27 @@ class ConfluenceInstance:
         self.exclude_ids: str = config_data.get('exclude_ids', [])
         self.fetch_pages_limit: int = config_data.get('fetch_pages_limit', '')
         self.fetch_attachments_limit: int = config_data.get('fetch_attachments_limit', '')
+        self.fetch_workers: int = int(config_data.get('fetch_workers', 1) or 1)
+        self.fetch_mode: str = config_data.get('fetch_mode', 'recursive')
+        self.use_tree_cache: bool = config_data.get('use_tree_cache', False)
+        self.body_store_dir: str = config_data.get('body_store_dir', '')
+        self.last_synced_at: str = config_data.get('last_synced_at', '')
+        self.async_requests: bool = config_data.get('async_requests', False)
+        self.max_in_flight_requests: int = int(config_data.get('max_in_flight_requests', 100) or 100)
+        self.pool_connections: int = int(config_data.get('pool_connections', 10) or 10)
+        self.pool_maxsize: int = int(config_data.get('pool_maxsize', 10) or 10)
+        self.pool_block: bool = config_data.get('pool_block', False)
+        self.keep_alive: bool = config_data.get('keep_alive', True)
+        self.tcp_keepalive: bool = config_data.get('tcp_keepalive', False)
+        self.download_chunk_size: int = int(config_data.get('download_chunk_size', 1048576) or 1048576)
+        self.relay_attachments: bool = config_data.get('relay_attachments', True)
+        self.relay_buffer_size: int = int(config_data.get('relay_buffer_size', 8388608) or 8388608)
+        self.attachment_list_workers: int = int(config_data.get('attachment_list_workers', 2) or 2)
+        self.attachment_download_workers: int = int(config_data.get('attachment_download_workers', 4) or 4)
+        self.attachment_upload_workers: int = int(config_data.get('attachment_upload_workers', 4) or 4)
+        self.max_in_flight_bytes: int = int(config_data.get('max_in_flight_bytes', 268435456) or 268435456)
+        self.create_workers: int = int(config_data.get('create_workers', 8) or 8)
+        self.copy_workers: int = int(config_data.get('copy_workers', 8) or 8)
         self.credentials: ConfluenceCredential = ConfluenceCredential(config_data=config_data.get('credentials',{}))
 
     def to_dict(self) -> Dict[str, Any]:
@@ -81,6 +102,27 @@ class ConfluenceInstance:
             'label': self.label,
             'fetch_pages_limit':self.fetch_pages_limit,
             'fetch_attachments_limit':self.fetch_attachments_limit,
+            'fetch_workers': self.fetch_workers,
+            'fetch_mode': self.fetch_mode,
+            'use_tree_cache': self.use_tree_cache,
+            'body_store_dir': self.body_store_dir,
+            'last_synced_at': self.last_synced_at,
+            'async_requests': self.async_requests,
+            'max_in_flight_requests': self.max_in_flight_requests,
+            'pool_connections': self.pool_connections,
+            'pool_maxsize': self.pool_maxsize,
+            'pool_block': self.pool_block,
+            'keep_alive': self.keep_alive,
+            'tcp_keepalive': self.tcp_keepalive,
+            'download_chunk_size': self.download_chunk_size,
+            'relay_attachments': self.relay_attachments,
+            'relay_buffer_size': self.relay_buffer_size,
+            'attachment_list_workers': self.attachment_list_workers,
+            'attachment_download_workers': self.attachment_download_workers,
+            'attachment_upload_workers': self.attachment_upload_workers,
+            'max_in_flight_bytes': self.max_in_flight_bytes,
+            'create_workers': self.create_workers,
+            'copy_workers': self.copy_workers,
             'exclude_ids': self.exclude_ids,
             'credentials': self.credentials.to_dict(),  # Convert credentials to dict
         }
@@ -107,6 +149,48 @@ class ConfluenceInstance:
             self.fetch_pages_limit = data['fetch_pages_limit']
         if data.get('fetch_attachments_limit') != self.fetch_attachments_limit:
             self.fetch_attachments_limit = data['fetch_attachments_limit']
+        if 'fetch_workers' in data and data['fetch_workers'] != self.fetch_workers:
+            self.fetch_workers = int(data['fetch_workers'] or 1)
+        if 'fetch_mode' in data and data['fetch_mode'] != self.fetch_mode:
+            self.fetch_mode = data['fetch_mode']
+        if 'use_tree_cache' in data and data['use_tree_cache'] != self.use_tree_cache:
+            self.use_tree_cache = data['use_tree_cache']
+        if 'body_store_dir' in data and data['body_store_dir'] != self.body_store_dir:
+            self.body_store_dir = data['body_store_dir']
+        if 'last_synced_at' in data and data['last_synced_at'] != self.last_synced_at:
+            self.last_synced_at = data['last_synced_at']
+        if 'async_requests' in data and data['async_requests'] != self.async_requests:
+            self.async_requests = data['async_requests']
+        if 'max_in_flight_requests' in data and data['max_in_flight_requests'] != self.max_in_flight_requests:
+            self.max_in_flight_requests = int(data['max_in_flight_requests'] or 100)
+        if 'pool_connections' in data and data['pool_connections'] != self.pool_connections:
+            self.pool_connections = int(data['pool_connections'] or 10)
+        if 'pool_maxsize' in data and data['pool_maxsize'] != self.pool_maxsize:
+            self.pool_maxsize = int(data['pool_maxsize'] or 10)
+        if 'pool_block' in data and data['pool_block'] != self.pool_block:
+            self.pool_block = data['pool_block']
+        if 'keep_alive' in data and data['keep_alive'] != self.keep_alive:
+            self.keep_alive = data['keep_alive']
+        if 'tcp_keepalive' in data and data['tcp_keepalive'] != self.tcp_keepalive:
+            self.tcp_keepalive = data['tcp_keepalive']
+        if 'download_chunk_size' in data and data['download_chunk_size'] != self.download_chunk_size:
+            self.download_chunk_size = int(data['download_chunk_size'] or 1048576)
+        if 'relay_attachments' in data and data['relay_attachments'] != self.relay_attachments:
+            self.relay_attachments = data['relay_attachments']
+        if 'relay_buffer_size' in data and data['relay_buffer_size'] != self.relay_buffer_size:
+            self.relay_buffer_size = int(data['relay_buffer_size'] or 8388608)
+        if 'attachment_list_workers' in data and data['attachment_list_workers'] != self.attachment_list_workers:
+            self.attachment_list_workers = int(data['attachment_list_workers'] or 2)
+        if 'attachment_download_workers' in data and data['attachment_download_workers'] != self.attachment_download_workers:
+            self.attachment_download_workers = int(data['attachment_download_workers'] or 4)
+        if 'attachment_upload_workers' in data and data['attachment_upload_workers'] != self.attachment_upload_workers:
+            self.attachment_upload_workers = int(data['attachment_upload_workers'] or 4)
+        if 'max_in_flight_bytes' in data and data['max_in_flight_bytes'] != self.max_in_flight_bytes:
+            self.max_in_flight_bytes = int(data['max_in_flight_bytes'] or 268435456)
+        if 'create_workers' in data and data['create_workers'] != self.create_workers:
+            self.create_workers = int(data['create_workers'] or 8)
+        if 'copy_workers' in data and data['copy_workers'] != self.copy_workers:
+            self.copy_workers = int(data['copy_workers'] or 8)
         if 'credentials' in data:
             self.credentials.from_dict(data['credentials'])
 
@@ -2,6 +2,7 @@ from app import ConfluenceSpacesApp
 from utils.logger import Logger
 import tkinter as tk
 import argparse
+import multiprocessing
 
 def parse_arguments():
     parser = argparse.ArgumentParser(description="Confluence Spaces Tool")
@@ -38,5 +39,6 @@ def main():
     root.mainloop()
 
 if __name__ == "__main__":
+    multiprocessing.freeze_support()  # Storage transform worker processes of the frozen executable start here
     main()
     
@@ -24,9 +24,11 @@ class ActionsSection:
         "copy_pages": {
             "text": "Copy",
             "options": {
+                "copy_pages_rest": {"text": "Copy Content (REST)", "command": lambda: logger.info("Copying page bodies to target confluence space through the REST API...")},
                 "copy_pages_source_mode": {"text": "Copy Content (Source View)", "command": lambda: logger.info("Visual Copy for Pages to target confluence space using Confluence Source View Module...")},
                 "copy_pages_edit_mode": {"text": "Copy Content (Edit View)", "command": lambda: logger.info("Visual Copy for Pages to target confluence space  by editing view mode...")},
                 "copy_attachments": {"text": "Copy Attachments", "command": lambda: logger.info("Copy Attachments to target confluence space...")},
+                "sync_changes": {"text": "Sync Changed Pages", "command": lambda: logger.info("Syncing pages changed since the last sync to target confluence space...")},
             },
             "description": "Copy Content from Source to Target Space."
         },
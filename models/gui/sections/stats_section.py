@@ -1,6 +1,5 @@
 import tkinter as tk
 from tkinter import ttk
-from . import logger
 class StatsTable:
     DEFAULTS = {
         "root_page_title": "n/a",
@@ -16,6 +15,13 @@ class StatsTable:
         "total_http_requests": "n/a",
         "successful_http_requests": "n/a",
         "failed_http_requests": "n/a",
+        "retried_http_requests": "n/a",
+        "opened_http_connections": "n/a",
+        "cache_hits": "n/a",
+        "cache_misses": "n/a",
+        "deduplicated_http_requests": "n/a",
+        "received_http_megabytes": "n/a",
+        "slowest_endpoint": "n/a",
     }
 
     def __init__(self, parent, title="Stats Table", row=0, column=0, padx=5, pady=5, sticky="nw", config=None):
@@ -89,6 +95,18 @@ class StatsTable:
             if key in self.labels:
                 self.labels[key].config(text=value)
 
+    def update_from_metrics(self, metrics):
+        # Request counters of an api client MetricsRegistry
+        slowest = metrics.slowest_endpoints(limit=1)
+        self.update_stats({
+            "total_http_requests": int(metrics.value("requests_total")),
+            "successful_http_requests": int(metrics.value("requests_total", outcome="success")),
+            "failed_http_requests": int(metrics.value("requests_total", outcome="failure")),
+            "retried_http_requests": int(metrics.value("http_retries_total")),
+            "received_http_megabytes": f"{metrics.value('http_received_bytes_total') / 1e6:.2f}",
+            "slowest_endpoint": f"{slowest[0][0]} {slowest[0][1] * 1000:.0f} ms" if slowest else "n/a",
+        })
+
     def update_current_user_groups(self, current_user_groups):
         self.current_user_groups_listbox.delete(0, tk.END)
         for group in current_user_groups:
@@ -1,15 +1,18 @@
-# No imports needed
+from typing import Optional
+import sys
 
 class ConfluenceAttachmentNode:
+    __slots__ = ('id', 'type', 'status', 'title', 'mediatype', 'file_size', 'media_type_description', 'download_link', 'webui_link')
+
     def __init__(self, id: str, type: str, status: str, title: str, mediatype: str, file_size: int = 0,
                  media_type_description: str = "", download_link: str = "", webui_link: str = ""):
         self.id = id
-        self.type = type
-        self.status = status
+        self.type = sys.intern(type)
+        self.status = sys.intern(status)
         self.title = title
-        self.mediatype = mediatype
+        self.mediatype = sys.intern(mediatype)
         self.file_size = file_size
-        self.media_type_description = media_type_description
+        self.media_type_description = sys.intern(media_type_description)
         self.download_link = download_link
         self.webui_link = webui_link
 
@@ -20,12 +23,16 @@ class ConfluenceAttachmentNode:
             type=response['type'],
             status=response['status'],
             title=response['title'],
-            mediatype=response['metadata']['mediaType'],
-            file_size=response['extensions'].get('fileSize', 0),
-            media_type_description=response['extensions'].get('mediaTypeDescription', ''),
+            mediatype=response.get('metadata', {}).get('mediaType', ''),
+            file_size=response.get('extensions', {}).get('fileSize', 0),
+            media_type_description=response.get('extensions', {}).get('mediaTypeDescription', ''),
             download_link=response['_links'].get('download', ''),
             webui_link=response['_links'].get('webui', ''),
         )
 
+    def is_same_file(self, other: Optional['ConfluenceAttachmentNode']) -> bool:
+        # The REST API exposes no content hash, name, size and media type are the closest fingerprint
+        return other is not None and self.title == other.title and self.file_size == other.file_size and self.mediatype == other.mediatype
+
     def __str__(self) -> str:
         return f
\ No newline at end of file
@@ -0,0 +1,202 @@
+from typing import Callable, Iterable, List, Optional, Tuple
+from .attachment_node import ConfluenceAttachmentNode
+from .migration_journal import MigrationJournal
+from api.client import ConfluenceAPIClient
+from . import logger
+from concurrent.futures import ThreadPoolExecutor
+import queue
+import threading
+import time
+
+def unjournaled_attachments(attachments: Iterable[ConfluenceAttachmentNode], journal: Optional[MigrationJournal]) -> List[ConfluenceAttachmentNode]:
+    """Attachments not copied by an earlier run, a page left without any needs no target listing."""
+    if journal is None:
+        return list(attachments)
+    return [attachment for attachment in attachments if not journal.lookup(MigrationJournal.ATTACHMENT, attachment.id, MigrationJournal.attachment_item(attachment))]
+
+def attachment_uploads(attachments: Iterable[ConfluenceAttachmentNode], target_attachments: dict, target_page_id: str,
+                       journal: Optional[MigrationJournal]) -> List[Tuple[ConfluenceAttachmentNode, Optional[str]]]:
+    """``(attachment, target attachment id)`` of the attachments that are new or changed on the target page.
+
+    ``target_attachments`` maps titles to the attachments of the target page. Changed files are uploaded as a
+    new version of the target attachment, the id is None for new ones. Unchanged files are journaled and left out.
+    """
+    uploads = []
+    for attachment in attachments:
+        target_attachment = target_attachments.get(attachment.title)
+        if attachment.is_same_file(target_attachment):
+            logger.debug(f"Skipping unchanged attachment '{attachment.title}' on target page '{target_page_id}'")
+            journal_attachment(journal, attachment, target_page_id)
+            continue
+        uploads.append((attachment, target_attachment.id if target_attachment else None))
+    return uploads
+
+def journal_attachment(journal: Optional[MigrationJournal], attachment: ConfluenceAttachmentNode, target_page_id: str):
+    if journal is not None:
+        journal.record(MigrationJournal.ATTACHMENT, attachment.id, target_page_id, MigrationJournal.attachment_item(attachment))
+
+class ByteBudget:
+    """Counting semaphore over bytes, caps the size of attachments held between download and upload.
+
+    An attachment larger than the whole budget is admitted once nothing else is in flight, so it
+    can never block the pipeline forever.
+    """
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.in_flight = 0
+        self.condition = threading.Condition()
+
+    def acquire(self, size: int):
+        with self.condition:
+            self.condition.wait_for(lambda: self.in_flight == 0 or self.in_flight + size <= self.max_bytes)
+            self.in_flight += size
+
+    def release(self, size: int):
+        with self.condition:
+            self.in_flight -= size
+            self.condition.notify_all()
+
+class _TransferJob:
+    __slots__ = ('source_page_id', 'attachment', 'target_page_id', 'target_attachment_id', 'download_dir', 'reserved_bytes', 'size')
+
+    def __init__(self, source_page_id: str, attachment: ConfluenceAttachmentNode, target_page_id: str = None, target_attachment_id: str = None, download_dir: str = None):
+        self.source_page_id = source_page_id
+        self.attachment = attachment
+        self.target_page_id = target_page_id
+        self.target_attachment_id = target_attachment_id
+        self.download_dir = download_dir
+        self.reserved_bytes = attachment.file_size or 0  # Share of the byte budget, taken from the listing
+        self.size = self.reserved_bytes
+
+class AttachmentTransferPipeline:
+    """Three stage attachment transfer: listing, a download pool and an upload pool connected by queues.
+
+    Listing workers enumerate the attachments of each page (and of its target page, so unchanged files
+    are skipped), download workers spool them from the source and upload workers relay them to the
+    target. The bytes between download and upload are capped by ``max_in_flight_bytes``, the bounded
+    queues keep listing from running far ahead of the transfers. With a ``journal``, copied attachments are
+    recorded and skipped on later runs, a page whose attachments are all journaled is not listed on the target.
+    """
+    def __init__(self, source_client: ConfluenceAPIClient, target_client: Optional[ConfluenceAPIClient] = None,
+                 list_workers: int = 2, download_workers: int = 4, upload_workers: int = 4, max_in_flight_bytes: int = 268435456,
+                 journal: Optional[MigrationJournal] = None):
+        self.source_client = source_client
+        self.target_client = target_client
+        self.journal = journal
+        self.list_workers = list_workers
+        self.download_workers = download_workers
+        self.upload_workers = upload_workers
+        self.budget = ByteBudget(max_in_flight_bytes)
+        self.stats_lock = threading.Lock()
+        self.stats = {}
+
+    def copy(self, page_pairs: Iterable[Tuple[str, str]]) -> dict:
+        """Copy the attachments of every ``(source_page_id, target_page_id)`` pair."""
+        return self._run(page_pairs, self._list_copy_jobs, self._spool, self._upload)
+
+    def download(self, pages: Iterable[Tuple[str, str]]) -> dict:
+        """Download the attachments of every ``(page_id, download_dir)`` pair to disk."""
+        return self._run(pages, self._list_download_jobs, self._download_to_disk)
+
+    def _run(self, pages: Iterable[tuple], list_jobs: Callable, download: Callable, upload: Optional[Callable] = None) -> dict:
+        self.stats = {'listed': 0, 'skipped': 0, 'transferred': 0, 'failed': 0, 'bytes': 0}
+        download_queue = queue.Queue(maxsize=self.download_workers * 4)
+        upload_queue = queue.Queue(maxsize=self.upload_workers * 4)
+        started_at = time.perf_counter()
+
+        download_threads = [threading.Thread(target=self._download_worker, args=(download_queue, upload_queue if upload else None, download), name=f"attachment-download-{i}") for i in range(self.download_workers)]
+        upload_threads = [threading.Thread(target=self._upload_worker, args=(upload_queue, upload), name=f"attachment-upload-{i}") for i in range(self.upload_workers)] if upload else []
+        for thread in download_threads + upload_threads:
+            thread.start()
+        try:
+            with ThreadPoolExecutor(max_workers=self.list_workers, thread_name_prefix="attachment-list") as executor:
+                for _ in executor.map(lambda page: self._list_page(list_jobs, page, download_queue), pages):
+                    pass
+        finally:
+            # One sentinel per worker shuts a stage down once everything queued before it is done
+            for _ in download_threads:
+                download_queue.put(None)
+            for thread in download_threads:
+                thread.join()
+            for _ in upload_threads:
+                upload_queue.put(None)
+            for thread in upload_threads:
+                thread.join()
+
+        elapsed = max(time.perf_counter() - started_at, 1e-6)
+        logger.info(f"Attachments: {self.stats['transferred']} transferred, {self.stats['skipped']} unchanged, {self.stats['failed']} failed of {self.stats['listed']} listed, {self.stats['bytes'] / 1e6:.2f} MB in {elapsed:.1f}s ({self.stats['bytes'] / 1e6 / elapsed:.2f} MB/s)")
+        return self.stats
+
+    def _count(self, **increments):
+        with self.stats_lock:
+            for key, value in increments.items():
+                self.stats[key] += value
+
+    def _list_page(self, list_jobs: Callable, page: tuple, download_queue: queue.Queue):
+        try:
+            list_jobs(page, download_queue)
+        except Exception as e:
+            logger.error(f"Failed to list attachments of page {page[0]}: {e}")
+
+    def _list_copy_jobs(self, page_pair: Tuple[str, str], download_queue: queue.Queue):
+        source_page_id, target_page_id = page_pair
+        attachments = [ConfluenceAttachmentNode.from_api_response(attachment_data) for attachment_data in self.source_client.iter_attachments(source_page_id)]
+        self._count(listed=len(attachments))
+        pending_attachments = unjournaled_attachments(attachments, self.journal)
+        uploads = []
+        if pending_attachments:
+            target_attachments = {attachment_data['title']: ConfluenceAttachmentNode.from_api_response(attachment_data) for attachment_data in self.target_client.iter_attachments(target_page_id)}
+            uploads = attachment_uploads(pending_attachments, target_attachments, target_page_id, self.journal)
+        self._count(skipped=len(attachments) - len(uploads))
+        for attachment, target_attachment_id in uploads:
+            download_queue.put(_TransferJob(source_page_id, attachment, target_page_id, target_attachment_id))
+
+    def _list_download_jobs(self, page: Tuple[str, str], download_queue: queue.Queue):
+        page_id, download_dir = page
+        for attachment_data in self.source_client.iter_attachments(page_id):
+            self._count(listed=1)
+            download_queue.put(_TransferJob(page_id, ConfluenceAttachmentNode.from_api_response(attachment_data), download_dir=download_dir))
+
+    def _download_worker(self, download_queue: queue.Queue, upload_queue: Optional[queue.Queue], download: Callable):
+        while (job := download_queue.get()) is not None:
+            self.budget.acquire(job.reserved_bytes)
+            try:
+                result = download(job)
+            except Exception as e:
+                logger.error(f"Failed to download attachment '{job.attachment.title}' from page {job.source_page_id}: {e}")
+                result = None
+            if result is None:
+                self._count(failed=1)
+                self.budget.release(job.reserved_bytes)
+            elif upload_queue is None:
+                self._count(transferred=1, bytes=job.size)
+                self.budget.release(job.reserved_bytes)
+            else:
+                upload_queue.put((job, result))
+
+    def _upload_worker(self, upload_queue: queue.Queue, upload: Callable):
+        while (item := upload_queue.get()) is not None:
+            job, spool = item
+            try:
+                with spool:
+                    succeeded = upload(job, spool)
+                self._count(**({'transferred': 1, 'bytes': job.size} if succeeded else {'failed': 1}))
+            except Exception as e:
+                logger.error(f"Failed to upload attachment '{job.attachment.title}' to page {job.target_page_id}: {e}")
+                self._count(failed=1)
+            finally:
+                self.budget.release(job.reserved_bytes)
+
+    def _spool(self, job: _TransferJob):
+        spool, job.size = self.source_client.spool_attachment(job.source_page_id, job.attachment.title)
+        return spool
+
+    def _upload(self, job: _TransferJob, spool) -> bool:
+        response = self.target_client.create_attachment_from_stream(content_id=job.target_page_id, attachment_name=job.attachment.title, fileobj=spool, size=job.size, attachment_id=job.target_attachment_id)
+        if response.status_code not in [200, 201]:
+            return False
+        journal_attachment(self.journal, job.attachment, job.target_page_id)
+        return True
+
+    def _download_to_disk(self, job: _TransferJob):
+        return self.source_client.download_attachment(job.source_page_id, job.attachment.title, job.download_dir)
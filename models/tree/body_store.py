@@ -0,0 +1,31 @@
+from pathlib import Path
+from . import logger
+import hashlib
+import os
+import tempfile
+
+class ConfluenceBodyStore:
+    """Content-addressed on-disk store for page bodies, a body is kept once per sha256 hash."""
+    def __init__(self, store_dir: str):
+        self.store_dir = Path(store_dir)
+        self.store_dir.mkdir(parents=True, exist_ok=True)
+
+    def _path(self, body_hash: str) -> Path:
+        return self.store_dir / body_hash[:2] / body_hash[2:]
+
+    def put(self, body: str) -> str:
+        data = body.encode('utf-8')
+        body_hash = hashlib.sha256(data).hexdigest()
+        path = self._path(body_hash)
+        if not path.exists():
+            path.parent.mkdir(parents=True, exist_ok=True)
+            # Write to a temp file first, so a concurrent reader never sees a partial body
+            fd, temp_path = tempfile.mkstemp(dir=path.parent)
+            with os.fdopen(fd, 'wb') as temp_file:
+                temp_file.write(data)
+            os.replace(temp_path, path)
+            logger.debug(f"Spilled body {body_hash} ({len(data)} bytes) to {path}")
+        return body_hash
+
+    def get(self, body_hash: str) -> str:
+        return self._path(body_hash).read_text(encoding='utf-8')
@@ -0,0 +1,42 @@
+from array import array
+from bisect import bisect_left
+from typing import List
+from .page_node import ConfluencePageNode
+
+class ConfluenceChildIndex:
+    """Compact, read-only parent -> children index stored in flat integer arrays.
+
+    Page ids are kept sorted in ``page_ids``, the children of ``page_ids[i]`` are
+    ``child_ids[child_offsets[i]:child_offsets[i + 1]]`` in their original order.
+    """
+    def __init__(self, root: ConfluencePageNode):
+        children_by_id = {}
+        stack = [root]
+        while stack:
+            node = stack.pop()
+            children = [child for child in node.children if isinstance(child, ConfluencePageNode)]
+            children_by_id[node.id] = [child.id for child in children]
+            stack.extend(children)
+
+        self.page_ids = array('q', sorted(children_by_id))
+        self.child_offsets = array('q', [0])
+        self.child_ids = array('q')
+        for page_id in self.page_ids:
+            self.child_ids.extend(children_by_id[page_id])
+            self.child_offsets.append(len(self.child_ids))
+
+    def __len__(self) -> int:
+        return len(self.page_ids)
+
+    def __contains__(self, page_id: int) -> bool:
+        position = bisect_left(self.page_ids, page_id)
+        return position < len(self.page_ids) and self.page_ids[position] == page_id
+
+    def children_of(self, page_id: int) -> List[int]:
+        position = bisect_left(self.page_ids, page_id)
+        if position == len(self.page_ids) or self.page_ids[position] != page_id:
+            raise KeyError(page_id)
+        return self.child_ids[self.child_offsets[position]:self.child_offsets[position + 1]].tolist()
+
+    def nbytes(self) -> int:
+        return sum(values.itemsize * len(values) for values in (self.page_ids, self.child_offsets, self.child_ids))
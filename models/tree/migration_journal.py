@@ -0,0 +1,80 @@
+from typing import Optional
+from . import logger
+import sqlite3
+import threading
+
+class MigrationJournal:
+    """Append-only SQLite journal of completed migration steps, so an interrupted run resumes where it stopped.
+
+    Each entry maps ``(unit, source_id, item)`` to a target id. ``item`` pins an entry to a source state,
+    e.g. the page version a body was copied from, so a changed source no longer matches it. Entries are
+    committed one by one in WAL mode and mirrored in memory, lookups never query the database or the target.
+    The ``page`` entries double as the persistent source -> target page id mapping used to pair pages.
+    """
+    PAGE = "page"
+    LABELS = "labels"
+    ATTACHMENT = "attachment"
+    BODY = "body"
+    ORDER = "order"
+
+    def __init__(self, journal_file: str):
+        self.journal_file = journal_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(journal_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # A crash can lose the last commits of the WAL but never corrupt the journal, lost steps are simply redone
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS journal (
+                unit TEXT NOT NULL,
+                source_id TEXT NOT NULL,
+                item TEXT NOT NULL,
+                target_id TEXT NOT NULL,
+                recorded_at TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (unit, source_id, item)
+            )
+        """)
+        self.connection.commit()
+        self.entries = {(unit, source_id, item): target_id for unit, source_id, item, target_id in self.connection.execute("SELECT unit, source_id, item, target_id FROM journal")}
+        if self.entries:
+            logger.info(f"Resuming from migration journal {journal_file} with {len(self.entries)} completed steps")
+
+    def lookup(self, unit: str, source_id, item: str = "") -> Optional[str]:
+        """Target id recorded for a completed step, None when the step still has to be done."""
+        return self.entries.get((unit, str(source_id), str(item)))
+
+    def record(self, unit: str, source_id, target_id="", item: str = ""):
+        key = (unit, str(source_id), str(item))
+        with self.lock:
+            if key in self.entries:
+                return
+            self.connection.execute("INSERT OR IGNORE INTO journal (unit, source_id, item, target_id) VALUES (?, ?, ?, ?)", (*key, str(target_id)))
+            self.connection.commit()
+            self.entries[key] = str(target_id)
+
+    def prune(self, live_target_ids) -> int:
+        """Forget the steps done on target pages that no longer exist, so they are redone. Returns the number of steps forgotten."""
+        live_target_ids = set(map(str, live_target_ids))
+        with self.lock:
+            stale_keys = [key for key, target_id in self.entries.items() if target_id not in live_target_ids]
+            self.connection.executemany("DELETE FROM journal WHERE unit = ? AND source_id = ? AND item = ?", stale_keys)
+            self.connection.commit()
+            for key in stale_keys:
+                del self.entries[key]
+        return len(stale_keys)
+
+    def targets(self, unit: str) -> dict:
+        """Source id -> target id of the steps of ``unit`` recorded without an item, e.g. the page id mapping."""
+        return {source_id: target_id for (entry_unit, source_id, item), target_id in self.entries.items() if entry_unit == unit and not item}
+
+    def count(self, unit: str) -> int:
+        return sum(1 for entry_unit, _, _ in self.entries if entry_unit == unit)
+
+    @staticmethod
+    def attachment_item(attachment) -> str:
+        # Attachments are matched by name and size, like ConfluenceAttachmentNode.is_same_file
+        return f"{attachment.title}:{attachment.file_size}"
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
@@ -1,29 +1,43 @@
 import re
-from typing import List, Optional
-from . import logger
+import sys
+from typing import Callable, List, Optional
+from .body_store import ConfluenceBodyStore
 
 class ConfluencePageNode:
+    # Fixed slots instead of a per-node __dict__, large spaces hold 100k+ of these
+    __slots__ = ('id', 'type', 'status', 'title', 'labels', 'child_pages', 'child_attachments', 'webui_link', 'edit_link', 'parent',
+                 '_body', 'body_hash', 'body_store', 'body_loader', 'version', 'macros', 'children')
+
     def __init__(self, page_id: str, title: str, page_type: str = "", status: str = "", edit_link: str = "", webui_link: str = "", 
                  labels: Optional[List[str]] = None, child_pages: Optional[List[dict]] = None, 
-                 child_attachments: Optional[List['ConfluenceAttachmentNode']] = None, parent: Optional['ConfluencePageNode'] = None,body:str =""):
+                 child_attachments: Optional[List['ConfluenceAttachmentNode']] = None, parent: Optional['ConfluencePageNode'] = None,body: Optional[str] = None, version: int = 0):
         self.id = int(page_id)
-        self.type = page_type
-        self.status = status
+        self.type = sys.intern(page_type)
+        self.status = sys.intern(status)
         self.title = title
-        self.labels = labels or []
-        self.child_pages = child_pages or []
-        self.child_attachments = child_attachments or []
+        # Label and macro names repeat across pages, interning keeps a single copy of each name
+        self.labels = [sys.intern(label) for label in labels] if labels else []
+        self.child_pages = child_pages or ()
+        self.child_attachments = child_attachments or ()
         self.webui_link = webui_link
         self.edit_link = edit_link
         self.parent = parent
-        self.body: Optional[str] = body
+        self._body: Optional[str] = body  # None until loaded, an empty page has the body ""
+        self.body_hash: str = ""
+        self.body_store: Optional[ConfluenceBodyStore] = None
+        self.body_loader: Optional[Callable[[int], str]] = None
+        self.version = version
         self.macros: List[str] = []
-        self.children = []
+        self.children = ()  # most pages are leaves, the list is only allocated for the first child
 
     def add_child(self, child: 'ConfluencePageNode'):
+        if not self.children:
+            self.children = []
         self.children.append(child)
 
     def add_child_attachment(self, child_attachment: 'ConfluenceAttachmentNode'):
+        if not self.child_attachments:
+            self.child_attachments = []
         self.child_attachments.append(child_attachment)
 
     @classmethod
@@ -34,14 +48,51 @@ class ConfluencePageNode:
             status=response['status'],
             title=response['title'],
             edit_link=response['_links']['editui'] if confluence_type == 'cloud' else response['_links']['edit'],
-            webui_link=response['_links']['webui']
+            webui_link=response['_links']['webui'],
+            version=response.get('version', {}).get('number', 0),
+            labels=[label['name'] for label in response.get('metadata', {}).get('labels', {}).get('results', [])],
+            # Listings without body.storage in their expand leave the body to be loaded
+            body=response.get('body', {}).get('storage', {}).get('value')
         )
         return page_node
 
+    @property
+    def body(self) -> str:
+        # Bodies are read from the body store, or loaded on first access when the node was built without one
+        if self._body is not None:
+            return self._body
+        if self.body_hash and self.body_store is not None:
+            return self.body_store.get(self.body_hash)
+        if self.body_loader is not None:
+            body = self.body_loader(self.id)
+            self.set_body(body)
+            return body
+        return ""
+
+    @body.setter
+    def body(self, body: str):
+        self.set_body(body)
+
     def set_body(self, body: str):
-        self.body = body
+        if self.body_store is not None:
+            self.body_hash = self.body_store.put(body or "")
+            self._body = None
+        else:
+            self._body = body
+
+    def has_body(self) -> bool:
+        return self._body is not None or bool(self.body_hash)
+
+    def attach_body_store(self, body_store: Optional[ConfluenceBodyStore], body_loader: Optional[Callable[[int], str]] = None):
+        # Spills a body that is already in memory, only the hash stays on the node
+        self.body_loader = body_loader
+        if body_store is None:
+            return
+        self.body_store = body_store
+        if self._body is not None:
+            self.set_body(self._body)
 
     def get_macros_list(self) -> List[str]:
         if not self.body:
             return [] 
-        return re.findall(r'ac:name="(.*?)"', self.body)
\ No newline at end of file
+        return [sys.intern(macro) for macro in re.findall(r'ac:name="(.*?)"', self.body)]
\ No newline at end of file
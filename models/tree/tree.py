@@ -1,9 +1,19 @@
 from typing import List, Optional
 from .page_node import ConfluencePageNode
 from .attachment_node import ConfluenceAttachmentNode
+from .tree_cache import ConfluenceTreeCache
+from .body_store import ConfluenceBodyStore
+from .child_index import ConfluenceChildIndex
 from api.client import ConfluenceAPIClient
+from api.async_client import AsyncConfluenceAPIClient
 from . import logger
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat
+import asyncio
 import json
+import sys
+import time
 
 class ConfluencePagesTree:
     def __init__(self, root: 'ConfluencePageNode', api_client: 'ConfluenceAPIClient'):
@@ -12,7 +22,17 @@ class ConfluencePagesTree:
         self.tree_file = f"tree_{self.api_client.instance_config.name}_{self.api_client.instance_config.root_page_id}.txt"
         self.tree_file_json = f"tree_{self.api_client.instance_config.name}_{self.api_client.instance_config.root_page_id}.json"
         self.logs_prefix = f"{self.api_client.instance_config.name} {self.api_client.instance_config.confluence_type}> "
+        self.tree_cache_file = f"tree_{self.api_client.instance_config.name}_{self.api_client.instance_config.root_page_id}.sqlite"
         self.total_nodes = 0 
+        # Indexes maintained by index_tree() and add_page(), they make lookups and counts O(1)
+        self.nodes_by_id = {}
+        self.parent_by_id = {}
+        self.depth_by_id = {}
+        self.subtree_size_by_id = {}
+        self.with_bodies = True  # False when bodies are restored from the tree cache instead of the listings
+        body_store_dir = self.api_client.instance_config.body_store_dir
+        self.body_store = ConfluenceBodyStore(body_store_dir) if body_store_dir else None
+        self.index_tree()
 
     def _print_node(self, node: 'ConfluencePageNode', level: int, to_file: bool = False):
         indent = "    " * level
@@ -24,11 +44,8 @@ class ConfluencePagesTree:
             logger.info(info_str)
 
     def print_pages(self, node: Optional['ConfluencePageNode'] = None, level: int = 0):
-        current_node = node or self.root
-        self._print_node(current_node, level)
-        for child in current_node.children:
-            if isinstance(child, ConfluencePageNode):
-                self.print_pages(child, level + 1)
+        for current_node, depth in self.iter_preorder_with_depth(node):
+            self._print_node(current_node, level + depth)
 
     def save_tree_to_file_as_json(self, node: Optional['ConfluencePageNode'] = None):
         current_node = node or self.root
@@ -37,90 +54,353 @@ class ConfluencePagesTree:
             json.dump(tree_dict, file, indent=4)
 
     def _node_to_dict(self, node: 'ConfluencePageNode'):
-        return {
-            "title": node.title,
-            "id": node.id,
-            "labels": node.labels,
-            "attachments": [attachment.id for attachment in node.child_attachments],
-            "children": [self._node_to_dict(child) for child in node.children],
-            "macros": list(set(node.macros))
-        }
+        # Pre-order visits every parent before its children, so each dict is appended to an already built parent dict
+        root_dict = None
+        stack = [(node, None)]
+        while stack:
+            current_node, parent_dict = stack.pop()
+            node_dict = {
+                "title": current_node.title,
+                "id": current_node.id,
+                "labels": current_node.labels,
+                "attachments": [attachment.id for attachment in current_node.child_attachments],
+                "children": [],
+                "macros": list(set(current_node.macros))
+            }
+            if parent_dict is None:
+                root_dict = node_dict
+            else:
+                parent_dict["children"].append(node_dict)
+            stack.extend((child, node_dict) for child in reversed(current_node.children))
+        return root_dict
 
     def traverse_tree(self, node: Optional['ConfluencePageNode'] = None) -> List['ConfluencePageNode']:
-        current_node = node or self.root
-        nodes = [current_node]
-        for child in current_node.children:
-            if isinstance(child, ConfluencePageNode):
-                nodes.extend(self.traverse_tree(child))
-        return nodes
+        return list(self.iter_preorder(node))
+
+    def iter_preorder(self, node: Optional['ConfluencePageNode'] = None):
+        for current_node, _ in self.iter_preorder_with_depth(node):
+            yield current_node
+
+    def iter_preorder_with_depth(self, node: Optional['ConfluencePageNode'] = None):
+        stack = [(node or self.root, 0)]
+        while stack:
+            current_node, depth = stack.pop()
+            yield current_node, depth
+            # Children are pushed in reverse, so they are popped in their original order
+            stack.extend((child, depth + 1) for child in reversed(current_node.children) if isinstance(child, ConfluencePageNode))
+
+    def iter_bfs(self, node: Optional['ConfluencePageNode'] = None):
+        queue = deque([node or self.root])
+        while queue:
+            current_node = queue.popleft()
+            yield current_node
+            queue.extend(child for child in current_node.children if isinstance(child, ConfluencePageNode))
+
+    def iter_levels(self, node: Optional['ConfluencePageNode'] = None):
+        level = [node or self.root]
+        while level:
+            yield level
+            level = [child for current_node in level for child in current_node.children if isinstance(child, ConfluencePageNode)]
+
+    def index_tree(self):
+        # Rebuilds all indexes in O(n), subtree sizes are summed bottom-up over the reversed pre-order.
+        # They are published once complete, readers such as the stats thread never see a partial index
+        nodes_by_id = {}
+        parent_by_id = {self.root.id: None}
+        depth_by_id = {}
+        ordered_nodes = []
+        for current_node, depth in self.iter_preorder_with_depth():
+            nodes_by_id[current_node.id] = current_node
+            depth_by_id[current_node.id] = depth
+            ordered_nodes.append(current_node)
+            for child in current_node.children:
+                parent_by_id[child.id] = current_node.id
+        subtree_size_by_id = {}
+        for current_node in reversed(ordered_nodes):
+            subtree_size_by_id[current_node.id] = 1 + sum(subtree_size_by_id[child.id] for child in current_node.children)
+        self.parent_by_id = parent_by_id
+        self.depth_by_id = depth_by_id
+        self.subtree_size_by_id = subtree_size_by_id
+        self.nodes_by_id = nodes_by_id
+        self.total_nodes = len(nodes_by_id)
+
+    def add_page(self, parent: 'ConfluencePageNode', page: 'ConfluencePageNode'):
+        # Attaches a leaf page and updates the indexes along its ancestor chain in O(depth)
+        parent.add_child(page)
+        self.nodes_by_id[page.id] = page
+        self.parent_by_id[page.id] = parent.id
+        self.depth_by_id[page.id] = self.depth_by_id.get(parent.id, 0) + 1
+        self.subtree_size_by_id[page.id] = 1
+        ancestor_id = parent.id
+        while ancestor_id is not None:
+            self.subtree_size_by_id[ancestor_id] = self.subtree_size_by_id.get(ancestor_id, 1) + 1
+            ancestor_id = self.parent_by_id.get(ancestor_id)
+        self.total_nodes = len(self.nodes_by_id)
+
+    def get_node(self, page_id) -> Optional['ConfluencePageNode']:
+        return self.nodes_by_id.get(int(page_id))
+
+    def get_parent(self, page_id) -> Optional['ConfluencePageNode']:
+        return self.nodes_by_id.get(self.parent_by_id.get(int(page_id)))
+
+    def get_depth(self, page_id) -> int:
+        return self.depth_by_id[int(page_id)]
+
+    def get_subtree_size(self, page_id) -> int:
+        return self.subtree_size_by_id[int(page_id)]
 
     def rearrange_trees(self, target_node: 'ConfluencePageNode', node: Optional['ConfluencePageNode'] = None):
-        current_node = node or self.root
-        target_children = {child.title: child for child in target_node.children if isinstance(child, ConfluencePageNode)}
-        new_children = []
+        stack = [(target_node, node or self.root)]
+        while stack:
+            target_node, current_node = stack.pop()
+            target_children = {child.title: child for child in target_node.children if isinstance(child, ConfluencePageNode)}
+            new_children = []
 
-        for original_child in current_node.children:
-            if isinstance(original_child, ConfluencePageNode):
-                if original_child.title in target_children:
-                    new_children.append(target_children[original_child.title])
-                    self.rearrange_trees(target_children[original_child.title], original_child)
-                else:
-                    logger.warning(f"{self.logs_prefix} Warning: No matching node found in target tree for '{original_child.title}'")
+            for original_child in current_node.children:
+                if isinstance(original_child, ConfluencePageNode):
+                    if original_child.title in target_children:
+                        new_children.append(target_children[original_child.title])
+                        stack.append((target_children[original_child.title], original_child))
+                    else:
+                        logger.warning(f"{self.logs_prefix} Warning: No matching node found in target tree for '{original_child.title}'")
 
-        target_node.children = [child for child in target_node.children if not isinstance(child, ConfluencePageNode)] + new_children
+            target_node.children = [child for child in target_node.children if not isinstance(child, ConfluencePageNode)] + new_children
+        # Pages are moved and dropped rather than added, so the indexes are rebuilt once the whole tree is rearranged
+        self.index_tree()
 
     def fetch_pages(self, node: Optional['ConfluencePageNode'] = None, confluence_type: str = '', from_label: str = "", exclude_page_ids: list = []):
-        current_node = node or self.root
-        logger.debug(f"Fetching pages for node: {current_node.title}, excluding pages with IDs: {exclude_page_ids}")
-        
-        child_pages = self.api_client.get_child_pages(current_node.id)
-        
-        for page_data in child_pages:
+        excluded_ids = set(map(str, exclude_page_ids))
+        stack = [node or self.root]
+        while stack:
+            current_node = stack.pop()
+            logger.debug(f"Fetching pages for node: {current_node.title}, excluding pages with IDs: {exclude_page_ids}")
+
+            for page_data in self.api_client.iter_child_pages(current_node.id, profile=self._listing_profile()):
+                page = ConfluencePageNode.from_api_response(page_data, confluence_type)
+
+                if str(page.id) in excluded_ids:
+                    logger.warning(f"Skipping page {page.title} (ID: {page.id}) with all sub pages, due to exclude_page_id match")
+                    continue
+
+                if not self._hydrate_page(page, from_label):
+                    logger.warning(f"Skipping page {page.title} (ID: {page.id}) with all sub pages, due to label filtering")
+                    continue
+
+                self.add_page(current_node, page)
+            stack.extend(reversed(current_node.children))
+
+    def fetch_pages_concurrently(self, confluence_type: str = '', from_label: str = "", exclude_page_ids: list = [], max_workers: int = 1):
+        # Breadth-first crawl, every frontier level is listed and hydrated by a bounded worker pool
+        excluded_ids = set(map(str, exclude_page_ids))
+        started_at = time.perf_counter()
+        fetched_pages = 0
+        frontier = [self.root]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{self.api_client.instance_config.name}-crawler") as executor:
+            while frontier:
+                # executor.map yields results in submission order, which keeps the sibling order deterministic
+                children_per_parent = executor.map(self._fetch_child_nodes, frontier, repeat(confluence_type))
+                candidates = self._exclude_pages(frontier, children_per_parent, excluded_ids)
+                hydrated = [self._hydrate_page(page, from_label) for _, page in candidates]
+                frontier = self._attach_pages(candidates, hydrated)
+                fetched_pages += len(frontier)
+                self._log_fetch_rate(fetched_pages, started_at)
+
+    async def fetch_pages_async(self, async_client: 'AsyncConfluenceAPIClient', confluence_type: str = '', from_label: str = "", exclude_page_ids: list = []):
+        # Same crawl as fetch_pages_concurrently, but every level is gathered on one event loop
+        excluded_ids = set(map(str, exclude_page_ids))
+        started_at = time.perf_counter()
+        fetched_pages = 0
+        frontier = [self.root]
+        while frontier:
+            # asyncio.gather returns results in the order of its arguments
+            children_per_parent = await asyncio.gather(*(async_client.get_child_pages(node.id, profile=self._listing_profile()) for node in frontier))
+            children_per_parent = [[ConfluencePageNode.from_api_response(page_data, confluence_type) for page_data in child_pages] for child_pages in children_per_parent]
+            candidates = self._exclude_pages(frontier, children_per_parent, excluded_ids)
+            hydrated = [self._hydrate_page(page, from_label) for _, page in candidates]
+            frontier = self._attach_pages(candidates, hydrated)
+            fetched_pages += len(frontier)
+            self._log_fetch_rate(fetched_pages, started_at)
+
+    def fetch_pages_flat(self, confluence_type: str = '', from_label: str = "", exclude_page_ids: list = [], fetch_mode: str = "cql"):
+        # Enumerates the whole subtree in pages of fetch_pages_limit results and links the hierarchy locally
+        expand = self.api_client.EXPAND_PROFILES["tree_flat" if self.with_bodies else "tree_flat_metadata"]
+        if fetch_mode == "space":
+            results = self.api_client.list_space_pages(self.api_client.instance_config.space_key, expand=expand)
+        else:
+            results = self.api_client.search_content(f"ancestor = {self.root.id} and type = page", expand=expand)
+
+        children_by_parent = {}
+        for page_data in results:
+            ancestor_ids = [int(ancestor['id']) for ancestor in page_data.get('ancestors', [])]
+            if self.root.id not in ancestor_ids:
+                continue  # space listings also return pages outside of the root page
             page = ConfluencePageNode.from_api_response(page_data, confluence_type)
+            self._attach_body_store(page)
+            if page.has_body():
+                page.macros = page.get_macros_list()
+            position = page_data.get('extensions', {}).get('position')
+            children_by_parent.setdefault(ancestor_ids[-1], []).append((position if isinstance(position, int) and position >= 0 else float('inf'), page.title, page))
 
-            if str(page.id) in map(str, exclude_page_ids):
-                logger.warning(f"Skipping page {page.title} (ID: {page.id}) with all sub pages, due to exclude_page_id match")
-                continue
-            
-            if from_label and (not page.labels or from_label not in page.labels):
+        # Attaching from the root down drops excluded or unlabelled pages together with their sub pages
+        excluded_ids = set(map(str, exclude_page_ids))
+        frontier = [self.root]
+        while frontier:
+            next_frontier = []
+            for parent in frontier:
+                for _, _, page in sorted(children_by_parent.pop(parent.id, []), key=lambda child: child[:2]):
+                    if str(page.id) in excluded_ids:
+                        logger.warning(f"Skipping page {page.title} (ID: {page.id}) with all sub pages, due to exclude_page_id match")
+                        continue
+                    if from_label and from_label not in page.labels:
+                        logger.warning(f"Skipping page {page.title} (ID: {page.id}) with all sub pages, due to label filtering")
+                        continue
+                    self.add_page(parent, page)
+                    next_frontier.append(page)
+            frontier = next_frontier
+
+    def _exclude_pages(self, frontier: List['ConfluencePageNode'], children_per_parent, excluded_ids: set) -> list:
+        candidates = []
+        for parent, children in zip(frontier, children_per_parent):
+            for page in children:
+                if str(page.id) in excluded_ids:
+                    logger.warning(f"Skipping page {page.title} (ID: {page.id}) with all sub pages, due to exclude_page_id match")
+                    continue
+                candidates.append((parent, page))
+        return candidates
+
+    def _attach_pages(self, candidates: list, hydrated) -> List['ConfluencePageNode']:
+        attached_pages = []
+        for (parent, page), is_included in zip(candidates, hydrated):
+            if not is_included:
                 logger.warning(f"Skipping page {page.title} (ID: {page.id}) with all sub pages, due to label filtering")
                 continue
+            self.add_page(parent, page)
+            attached_pages.append(page)
+        return attached_pages
+
+    def _log_fetch_rate(self, fetched_pages: int, started_at: float):
+        elapsed = time.perf_counter() - started_at
+        logger.info(f"{self.logs_prefix} Fetched {fetched_pages} pages in {elapsed:.2f}s ({fetched_pages / elapsed if elapsed else 0:.2f} pages/sec)")
+
+    def _fetch_child_nodes(self, node: 'ConfluencePageNode', confluence_type: str) -> List['ConfluencePageNode']:
+        logger.debug(f"Fetching pages for node: {node.title}")
+        return [ConfluencePageNode.from_api_response(page_data, confluence_type) for page_data in self.api_client.get_child_pages(node.id, profile=self._listing_profile())]
 
-            page.labels = [label['name'] for label in self.api_client.get_labels(page.id)]
-            logger.debug(f"Adding page {page.title} (ID: {page.id}) with labels: {page.labels}")
-            page.set_body(self.api_client.get_content(page.id).json().get("body",{}).get("storage",{}).get("value",""))
+    def _listing_profile(self) -> str:
+        return "tree_with_bodies" if self.with_bodies else "tree_metadata"
+
+    def hydrate_from_cache(self, tree_cache: ConfluenceTreeCache, max_workers: int = 1):
+        # Versions come with the listings, so only pages changed since the last build download their body
+        nodes = self.traverse_tree()
+        cached_pages = tree_cache.load_pages([node.id for node in nodes])
+        stale_nodes = []
+        for node in nodes:
+            cached_page = cached_pages.get(node.id)
+            if cached_page and node.version and cached_page["version"] == node.version:
+                node.set_body(cached_page["body"])
+                node.macros = [sys.intern(macro) for macro in cached_page["macros"]]
+            else:
+                stale_nodes.append(node)
+
+        # Pages listed with their body already have their macros
+        fetched_nodes = [node for node in stale_nodes if not node.has_body()]
+        with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix=f"{self.api_client.instance_config.name}-cache") as executor:
+            list(executor.map(self._fetch_body, fetched_nodes))
+        for node in fetched_nodes:
+            node.macros = node.get_macros_list()
+        tree_cache.store_pages(stale_nodes)
+        logger.info(f"{self.logs_prefix} Restored {len(nodes) - len(stale_nodes)} pages from cache, refetched {len(stale_nodes)} changed pages")
+
+    def _fetch_body(self, node: 'ConfluencePageNode'):
+        node.set_body(self._load_body(node.id))
+
+    def _hydrate_page(self, page: 'ConfluencePageNode', from_label: str = "") -> bool:
+        # Labels and body are expanded on the child listing, so hydrating a page costs no extra request
+        if from_label and from_label not in page.labels:
+            return False
+        logger.debug(f"Adding page {page.title} (ID: {page.id}) with labels: {page.labels}")
+        self._attach_body_store(page)
+        if page.has_body():  # metadata-only listings get their macros once the bodies are restored
             page.macros = page.get_macros_list()
-            current_node.add_child(page)
-            self.fetch_pages(page, confluence_type, from_label, exclude_page_ids)
+        return True
+
+    def _attach_body_store(self, page: 'ConfluencePageNode'):
+        page.attach_body_store(self.body_store, body_loader=self._load_body)
+
+    def _load_body(self, page_id: int) -> str:
+        return self.api_client.get_content(page_id, profile="page_body").json().get("body",{}).get("storage",{}).get("value","")
 
     def fetch_attachments(self, node: Optional['ConfluencePageNode'] = None):
         current_node = node or self.root
-        logger.debug(f"Fetching attachments for node: {current_node.title}")
-        response = self.api_client.get_content(current_node.id)
-        
-        for attachment_data in response.json()['children']['attachment']['results']:
-            attachment = ConfluenceAttachmentNode.from_api_response(attachment_data)
+        for attachment in self.iter_attachments(current_node):
             current_node.add_child_attachment(attachment)
             logger.debug(f"{self.logs_prefix} Added attachment: {attachment.title}")
 
+    def iter_attachments(self, node: Optional['ConfluencePageNode'] = None):
+        # Streams attachments page by page without keeping them on the node
+        current_node = node or self.root
+        logger.debug(f"Fetching attachments for node: {current_node.title}")
+        for attachment_data in self.api_client.iter_attachments(current_node.id):
+            yield ConfluenceAttachmentNode.from_api_response(attachment_data)
+
+    async def iter_attachments_async(self, async_client: 'AsyncConfluenceAPIClient', node: Optional['ConfluencePageNode'] = None):
+        current_node = node or self.root
+        logger.debug(f"Fetching attachments for node: {current_node.title}")
+        async for attachment_data in async_client.iter_attachments(current_node.id):
+            yield ConfluenceAttachmentNode.from_api_response(attachment_data)
+
     def build_tree(self, confluence_type: str, from_label: str = "", exclude_page_ids: list = []):
         logger.info(f"{self.logs_prefix} Building the Confluence pages tree...")
-        root_page_data = self.api_client.get_content(self.root.id)  # Ensure root is a valid ConfluencePageNode
+        started_at = time.perf_counter()
+        root_page_data = self.api_client.get_content(self.root.id, profile="tree_with_bodies")  # Ensure root is a valid ConfluencePageNode
         self.root = ConfluencePageNode.from_api_response(root_page_data.json(), confluence_type)  # Convert to ConfluencePageNode
-        self.fetch_pages(confluence_type=confluence_type, from_label=from_label, exclude_page_ids=exclude_page_ids)
+        self.index_tree()
+        self._attach_body_store(self.root)
+        self.root.macros = self.root.get_macros_list()
+        fetch_workers = self.api_client.instance_config.fetch_workers
+        fetch_mode = self.api_client.instance_config.fetch_mode
+        tree_cache = ConfluenceTreeCache(self.tree_cache_file) if self.api_client.instance_config.use_tree_cache else None
+        # A new or empty cache has no bodies to restore, listing them costs less than one body request per page
+        self.with_bodies = tree_cache is None or tree_cache.is_empty()
+        if fetch_mode in ("cql", "space"):
+            logger.info(f"{self.logs_prefix} Enumerating pages with a flat {fetch_mode} listing")
+            self.fetch_pages_flat(confluence_type=confluence_type, from_label=from_label, exclude_page_ids=exclude_page_ids, fetch_mode=fetch_mode)
+        elif fetch_workers > 1:
+            logger.info(f"{self.logs_prefix} Crawling pages with {fetch_workers} workers")
+            self.fetch_pages_concurrently(confluence_type=confluence_type, from_label=from_label, exclude_page_ids=exclude_page_ids, max_workers=fetch_workers)
+        else:
+            self.fetch_pages(confluence_type=confluence_type, from_label=from_label, exclude_page_ids=exclude_page_ids)
+        if tree_cache is not None:
+            try:
+                self.hydrate_from_cache(tree_cache, max_workers=fetch_workers)
+            finally:
+                tree_cache.close()
+            self.with_bodies = True
+        elapsed = time.perf_counter() - started_at
         
-        logger.info(f"{self.logs_prefix} ConfluencePagesTree with root {self.root.title} with total of {self.total_nodes} nodes is ready...")
+        logger.info(f"{self.logs_prefix} ConfluencePagesTree with root {self.root.title} with total of {self.total_nodes} nodes is ready in {elapsed:.2f}s ({self.total_nodes / elapsed if elapsed else 0:.2f} pages/sec)...")
+
+    async def build_tree_async(self, confluence_type: str, async_client: 'AsyncConfluenceAPIClient', from_label: str = "", exclude_page_ids: list = []):
+        logger.info(f"{self.logs_prefix} Building the Confluence pages tree with up to {async_client.max_in_flight_requests} in-flight requests...")
+        started_at = time.perf_counter()
+        root_page_data = await async_client.get_content(self.root.id, profile="tree_with_bodies")
+        self.root = ConfluencePageNode.from_api_response(root_page_data.json(), confluence_type)
+        self.index_tree()
+        self._attach_body_store(self.root)
+        self.root.macros = self.root.get_macros_list()
+        await self.fetch_pages_async(async_client, confluence_type=confluence_type, from_label=from_label, exclude_page_ids=exclude_page_ids)
+        elapsed = time.perf_counter() - started_at
+
+        logger.info(f"{self.logs_prefix} ConfluencePagesTree with root {self.root.title} with total of {self.total_nodes} nodes is ready in {elapsed:.2f}s ({self.total_nodes / elapsed if elapsed else 0:.2f} pages/sec)...")
+
+    def build_child_index(self) -> ConfluenceChildIndex:
+        return ConfluenceChildIndex(self.root)
 
     def count_children(self, node: ConfluencePageNode = None) -> int:
         current_node = node or self.root
-        count = len(current_node.children)
-        for child in current_node.children:
-            if isinstance(child, ConfluencePageNode):
-                count += self.count_children(child)
-        return count
+        if current_node.id in self.subtree_size_by_id:
+            return self.subtree_size_by_id[current_node.id] - 1
+        return sum(1 for _ in self.iter_preorder(current_node)) - 1
     
     def fetch_total_nodes(self) -> int:
-        self.total_nodes = 0
-        child_nodes = self.count_children()
-        self.total_nodes += child_nodes + 1
-        return self.total_nodes
\ No newline at end of file
+        return self.total_nodes
@@ -0,0 +1,58 @@
+from typing import Dict, List
+from .page_node import ConfluencePageNode
+from . import logger
+import json
+import sqlite3
+import threading
+
+class ConfluenceTreeCache:
+    """On-disk cache of page macros and bodies keyed by page id and version number."""
+    # SQLite limits the number of bound parameters, so id lookups are chunked
+    LOOKUP_CHUNK_SIZE = 500
+
+    def __init__(self, cache_file: str):
+        self.cache_file = cache_file
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(cache_file, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        if "title" in {column[1] for column in self.connection.execute("PRAGMA table_info(pages)")}:
+            # Caches written before titles and labels were dropped are rebuilt, both come with every listing
+            self.connection.execute("DROP TABLE pages")
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS pages (
+                id INTEGER PRIMARY KEY,
+                version INTEGER NOT NULL,
+                macros TEXT NOT NULL,
+                body TEXT NOT NULL
+            )
+        """)
+        self.connection.commit()
+
+    def is_empty(self) -> bool:
+        with self.lock:
+            return self.connection.execute("SELECT 1 FROM pages LIMIT 1").fetchone() is None
+
+    def load_pages(self, page_ids: List[int]) -> Dict[int, dict]:
+        cached_pages = {}
+        with self.lock:
+            for start in range(0, len(page_ids), self.LOOKUP_CHUNK_SIZE):
+                chunk = page_ids[start:start + self.LOOKUP_CHUNK_SIZE]
+                rows = self.connection.execute(
+                    f"SELECT id, version, macros, body FROM pages WHERE id IN ({','.join('?' * len(chunk))})", chunk
+                )
+                for page_id, version, macros, body in rows:
+                    cached_pages[page_id] = {"version": version, "macros": json.loads(macros), "body": body}
+        return cached_pages
+
+    def store_pages(self, pages: List[ConfluencePageNode]):
+        with self.lock:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO pages (id, version, macros, body) VALUES (?, ?, ?, ?)",
+                [(page.id, page.version, json.dumps(page.macros), page.body or "") for page in pages]
+            )
+            self.connection.commit()
+        logger.debug(f"Stored {len(pages)} pages in tree cache {self.cache_file}")
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
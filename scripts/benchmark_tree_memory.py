@@ -0,0 +1,94 @@
+"""Measures memory per page node on a synthetic tree.
+
+Compares a plain ``__dict__`` node (the previous ConfluencePageNode layout) with the
+current slotted node with interned labels and macros, and the array backed child index.
+
+    python scripts/benchmark_tree_memory.py --pages 100000
+"""
+from pathlib import Path
+import argparse
+import gc
+import sys
+import tracemalloc
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+from models.tree.page_node import ConfluencePageNode
+from models.tree.child_index import ConfluenceChildIndex
+
+LABELS = ["team-docs", "architecture", "runbook", "release-notes", "how-to", "archived"]
+MACROS = ["toc", "code", "info", "expand", "jira", "children", "panel"]
+
+class DictPageNode:
+    # Layout of ConfluencePageNode before __slots__ and interning
+    def __init__(self, page_id: str, title: str, page_type: str = "", status: str = "", edit_link: str = "", webui_link: str = "", labels=None, version: int = 0):
+        self.id = int(page_id)
+        self.type = page_type
+        self.status = status
+        self.title = title
+        self.labels = labels or []
+        self.child_pages = []
+        self.child_attachments = []
+        self.webui_link = webui_link
+        self.edit_link = edit_link
+        self.parent = None
+        self.body = ""
+        self.version = version
+        self.macros = []
+        self.children = []
+
+    def add_child(self, child):
+        self.children.append(child)
+
+def page_kwargs(page_id: int) -> dict:
+    # Strings are rebuilt per page like json.loads does for every API response
+    return {
+        "page_id": str(page_id),
+        "title": f"Page {page_id}",
+        "page_type": "".join(["pa", "ge"]),
+        "status": "".join(["cur", "rent"]),
+        "edit_link": f"/pages/resumedraft.action?draftId={page_id}",
+        "webui_link": f"/pages/viewpage.action?pageId={page_id}",
+        "labels": ["".join(list(LABELS[(page_id + offset) % len(LABELS)])) for offset in range(2)],
+        "version": 1,
+    }
+
+def build_tree(node_class, total_pages: int, fanout: int):
+    nodes = [node_class(**page_kwargs(0))]
+    for page_id in range(1, total_pages):
+        node = node_class(**page_kwargs(page_id))
+        node.macros = ["".join(list(MACROS[(page_id + offset) % len(MACROS)])) for offset in range(3)]
+        if node_class is ConfluencePageNode:
+            node.macros = [sys.intern(macro) for macro in node.macros]
+        nodes[(page_id - 1) // fanout].add_child(node)
+        nodes.append(node)
+    return nodes[0], nodes
+
+def measure(node_class, total_pages: int, fanout: int):
+    gc.collect()
+    tracemalloc.start()
+    root, nodes = build_tree(node_class, total_pages, fanout)
+    used_bytes, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return root, nodes, used_bytes
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark memory usage per ConfluencePageNode")
+    parser.add_argument("--pages", type=int, default=100000, help="Number of synthetic pages")
+    parser.add_argument("--fanout", type=int, default=10, help="Children per page")
+    args = parser.parse_args()
+
+    _, dict_nodes, dict_bytes = measure(DictPageNode, args.pages, args.fanout)
+    del dict_nodes
+    root, slot_nodes, slot_bytes = measure(ConfluencePageNode, args.pages, args.fanout)
+    child_index = ConfluenceChildIndex(root)
+    list_bytes = sum(sys.getsizeof(node.children) for node in slot_nodes if node.children)
+
+    print(f"pages:                   {args.pages}")
+    print(f"__dict__ nodes:          {dict_bytes / args.pages:8.1f} bytes/node")
+    print(f"__slots__ nodes:         {slot_bytes / args.pages:8.1f} bytes/node")
+    print(f"children lists:          {list_bytes / args.pages:8.1f} bytes/node")
+    print(f"array child index:       {child_index.nbytes() / args.pages:8.1f} bytes/node")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import inspect
+import unittest
+
+from api.async_client import AsyncConfluenceAPIClient
+from api.client import ConfluenceAPIClient
+
+class AsyncClientEndpointsTest(unittest.TestCase):
+    def test_every_endpoint_helper_is_a_coroutine(self):
+        # An inherited sync helper would get a coroutine back from the async api_request and never send the request
+        for name, method in inspect.getmembers(ConfluenceAPIClient, inspect.isfunction):
+            source = inspect.getsource(method)
+            if name.startswith('__') or not ('self.api_request(' in source or 'self._iter_results(' in source):
+                continue
+            with self.subTest(name=name):
+                async_method = getattr(AsyncConfluenceAPIClient, name)
+                self.assertTrue(inspect.iscoroutinefunction(async_method) or inspect.isasyncgenfunction(async_method))
+
+if __name__ == '__main__':
+    unittest.main()
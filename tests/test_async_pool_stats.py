@@ -0,0 +1,46 @@
+import asyncio
+import json
+import unittest
+from pathlib import Path
+
+from aiohttp import web
+
+from api.async_client import AsyncConfluenceAPIClient
+from config.config_types import ConfluenceInstance
+
+API_CONFIG = json.loads((Path(__file__).resolve().parent.parent / "confluence-api.json").read_text())
+
+class AsyncPoolStatsTest(unittest.TestCase):
+    def pool_stats_after_requests(self, keep_alive: bool) -> dict:
+        async def run():
+            app = web.Application()
+            app.router.add_get('/rest/api/content/{contentId}', lambda request: web.json_response({'id': request.match_info['contentId']}))
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+            port = runner.addresses[0][1]
+            instance = ConfluenceInstance({
+                'name': 'test', 'confluence_type': 'server', 'site_url': f'http://127.0.0.1:{port}', 'space_key': 'TEST',
+                'keep_alive': keep_alive, 'credentials': {'rest_auth_type': 'basic_auth'}
+            })
+            try:
+                async with AsyncConfluenceAPIClient(instance, API_CONFIG) as client:
+                    await asyncio.gather(*(client.get_content(content_id, expand=False) for content_id in range(3)))
+                    return client.get_pool_stats()
+            finally:
+                await runner.cleanup()
+        return asyncio.run(run())
+
+    def test_idle_connections_are_counted(self):
+        stats = self.pool_stats_after_requests(keep_alive=True)
+        self.assertEqual(stats['requests_sent'], 3)
+        self.assertEqual(stats['connections_idle'], stats['connections_opened'])
+        self.assertGreater(stats['connections_idle'], 0)
+
+    def test_closed_connections_are_not_idle(self):
+        stats = self.pool_stats_after_requests(keep_alive=False)
+        self.assertEqual(stats['connections_idle'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+import asyncio
+import json
+import unittest
+from pathlib import Path
+
+from api.async_client import AsyncConfluenceAPIClient
+from config.config_types import ConfluenceInstance
+
+API_CONFIG = json.loads((Path(__file__).resolve().parent.parent / "confluence-api.json").read_text())
+ATTACHMENT = bytes(range(256)) * 64
+
+class DroppingAttachmentServer:
+    """Serves ATTACHMENT, the first ``drops`` responses are cut off after half the body."""
+    def __init__(self, drops: int = 1):
+        self.drops = drops
+        self.requests = 0
+
+    async def handle(self, reader, writer):
+        await reader.readuntil(b"\r\n\r\n")
+        self.requests += 1
+        headers = f"HTTP/1.1 200 OK\r\nContent-Length: {len(ATTACHMENT)}\r\nConnection: close\r\n\r\n".encode()
+        body = ATTACHMENT[:len(ATTACHMENT) // 2] if self.requests <= self.drops else ATTACHMENT
+        writer.write(headers + body)
+        await writer.drain()
+        writer.close()
+
+class AsyncRelayRetryTest(unittest.TestCase):
+    def spool(self, drops: int):
+        async def run():
+            server = DroppingAttachmentServer(drops)
+            listener = await asyncio.start_server(server.handle, "127.0.0.1", 0)
+            port = listener.sockets[0].getsockname()[1]
+            instance = ConfluenceInstance({
+                'name': 'test', 'confluence_type': 'server', 'site_url': f'http://127.0.0.1:{port}',
+                'space_key': 'TEST', 'download_chunk_size': 1024, 'credentials': {'rest_auth_type': 'basic_auth'}
+            })
+            api_config = {**API_CONFIG, 'retry': {'default': {'max_retries': 2, 'backoff_factor': 0}}}
+            try:
+                async with AsyncConfluenceAPIClient(instance, api_config) as client:
+                    spool, size = await client.spool_attachment('123', 'file.bin')
+                    with spool:
+                        return server.requests, size, spool.read()
+            finally:
+                listener.close()
+                await listener.wait_closed()
+        return asyncio.run(run())
+
+    def test_body_cut_off_mid_transfer_is_downloaded_again_from_the_start(self):
+        requests, size, content = self.spool(drops=1)
+        self.assertEqual(requests, 2)
+        self.assertEqual(size, len(ATTACHMENT))
+        self.assertEqual(content, ATTACHMENT)
+
+    def test_body_cut_off_on_every_attempt_raises(self):
+        with self.assertRaises(Exception):
+            self.spool(drops=3)
+
+if __name__ == '__main__':
+    unittest.main()
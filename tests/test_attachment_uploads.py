@@ -0,0 +1,37 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from models.tree.attachment_node import ConfluenceAttachmentNode
+from models.tree.attachment_pipeline import attachment_uploads, unjournaled_attachments
+from models.tree.migration_journal import MigrationJournal
+
+def attachment(attachment_id: str, title: str, file_size: int) -> ConfluenceAttachmentNode:
+    return ConfluenceAttachmentNode.from_api_response({
+        'id': attachment_id, 'type': 'attachment', 'status': 'current', 'title': title,
+        'metadata': {'mediaType': 'image/png'}, 'extensions': {'fileSize': file_size}, '_links': {}
+    })
+
+class AttachmentUploadsTest(unittest.TestCase):
+    def setUp(self):
+        journal_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(journal_dir.cleanup)
+        self.journal = MigrationJournal(str(Path(journal_dir.name) / "journal.sqlite"))
+        self.addCleanup(self.journal.close)
+
+    def test_only_new_and_changed_attachments_are_uploaded(self):
+        attachments = [attachment('1', 'same.png', 10), attachment('2', 'changed.png', 12), attachment('3', 'new.png', 5)]
+        target_attachments = {'same.png': attachment('11', 'same.png', 10), 'changed.png': attachment('12', 'changed.png', 11)}
+
+        uploads = attachment_uploads(attachments, target_attachments, '99', self.journal)
+
+        self.assertEqual([(upload.title, target_id) for upload, target_id in uploads], [('changed.png', '12'), ('new.png', None)])
+        # Unchanged attachments are journaled, the next run skips them without listing the target page
+        self.assertEqual([pending.title for pending in unjournaled_attachments(attachments, self.journal)], ['changed.png', 'new.png'])
+
+    def test_without_a_journal_every_attachment_is_pending(self):
+        attachments = [attachment('1', 'same.png', 10)]
+        self.assertEqual(unjournaled_attachments(attachments, None), attachments)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,128 @@
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+from api.client import ConfluenceAPIClient
+from config.config_types import ConfluenceInstance
+from models.tree.page_node import ConfluencePageNode
+from models.tree.tree import ConfluencePagesTree
+
+API_CONFIG = json.loads((Path(__file__).resolve().parent.parent / "confluence-api.json").read_text())
+SITE_URL = "http://confluence.test"
+# parent id -> child ids, 1 is the root page
+CHILDREN = {1: [2, 3], 2: [4, 5, 6], 3: [7], 4: [], 5: [8], 6: [], 7: [], 8: []}
+EMPTY_PAGE_ID = 6
+
+def body_of(page_id: int) -> str:
+    return "" if page_id == EMPTY_PAGE_ID else f"<p>Body {page_id}</p>"
+
+def page_data(page_id: int, expand: str) -> dict:
+    data = {
+        'id': str(page_id), 'type': 'page', 'status': 'current', 'title': f"Page {page_id}",
+        '_links': {'edit': f"/pages/resumedraft.action?draftId={page_id}", 'webui': f"/pages/viewpage.action?pageId={page_id}"}
+    }
+    fields = expand.split(',')
+    if 'version' in fields:
+        data['version'] = {'number': page_id + 10}
+    if 'metadata.labels' in fields:
+        data['metadata'] = {'labels': {'results': [{'name': f"label-{page_id}"}]}}
+    if 'body.storage' in fields:
+        data['body'] = {'storage': {'value': body_of(page_id), 'representation': 'storage'}}
+    return data
+
+class FakeConfluence:
+    """Stands in for Session.request, answers child listings and page requests and counts every request."""
+    def __init__(self):
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append((method, url, kwargs.get('params', {})))
+        path = url[len(SITE_URL):]
+        response = requests.Response()
+        response.url = url
+        response.headers['Content-Type'] = 'application/json'
+        parts = path.split('/')
+        page_id = int(parts[4]) if len(parts) > 4 and parts[4].isdigit() else None
+        if method != 'GET' or page_id not in CHILDREN:
+            response.status_code = 404
+            response._content = b'{}'
+            return response
+        expand = kwargs.get('params', {}).get('expand', '')
+        response.status_code = 200
+        if path.endswith('/child/page'):
+            response._content = json.dumps({'results': [page_data(child_id, expand) for child_id in CHILDREN[page_id]], '_links': {}}).encode()
+        else:
+            response._content = json.dumps(page_data(page_id, expand)).encode()
+        return response
+
+class FetchPagesRequestCountTest(unittest.TestCase):
+    def setUp(self):
+        instance = ConfluenceInstance({
+            'name': 'test', 'confluence_type': 'server', 'site_url': SITE_URL, 'space_key': 'TEST', 'root_page_id': '1',
+            'fetch_pages_limit': 25, 'credentials': {'rest_auth_type': 'basic_auth'}
+        })
+        self.client = ConfluenceAPIClient(instance, API_CONFIG)
+        self.client.initialize_session()
+        self.confluence = FakeConfluence()
+        patcher = mock.patch.object(requests.Session, 'request', side_effect=self.confluence.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def fetch_tree(self, with_bodies: bool) -> ConfluencePagesTree:
+        tree = ConfluencePagesTree(ConfluencePageNode('1', 'Page 1'), self.client)
+        tree.with_bodies = with_bodies
+        tree.fetch_pages(confluence_type='server')
+        return tree
+
+    def assert_one_listing_per_page(self, tree: ConfluencePagesTree, profile: str):
+        pages = tree.traverse_tree()
+        self.assertEqual(len(pages), len(CHILDREN))
+        # Every page, leaves included, is listed once for its children, nothing else is requested per page
+        self.assertEqual(len(self.confluence.requests), len(pages))
+        for method, url, params in self.confluence.requests:
+            self.assertEqual(method, 'GET')
+            self.assertTrue(url.endswith('/child/page'))
+            self.assertEqual(params['expand'], ConfluenceAPIClient.EXPAND_PROFILES[profile])
+        for page in pages[1:]:
+            self.assertEqual(page.version, page.id + 10)
+            self.assertEqual(page.labels, [f"label-{page.id}"])
+
+    def test_tree_with_bodies_profile_costs_one_request_per_page(self):
+        tree = self.fetch_tree(with_bodies=True)
+        self.assert_one_listing_per_page(tree, "tree_with_bodies")
+        # Empty pages included, the listed bodies are read without loading them again
+        for page in tree.traverse_tree()[1:]:
+            self.assertTrue(page.has_body())
+            self.assertEqual(page.body, body_of(page.id))
+        self.assertEqual(len(self.confluence.requests), len(CHILDREN))
+
+    def test_tree_metadata_profile_costs_one_request_per_page(self):
+        tree = self.fetch_tree(with_bodies=False)
+        self.assert_one_listing_per_page(tree, "tree_metadata")
+        self.assertFalse(any(page.has_body() for page in tree.traverse_tree()))
+
+    def test_cold_tree_cache_lists_the_bodies(self):
+        self.client.instance_config.use_tree_cache = True
+        with tempfile.TemporaryDirectory() as cache_dir:
+            for run in ("cold", "warm"):
+                self.confluence.requests.clear()
+                tree = ConfluencePagesTree(ConfluencePageNode('1', 'Page 1'), self.client)
+                tree.tree_cache_file = str(Path(cache_dir) / "tree.sqlite")
+                tree.build_tree(confluence_type='server')
+
+                # The root page and one listing per page, bodies are listed when cold and restored from the cache when warm
+                self.assertEqual(len(self.confluence.requests), len(CHILDREN) + 1, run)
+                self.assertEqual(self.confluence.requests[1][2]['expand'], ConfluenceAPIClient.EXPAND_PROFILES["tree_with_bodies" if run == "cold" else "tree_metadata"])
+                self.assertEqual([page.body for page in tree.traverse_tree()[1:]], [body_of(page.id) for page in tree.traverse_tree()[1:]])
+
+    def test_failed_listing_raises_instead_of_ending_early(self):
+        tree = ConfluencePagesTree(ConfluencePageNode('99', 'Missing page'), self.client)
+        with self.assertRaises(requests.exceptions.HTTPError):
+            tree.fetch_pages(confluence_type='server')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,34 @@
+import tempfile
+import unittest
+from pathlib import Path
+
+from models.tree.migration_journal import MigrationJournal
+
+class MigrationJournalTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.journal_file = str(Path(self.directory.name) / "journal.sqlite")
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def test_prune_forgets_steps_of_deleted_target_pages(self):
+        journal = MigrationJournal(self.journal_file)
+        journal.record(MigrationJournal.PAGE, 1, 101)
+        journal.record(MigrationJournal.LABELS, 1, 101)
+        journal.record(MigrationJournal.PAGE, 2, 102)
+        journal.record(MigrationJournal.BODY, 2, 102, item=7)
+
+        self.assertEqual(journal.prune(["102"]), 2)
+        self.assertIsNone(journal.lookup(MigrationJournal.PAGE, 1))
+        self.assertIsNone(journal.lookup(MigrationJournal.LABELS, 1))
+        self.assertEqual(journal.lookup(MigrationJournal.BODY, 2, 7), "102")
+        journal.close()
+
+        reopened = MigrationJournal(self.journal_file)
+        self.assertIsNone(reopened.lookup(MigrationJournal.PAGE, 1))
+        self.assertEqual(reopened.lookup(MigrationJournal.PAGE, 2), "102")
+        reopened.close()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import json
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+
+from api.client import ConfluenceAPIClient
+from config.config_types import ConfluenceInstance
+
+API_CONFIG = json.loads((Path(__file__).resolve().parent.parent / "confluence-api.json").read_text())
+SITE_URL = "http://confluence.test"
+
+class FakeContent:
+    """Stands in for Session.request, answers content requests of page 1 at its current version."""
+    def __init__(self):
+        self.version = 3
+        self.requests = []
+
+    def request(self, method, url, **kwargs):
+        self.requests.append(kwargs.get('params', {}))
+        response = requests.Response()
+        response.url = url
+        response.status_code = 200
+        response.headers['Content-Type'] = 'application/json'
+        data = {'id': '1', 'type': 'page', 'title': 'Page 1', 'version': {'number': self.version}}
+        if 'body.storage' in kwargs.get('params', {}).get('expand', ''):
+            data['body'] = {'storage': {'value': '<p>Body</p>', 'representation': 'storage'}}
+        response._content = json.dumps(data).encode()
+        return response
+
+class ResponseCacheTest(unittest.TestCase):
+    def setUp(self):
+        instance = ConfluenceInstance({
+            'name': 'test', 'confluence_type': 'server', 'site_url': SITE_URL, 'space_key': 'TEST', 'root_page_id': '1',
+            'credentials': {'rest_auth_type': 'basic_auth'}
+        })
+        self.client = ConfluenceAPIClient(instance, API_CONFIG)
+        self.client.initialize_session()
+        self.confluence = FakeContent()
+        patcher = mock.patch.object(requests.Session, 'request', side_effect=self.confluence.request)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_bodies_are_not_cached(self):
+        self.client.get_content(1, profile="page_body")
+        self.client.get_content(1, profile="page_body")
+
+        self.assertEqual(len(self.confluence.requests), 2)
+        self.assertEqual(self.client.response_cache.get_stats()['entries'], 0)
+
+    def test_expired_entries_are_revalidated_by_version(self):
+        with mock.patch('api.response_cache.time.monotonic', return_value=0):
+            self.client.get_content(1, expand=False)
+        # Past the ttl the entry is only served again once its version is confirmed
+        with mock.patch('api.response_cache.time.monotonic', return_value=1000):
+            self.client.get_content_version(1)
+            self.client.get_content(1, expand=False)
+
+        self.assertEqual(len(self.confluence.requests), 2)
+        self.assertEqual(self.client.response_cache.get_stats()['revalidations'], 1)
+
+    def test_entries_of_an_older_version_are_dropped(self):
+        self.client.get_content(1, expand=False)
+        self.confluence.version = 4
+
+        self.client.get_content_version(1)
+        response = self.client.get_content(1, expand=False)
+
+        self.assertEqual(len(self.confluence.requests), 3)
+        self.assertEqual(response.json()['version']['number'], 4)
+
+if __name__ == '__main__':
+    unittest.main()
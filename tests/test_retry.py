@@ -0,0 +1,54 @@
+import json
+import socket
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import requests
+import urllib3
+
+from api.client import ConfluenceAPIClient
+from api.retry import RetryPolicy
+from config.config_types import ConfluenceInstance
+
+API_CONFIG = json.loads((Path(__file__).resolve().parent.parent / "confluence-api.json").read_text())
+
+def unused_port() -> int:
+    with socket.socket() as listener:
+        listener.bind(("127.0.0.1", 0))
+        return listener.getsockname()[1]
+
+class RetryPolicyTest(unittest.TestCase):
+    def test_retry_after_is_honored_beyond_max_backoff(self):
+        policy = RetryPolicy({'max_backoff': 60, 'max_retry_after': 900})
+        self.assertEqual(policy.get_delay(0, "120"), 120.0)
+        self.assertEqual(policy.get_delay(0, "3600"), 900.0)
+        self.assertLessEqual(policy.get_delay(10), 60.0)
+
+class ConnectFailureRetryTest(unittest.TestCase):
+    def client(self, site_url: str) -> ConfluenceAPIClient:
+        instance = ConfluenceInstance({
+            'name': 'test', 'confluence_type': 'server', 'site_url': site_url, 'space_key': 'TEST',
+            'credentials': {'rest_auth_type': 'basic_auth'}
+        })
+        client = ConfluenceAPIClient(instance, {**API_CONFIG, 'retry': {'default': {'max_retries': 2, 'backoff_factor': 0}}})
+        client.initialize_session()
+        return client
+
+    def test_refused_post_is_retried(self):
+        client = self.client(f"http://127.0.0.1:{unused_port()}")
+        with self.assertRaises(requests.exceptions.ConnectionError) as raised:
+            client.api_request('POST', 'content', 'create', 'v1', data={'title': 'Page'})
+        self.assertTrue(ConfluenceAPIClient._is_connect_failure(raised.exception))
+        self.assertEqual(client.total_retries, 2)
+
+    def test_post_dropped_after_connecting_is_not_retried(self):
+        client = self.client("http://confluence.test")
+        dropped = requests.exceptions.ConnectionError(urllib3.exceptions.ProtocolError("Connection aborted."))
+        with mock.patch.object(requests.Session, 'request', side_effect=dropped) as request:
+            with self.assertRaises(requests.exceptions.ConnectionError):
+                client.api_request('POST', 'content', 'create', 'v1', data={'title': 'Page'})
+        self.assertEqual(request.call_count, 1)
+
+if __name__ == '__main__':
+    unittest.main()
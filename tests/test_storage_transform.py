@@ -0,0 +1,27 @@
+import unittest
+
+from api.storage_transform import StorageTransform
+
+class StorageTransformEntityTest(unittest.TestCase):
+    def test_html_entities_outside_cdata_become_characters(self):
+        result = StorageTransform().transform("<p>&copy;&nbsp;&amp;</p>")
+        self.assertTrue(result.valid)
+        self.assertEqual(result.body, "<p>© &amp;</p>")
+
+    def test_cdata_sections_are_kept_verbatim(self):
+        body = ('<p>&copy;</p><ac:structured-macro ac:name="code"><ac:plain-text-body>'
+                '<![CDATA[x = "&copy;" &nbsp; <b>]]></ac:plain-text-body></ac:structured-macro>')
+        result = StorageTransform().transform(body)
+        self.assertTrue(result.valid)
+        self.assertIn('<![CDATA[x = "&copy;" &nbsp; <b>]]>', result.body)
+        self.assertEqual(result.macros, ["code"])
+
+class StorageTransformReferenceTest(unittest.TestCase):
+    def test_attachments_of_other_pages_follow_the_space_key(self):
+        body = '<ac:image><ri:attachment ri:filename="a.png"><ri:page ri:space-key="SRC" ri:content-title="Other"/></ri:attachment></ac:image>'
+        result = StorageTransform(space_keys={"SRC": "TGT"}).transform(body)
+        # Attachments are copied under their own title, only the page that holds them is rewritten
+        self.assertEqual(result.body, body.replace('"SRC"', '"TGT"'))
+
+if __name__ == '__main__':
+    unittest.main()
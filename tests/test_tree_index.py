@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+from models.tree.page_node import ConfluencePageNode
+from models.tree.tree import ConfluencePagesTree
+
+def page(page_id: int) -> ConfluencePageNode:
+    return ConfluencePageNode(str(page_id), f"Page {page_id}")
+
+class TreeIndexTest(unittest.TestCase):
+    def setUp(self):
+        api_client = mock.MagicMock()
+        api_client.instance_config.body_store_dir = ""
+        self.tree = ConfluencePagesTree(page(1), api_client)
+        self.child = page(2)
+        self.tree._attach_pages([(self.tree.root, self.child), (self.tree.root, page(3))], [True, True])
+
+    def test_counts_and_lookups_follow_attached_pages(self):
+        self.assertEqual(self.tree.fetch_total_nodes(), 3)
+        self.assertEqual(self.tree.count_children(), 2)
+        self.assertIsNone(self.tree.get_node(4))
+
+        self.tree._attach_pages([(self.child, page(4)), (self.child, page(5))], [True, False])
+
+        self.assertEqual(self.tree.fetch_total_nodes(), 4)
+        self.assertEqual(self.tree.count_children(), 3)
+        self.assertEqual(self.tree.count_children(self.child), 1)
+        self.assertEqual(self.tree.get_node("4").title, "Page 4")
+        self.assertIs(self.tree.get_parent(4), self.child)
+        self.assertEqual(self.tree.get_depth(4), 2)
+        self.assertEqual(self.tree.get_subtree_size(1), 4)
+
+    def test_incremental_indexes_match_a_full_rebuild(self):
+        self.tree._attach_pages([(self.child, page(4)), (self.child, page(5))], [True, True])
+        indexes = (dict(self.tree.parent_by_id), dict(self.tree.depth_by_id), dict(self.tree.subtree_size_by_id))
+
+        self.tree.index_tree()
+
+        self.assertEqual(indexes, (self.tree.parent_by_id, self.tree.depth_by_id, self.tree.subtree_size_by_id))
+
+    def test_breadth_first_walks_level_by_level(self):
+        self.tree._attach_pages([(self.child, page(4))], [True])
+
+        self.assertEqual([node.id for node in self.tree.iter_bfs()], [1, 2, 3, 4])
+        self.assertEqual([[node.id for node in level] for level in self.tree.iter_levels()], [[1], [2, 3], [4]])
+
+    def test_rearranging_a_tree_re_indexes_it(self):
+        self.assertEqual(self.tree.fetch_total_nodes(), 3)
+        source_tree = ConfluencePagesTree(page(10), self.tree.api_client)
+        source_tree.root.add_child(ConfluencePageNode("11", "Page 3"))
+
+        self.tree.rearrange_trees(self.tree.root, source_tree.root)
+
+        self.assertEqual(self.tree.fetch_total_nodes(), 2)
+        self.assertIsNone(self.tree.get_node(2))
+
+    def test_child_index_keeps_the_sibling_order(self):
+        self.tree._attach_pages([(self.child, page(5)), (self.child, page(4))], [True, True])
+
+        child_index = self.tree.build_child_index()
+
+        self.assertEqual(len(child_index), 5)
+        self.assertIn(4, child_index)
+        self.assertEqual(list(child_index.children_of(1)), [2, 3])
+        self.assertEqual(list(child_index.children_of(2)), [5, 4])
+        self.assertEqual(list(child_index.children_of(3)), [])
+        with self.assertRaises(KeyError):
+            child_index.children_of(6)
+
+if __name__ == '__main__':
+    unittest.main()